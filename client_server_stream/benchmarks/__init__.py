@@ -0,0 +1 @@
+# client_server_stream/benchmarks/__init__.py
@@ -0,0 +1,62 @@
+# client_server_stream/benchmarks/envelope_bench.py
+"""
+Outbound envelope cost: validated build_message + json.dumps versus a
+per-stream EnvelopeTemplate that splices the payload into pre-encoded
+bytes.
+
+    python -m client_server_stream.benchmarks.envelope_bench
+"""
+import argparse
+import json
+import timeit
+import uuid
+
+from client_server_stream.server.protocol import Event, EnvelopeTemplate, build_message
+
+PAYLOADS = {
+    "token": " the",
+    "progress": {"current": 42, "total": 100, "percent": 42},
+}
+
+
+def run(iterations: int):
+    stream_id = str(uuid.uuid4())
+    message_id = uuid.uuid4().hex
+    template = EnvelopeTemplate(
+        stream_id=stream_id,
+        channel="homepage",
+        candidate_id="user1",
+        message_id=message_id,
+    )
+
+    print(f"{'payload':>10} {'build_message':>15} {'template':>10} {'speedup':>8}")
+    for name, payload in PAYLOADS.items():
+        data = {"payload": payload}
+
+        def baseline():
+            return json.dumps(build_message(
+                event=Event.STREAM_CHUNK,
+                stream_id=stream_id,
+                channel="homepage",
+                candidate_id="user1",
+                message_id=message_id,
+                data=data,
+                validate=True,
+            ))
+
+        def fast():
+            return template.encode(template.message(Event.STREAM_CHUNK, data))
+
+        assert baseline() == fast()
+
+        slow_ns = min(timeit.repeat(baseline, number=iterations, repeat=5)) / iterations * 1e9
+        fast_ns = min(timeit.repeat(fast, number=iterations, repeat=5)) / iterations * 1e9
+        print(f"{name:>10} {slow_ns:>13.0f}ns {fast_ns:>8.0f}ns {slow_ns / fast_ns:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    run(args.iterations)
@@ -0,0 +1,354 @@
+# client_server_stream/benchmarks/loadtest.py
+"""
+End-to-end load test against a local server.
+
+Starts `client_server_stream.server.app:app` under uvicorn on localhost
+(plus the mock upstream from mock_llm.py for `--plugin llm_demo`) as
+subprocesses, then drives it with `--producers` /ws clients that start
+streams back to back and `--observers` /observe sockets watching the
+producers' candidates. Reports throughput and end-to-end chunk latency
+(server emit -> client receive, from the meta.ts stamp the server adds
+when STREAM_STAMP_CHUNKS is set) and writes the results as JSON.
+
+    python -m client_server_stream.benchmarks.loadtest --plugin progress \\
+        --producers 6 --observers 100 --duration 20 --out progress.json
+    python -m client_server_stream.benchmarks.loadtest --plugin progress \\
+        --baseline progress.json
+
+Slots are limited per API key (`max_streams` in server/auth.py), so each
+producer opens a fresh connection per stream and producers are spread
+over the configured keys.
+
+Every stream gets a distinct payload (a nonce is added), so plugins with
+`cache_ttl` run each time instead of serving cache hits; pass
+`--same-payload` to measure the cached / shared path instead.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import websockets
+
+from client_server_stream.server.auth import VALID_API_KEYS
+from client_server_stream.server.protocol import PROTOCOL_VERSION
+
+API_KEYS = list(VALID_API_KEYS)
+CANDIDATES = [VALID_API_KEYS[key]["client"] for key in API_KEYS]
+
+DEFAULT_PAYLOADS = {
+    "text": "bench",
+    "progress": {"total": 200, "delay": 0.005},
+    "llm_demo": "benchmark prompt",
+}
+
+
+# ----------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.frames = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def record(self, raw, msg):
+        now = time.time()
+        self.frames += 1
+        self.bytes += len(raw)
+
+        data = msg.get("data") or {}
+        self.chunks += len(data["payloads"]) if "payloads" in data else 1
+
+        ts = (msg.get("meta") or {}).get("ts")
+        if ts is not None:
+            self.latencies.append(now - ts)
+
+    def summary(self, elapsed: float) -> dict:
+        lat = sorted(self.latencies)
+
+        def pct(q):
+            if not lat:
+                return None
+            return lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+
+        return {
+            "frames": self.frames,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "chunks_per_s": self.chunks / elapsed if elapsed else 0.0,
+            "bytes_per_s": self.bytes / elapsed if elapsed else 0.0,
+            "latency_ms": {
+                "p50": pct(0.50),
+                "p99": pct(0.99),
+                "p999": pct(0.999),
+                "max": lat[-1] * 1000 if lat else None,
+                "samples": len(lat),
+            },
+        }
+
+
+class StreamCounts:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.errors = 0
+
+
+# ----------------------------------------------------------------------
+# Clients
+# ----------------------------------------------------------------------
+
+def unique_payload(payload):
+    """
+    `payload` made distinct per stream, so the stream cache never matches.
+    """
+    nonce = uuid.uuid4().hex
+    if isinstance(payload, dict):
+        return {**payload, "nonce": nonce}
+    if isinstance(payload, str):
+        return f"{payload} [{nonce}]"
+    return payload
+
+async def producer(idx, base_url, plugin, payload, deadline, recorder, counts, same_payload=False):
+    api_key = API_KEYS[idx % len(API_KEYS)]
+    url = f"{base_url}/ws?api_key={api_key}"
+
+    while time.monotonic() < deadline:
+        stream_id = str(uuid.uuid4())
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps({
+                "protocol": PROTOCOL_VERSION,
+                "event": "stream.start",
+                "stream_id": stream_id,
+                "channel": "bench",
+                "plugin": plugin,
+                "data": {"payload": payload if same_payload else unique_payload(payload)},
+                "meta": {},
+            }))
+            counts.started += 1
+
+            async for raw in ws:
+                msg = json.loads(raw)
+                event = msg.get("event")
+
+                if event == "error":
+                    counts.errors += 1
+                    await asyncio.sleep(0.05)
+                    break
+                if msg.get("stream_id") != stream_id:
+                    continue
+                if event == "stream.chunk":
+                    recorder.record(raw, msg)
+                elif event == "stream.end":
+                    counts.completed += 1
+                    break
+
+
+async def observer(idx, base_url, stop, recorder, ready):
+    candidate = CANDIDATES[idx % len(CANDIDATES)]
+    async with websockets.connect(f"{base_url}/observe?candidate_id={candidate}", max_size=None) as ws:
+        ready()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            msg = json.loads(raw)
+            if msg.get("event") == "stream.chunk":
+                recorder.record(raw, msg)
+
+
+# ----------------------------------------------------------------------
+# Processes
+# ----------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_http(port: int, path: str, timeout: float = 15.0, method: str = "GET"):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+            status = await reader.readline()
+            writer.close()
+            if status:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"port {port} did not come up")
+
+
+@contextlib.contextmanager
+def spawn(args, env=None):
+    proc = subprocess.Popen([sys.executable, "-m", *args], env={**os.environ, **(env or {})})
+    try:
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ----------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------
+
+async def run_load(base_url, args, payload) -> dict:
+    produced, observed = Recorder(), Recorder()
+    counts = StreamCounts()
+
+    stop = asyncio.Event()
+    connected = 0
+    all_ready = asyncio.Event()
+
+    def ready():
+        nonlocal connected
+        connected += 1
+        if connected >= args.observers:
+            all_ready.set()
+
+    observers = [
+        asyncio.create_task(observer(i, base_url, stop, observed, ready))
+        for i in range(args.observers)
+    ]
+    if args.observers:
+        await asyncio.wait_for(all_ready.wait(), 30)
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    producers = [
+        asyncio.create_task(producer(i, base_url, args.plugin, payload, deadline, produced, counts, args.same_payload))
+        for i in range(args.producers)
+    ]
+    await asyncio.gather(*producers)
+    elapsed = time.monotonic() - start
+
+    # let observers drain what is still in flight
+    await asyncio.sleep(args.drain)
+    stop.set()
+    await asyncio.gather(*observers, return_exceptions=True)
+
+    return {
+        "elapsed_s": elapsed,
+        "streams": vars(counts),
+        "producers": produced.summary(elapsed),
+        "observers": observed.summary(elapsed),
+    }
+
+
+async def main_async(args) -> dict:
+    payload = json.loads(args.payload) if args.payload else DEFAULT_PAYLOADS[args.plugin]
+
+    if args.server_url:
+        return await run_load(args.server_url, args, payload)
+
+    with contextlib.ExitStack() as stack:
+        env = {"STREAM_STAMP_CHUNKS": "1", "STREAM_LOG_LEVEL": "WARNING"}
+
+        if args.plugin == "llm_demo":
+            mock_port = free_port()
+            stack.enter_context(spawn([
+                "client_server_stream.benchmarks.mock_llm",
+                "--port", str(mock_port),
+                "--rate", str(args.token_rate),
+                "--tokens", str(args.tokens),
+            ]))
+            await wait_http(mock_port, "/generate", method="POST")
+            env["LLM_DEMO_URL"] = f"http://127.0.0.1:{mock_port}/generate"
+
+        port = free_port()
+        stack.enter_context(spawn([
+            "uvicorn", "client_server_stream.server.app:app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ], env))
+        await wait_http(port, "/health")
+
+        return await run_load(f"ws://127.0.0.1:{port}", args, payload)
+
+
+def compare(result: dict, baseline: dict) -> None:
+    def delta(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print("\nvs baseline:")
+    for side in ("producers", "observers"):
+        new, old = result[side], baseline[side]
+        print(f"  {side:<10} chunks/s {delta(new['chunks_per_s'], old['chunks_per_s'])}", end="")
+        for q in ("p50", "p99", "p999"):
+            print(f"  {q} {delta(new['latency_ms'][q], old['latency_ms'][q])}", end="")
+        print()
+
+
+def report(result: dict) -> None:
+    s = result["streams"]
+    print(f"streams: started={s['started']} completed={s['completed']} errors={s['errors']} "
+          f"in {result['elapsed_s']:.1f}s")
+    for side in ("producers", "observers"):
+        r = result[side]
+        lat = r["latency_ms"]
+        fmt = lambda v: "-" if v is None else f"{v:.2f}"
+        print(
+            f"{side:<10} {r['chunks_per_s']:>10.0f} chunks/s {r['bytes_per_s'] / 1e6:>8.2f} MB/s  "
+            f"p50={fmt(lat['p50'])}ms p99={fmt(lat['p99'])}ms p999={fmt(lat['p999'])}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--plugin", choices=sorted(DEFAULT_PAYLOADS), default="progress")
+    parser.add_argument("--payload", help="JSON payload (defaults per plugin)")
+    parser.add_argument(
+        "--same-payload", action="store_true",
+        help="send the same payload on every stream (measures stream cache hits)",
+    )
+    parser.add_argument("--producers", type=int, default=3)
+    parser.add_argument("--observers", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to keep starting streams")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds observers wait after the last stream")
+    parser.add_argument("--token-rate", type=float, default=50, help="mock upstream tokens/s (llm_demo)")
+    parser.add_argument("--tokens", type=int, default=64, help="mock upstream tokens per generation (llm_demo)")
+    parser.add_argument("--server-url", help="use a running server (ws://host:port) instead of spawning one")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON of a previous run to compare against")
+    args = parser.parse_args()
+
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "timestamp": time.time(),
+        **asyncio.run(main_async(args)),
+    }
+
+    report(result)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# client_server_stream/benchmarks/mock_llm.py
+"""
+Local stand-in for the llm_demo generation service.
+
+POST /generate {"prompt": ...} streams `tokens` short text chunks at
+`rate` tokens per second (0 = as fast as possible) over a chunked HTTP
+response, like the real upstream.
+
+    python -m client_server_stream.benchmarks.mock_llm --port 8100 --rate 50
+"""
+import argparse
+import asyncio
+import json
+
+import uvicorn
+
+WORDS = ("the", "quick", "brown", "fox", "jumps", "over", "a", "lazy", "dog")
+
+
+class MockLLM:
+    """
+    Raw ASGI app so the mock adds no framework overhead of its own.
+    """
+
+    def __init__(self, rate: float = 50, tokens: int = 64):
+        self.rate = rate
+        self.tokens = tokens
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        try:
+            tokens = int(json.loads(body or b"{}").get("tokens", self.tokens))
+        except (ValueError, AttributeError):
+            tokens = self.tokens
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        })
+
+        delay = 1 / self.rate if self.rate > 0 else 0
+        for i in range(tokens):
+            word = WORDS[i % len(WORDS)]
+            await send({"type": "http.response.body", "body": f" {word}".encode(), "more_body": True})
+            await asyncio.sleep(delay)
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--rate", type=float, default=50, help="tokens per second per stream")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per generation")
+    args = parser.parse_args()
+
+    uvicorn.run(MockLLM(args.rate, args.tokens), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
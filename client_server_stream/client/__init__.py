@@ -1,3 +1,4 @@
 from .client import StreamClient
+from .transport import StreamError, StreamInterrupted
 
-__all__ = ["StreamClient"]
+__all__ = ["StreamClient", "StreamError", "StreamInterrupted"]
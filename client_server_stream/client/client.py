@@ -1,14 +1,63 @@
 import asyncio
-from typing import Any, Callable, Optional, AsyncIterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, AsyncIterator
 
-from .transport import StreamTransport
+from .pool import TransportPool
+from .transport import DEFAULT_WINDOW, StreamTransport
 
 
 OnChunk = Callable[[Any], None]
+OnChunks = Callable[[List[Any]], None]
 OnEnd = Callable[[], None]
 OnError = Callable[[Exception], None]
 
 
+class _ExecutorDispatch:
+    """
+    Runs one stream's callbacks on an executor, one at a time and in
+    order, fed through a bounded handoff queue. A full queue holds the
+    stream back (and with it the credit returned to the server).
+    """
+
+    def __init__(self, executor: Executor, maxsize: int):
+        self._executor = executor
+        self._queue = asyncio.Queue(maxsize)
+        self._task = asyncio.create_task(self._run())
+        self.error: Optional[BaseException] = None
+
+    async def __call__(self, fn, *args):
+        if self.error is not None:
+            raise self.error
+        await self._queue.put((fn, args))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # an earlier callback failed; drop the rest
+                continue
+            fn, args = item
+            try:
+                await loop.run_in_executor(self._executor, fn, *args)
+            except Exception as e:
+                self.error = e
+
+    async def run(self, fn, *args):
+        # bypasses the queue, for the final on_error after close()
+        await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def close(self):
+        await self._queue.put(None)
+        await self._task
+
+
+async def _call_inline(fn, *args):
+    fn(*args)
+
+
 class StreamClient:
     """
     PUBLIC client API.
@@ -18,8 +67,28 @@ class StreamClient:
     2. Async iteration (legacy / internal) ⚠️ temporary
     """
 
-    def __init__(self, url: str, api_key: Optional[str] = None):
-        self._transport = StreamTransport(url, api_key)
+    def __init__(
+        self,
+        url: str,
+        api_key: Optional[str] = None,
+        codecs: Optional[Iterable[str]] = None,
+        connections: int = 1,
+        callback_workers: int = 4,
+        compact: bool = False,
+    ):
+        # `codecs` restricts/orders the wire codecs offered to the server,
+        # e.g. ["streamkit.msgpack", "streamkit.json"]
+        # `connections` > 1 spreads streams over a pool of WebSockets,
+        # each with its own receiver, by load
+        # `compact` asks for compact chunk frames (server/compact.py)
+        if connections > 1:
+            self._transport = TransportPool(url, api_key, codecs=codecs, size=connections, compact=compact)
+        else:
+            self._transport = StreamTransport(url, api_key, codecs=codecs, compact=compact)
+
+        # threads for dispatch="executor" callbacks, created on first use
+        self._callback_workers = callback_workers
+        self._callback_executor: Optional[Executor] = None
 
     # ------------------------------------------------------------------
     # NEW: ADDON-STYLE PUSH API (THIS IS STEP 5)
@@ -30,9 +99,15 @@ class StreamClient:
         *,
         channel: str,
         payload: Any,
-        on_chunk: OnChunk,
+        on_chunk: Optional[OnChunk] = None,
         on_end: Optional[OnEnd] = None,
         on_error: Optional[OnError] = None,
+        batch: Optional[Any] = None,
+        window: Optional[int] = DEFAULT_WINDOW,
+        window_bytes: Optional[int] = None,
+        on_chunks: Optional[OnChunks] = None,
+        dispatch: str = "loop",
+        handoff_size: int = 64,
     ) -> None:
         """
         Start a stream without exposing async iteration.
@@ -41,7 +116,26 @@ class StreamClient:
         - returns immediately
         - runs the stream in the background
         - pushes data via callbacks
+
+        `batch` (True or a dict of flush thresholds) asks the server to
+        coalesce chunks into fewer frames; callbacks still see one chunk
+        at a time.
+
+        `window` / `window_bytes` bound how far the server may run ahead
+        of the callbacks (credit-based flow control; None disables).
+
+        `on_chunks` (instead of `on_chunk`) receives lists: every chunk
+        that arrived since its previous call.
+
+        `dispatch="executor"` runs the callbacks on the client's callback
+        threads instead of the event loop, so slow callbacks do not hold
+        up other streams. Each stream's callbacks still run one at a
+        time, in order, with at most `handoff_size` calls waiting.
         """
+        if (on_chunk is None) == (on_chunks is None):
+            raise ValueError("Pass exactly one of on_chunk / on_chunks")
+        if dispatch not in ("loop", "executor"):
+            raise ValueError(f"Unknown dispatch mode: {dispatch}")
 
         asyncio.create_task(
             self._run_stream(
@@ -50,6 +144,12 @@ class StreamClient:
                 on_chunk=on_chunk,
                 on_end=on_end,
                 on_error=on_error,
+                batch=batch,
+                window=window,
+                window_bytes=window_bytes,
+                on_chunks=on_chunks,
+                dispatch=dispatch,
+                handoff_size=handoff_size,
             )
         )
 
@@ -58,33 +158,67 @@ class StreamClient:
         *,
         channel: str,
         payload: Any,
-        on_chunk: OnChunk,
+        on_chunk: Optional[OnChunk],
         on_end: Optional[OnEnd],
         on_error: Optional[OnError],
+        batch: Optional[Any] = None,
+        window: Optional[int] = DEFAULT_WINDOW,
+        window_bytes: Optional[int] = None,
+        on_chunks: Optional[OnChunks] = None,
+        dispatch: str = "loop",
+        handoff_size: int = 64,
     ) -> None:
         """
         INTERNAL worker that consumes the transport stream
         and dispatches events to callbacks.
         """
+        if dispatch == "executor":
+            call = _ExecutorDispatch(self._executor(), handoff_size)
+        else:
+            call = _call_inline
+        deliver = on_chunks or on_chunk
+
+        error = None
         try:
             await self._transport.connect()
 
             async for item in self._transport.open_stream(
                 channel=channel,
                 payload=payload,
+                batch=batch,
+                window=window,
+                window_bytes=window_bytes,
+                batched=on_chunks is not None,
             ):
-                on_chunk(item)
+                await call(deliver, item)
 
             if on_end:
-                on_end()
+                await call(on_end)
 
         except Exception as e:
+            error = e
+
+        if call is not _call_inline:
+            # let queued callbacks finish; a failure among them counts
+            # as the stream's error
+            await call.close()
+            error = error or call.error
+            call = call.run
+
+        if error is not None:
             if on_error:
-                on_error(e)
+                await call(on_error, error)
             else:
                 # Fail silently by default (addon-friendly behavior)
                 pass
 
+    def _executor(self) -> Executor:
+        if self._callback_executor is None:
+            self._callback_executor = ThreadPoolExecutor(
+                self._callback_workers, thread_name_prefix="streamkit-callback"
+            )
+        return self._callback_executor
+
     # ------------------------------------------------------------------
     # LEGACY API (KEEP FOR NOW — DO NOT REMOVE YET)
     # ------------------------------------------------------------------
@@ -100,5 +234,16 @@ class StreamClient:
         ):
             yield item
 
+    def stats(self) -> dict:
+        """
+        Per-connection stats: streams, queued chunks, reconnects, RTT.
+        """
+        if isinstance(self._transport, TransportPool):
+            return self._transport.stats()
+        return {"connections": [self._transport.stats()]}
+
     async def close(self):
         await self._transport.close()
+        if self._callback_executor is not None:
+            self._callback_executor.shutdown(wait=False)
+            self._callback_executor = None
@@ -0,0 +1,61 @@
+import asyncio
+from typing import AsyncIterator, Iterable, List, Optional
+
+from .transport import StreamTransport
+
+
+class TransportPool:
+    """
+    INTERNAL: K transports (WebSocket connections, each with its own
+    receiver) behind the StreamTransport interface.
+
+    Every new stream goes to the connection with the fewest streams,
+    ties broken by the fewest queued chunks. Connections reconnect and
+    settle their streams on their own (see StreamTransport).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        api_key: Optional[str] = None,
+        codecs: Optional[Iterable[str]] = None,
+        size: int = 4,
+        **transport_options,
+    ):
+        if size < 1:
+            raise ValueError("size must be >= 1")
+        self.transports: List[StreamTransport] = [
+            StreamTransport(url, api_key, codecs, **transport_options) for _ in range(size)
+        ]
+        # streams handed to each transport, counted from the moment they
+        # are assigned (a transport only sees them once they start)
+        self._load = [0] * size
+
+    async def connect(self):
+        await asyncio.gather(*(t.connect() for t in self.transports))
+
+    def _pick(self) -> int:
+        return min(
+            range(len(self.transports)),
+            key=lambda i: (self._load[i], self.transports[i].queued),
+        )
+
+    async def open_stream(self, **kwargs) -> AsyncIterator:
+        index = self._pick()
+        self._load[index] += 1
+        try:
+            async for item in self.transports[index].open_stream(**kwargs):
+                yield item
+        finally:
+            self._load[index] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "connections": [
+                {**t.stats(), "assigned": load}
+                for t, load in zip(self.transports, self._load)
+            ],
+        }
+
+    async def close(self):
+        await asyncio.gather(*(t.close() for t in self.transports))
@@ -1,10 +1,15 @@
 import asyncio
-import json
+import logging
+import random
+import time
 import uuid
-from typing import AsyncIterator, Optional
+from typing import AsyncIterator, Iterable, Optional
 
 import websockets
 
+from client_server_stream.server.batching import chunk_size
+from client_server_stream.server.codec import get_codec, subprotocols
+from client_server_stream.server.compact import Expander
 from client_server_stream.server.protocol import (
     Event,
     build_message,
@@ -13,26 +18,124 @@ from client_server_stream.server.protocol import (
 
 _STREAM_END = object()
 
+# Chunks a stream may have in flight (sent but not yet consumed) by default
+DEFAULT_WINDOW = 64
+
+log = logging.getLogger(__name__)
+
+
+class StreamError(Exception):
+    """Raised by a stream the server answered with an error event."""
+
+    def __init__(self, stream_id: str, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.stream_id = stream_id
+        self.code = code
+
+
+class StreamInterrupted(ConnectionError):
+    """
+    Raised by a stream whose connection dropped after it had delivered
+    chunks; it cannot be resumed transparently.
+    """
+
+    def __init__(self, stream_id: str, received: int):
+        super().__init__(f"Connection lost after {received} chunks of stream {stream_id}")
+        self.stream_id = stream_id
+        self.received = received
+
+
+class _Disconnected:
+    __slots__ = ("error",)
+
+    def __init__(self, error: Optional[BaseException]):
+        self.error = error
+
+
+class _Stream:
+    """
+    Client-side state of one open stream.
+    """
+
+    __slots__ = ("stream_id", "queue", "limit", "received", "generation")
+
+    def __init__(self, stream_id: str, limit: int):
+        self.stream_id = stream_id
+        # bounded by the credit window (limit=0: unbounded); never put to
+        # with a blocking call, so that end/disconnect markers always fit
+        self.queue = asyncio.Queue()
+        self.limit = limit
+        self.received = 0
+        # connection the stream was started on
+        self.generation = 0
+
 
 class StreamTransport:
     """
     INTERNAL transport layer.
 
     Responsibilities:
-    - WebSocket connection management
+    - WebSocket connection management, reconnecting with exponential
+      backoff
     - Protocol send/receive
     - Stream multiplexing by stream_id
+    - Wire codec negotiation (see server/codec.py)
+    - Credit-based flow control (see server/flow_control.py)
+    - Optional compact chunk frames (see server/compact.py), expanded
+      back into regular messages on receipt
+
+    When the connection drops, every stream on it is settled: streams
+    that have not delivered a chunk yet are started again on a new
+    connection, the others raise StreamInterrupted.
     """
 
-    def __init__(self, url: str, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        url: str,
+        api_key: Optional[str] = None,
+        codecs: Optional[Iterable[str]] = None,
+        *,
+        max_attempts: int = 6,
+        backoff_initial: float = 0.2,
+        backoff_max: float = 10.0,
+        ping_interval: Optional[float] = 10.0,
+        compact: bool = False,
+    ):
         self._url = url
         self._api_key = api_key
+        self.compact = compact
+        # subprotocols to offer, most preferred first (None = all available)
+        self._subprotocols = subprotocols(codecs)
+        self._codec = get_codec(None)
+
+        # connect attempts per (re)connect, delay doubling from
+        # backoff_initial up to backoff_max (with jitter)
+        self.max_attempts = max_attempts
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.ping_interval = ping_interval
 
         self._ws = None
+        self._generation = 0
         self._receiver_task = None
-        self._streams: dict[str, asyncio.Queue] = {}
+        self._ping_task = None
+        self._streams: dict[str, _Stream] = {}
         self._lock = asyncio.Lock()
 
+        # stats
+        self.reconnects = 0
+        self.frames = 0
+        self.rtt: Optional[float] = None
+        self.rtt_avg: Optional[float] = None
+
+    @property
+    def active_streams(self) -> int:
+        return len(self._streams)
+
+    @property
+    def queued(self) -> int:
+        return sum(s.queue.qsize() for s in self._streams.values())
+
     async def connect(self):
         async with self._lock:
             if self._ws is None:
@@ -40,17 +143,46 @@ class StreamTransport:
                 if self._api_key:
                     sep = "&" if "?" in url else "?"
                     url = f"{url}{sep}api_key={self._api_key}"
+                if self.compact:
+                    sep = "&" if "?" in url else "?"
+                    url = f"{url}{sep}compact=1"
 
-                self._ws = await websockets.connect(url)
+                self._ws = await self._dial(url)
+                self._codec = get_codec(self._ws.subprotocol)
+                if self._generation:
+                    self.reconnects += 1
+                self._generation += 1
 
             if self._receiver_task is None or self._receiver_task.done():
-                self._receiver_task = asyncio.create_task(self._receiver_loop())
+                self._receiver_task = asyncio.create_task(self._receiver_loop(self._ws, self._generation))
+            if self.ping_interval and (self._ping_task is None or self._ping_task.done()):
+                self._ping_task = asyncio.create_task(self._ping_loop(self._ws))
+
+    async def _dial(self, url):
+        delay = self.backoff_initial
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await websockets.connect(url, subprotocols=self._subprotocols)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                if attempt == self.max_attempts:
+                    raise ConnectionError(f"Could not connect to {self._url}: {e}") from e
+                log.info("connect attempt %d failed (%s), retrying in %.2fs", attempt, e, delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.backoff_max)
 
-    async def _receiver_loop(self):
+    async def _receiver_loop(self, ws, generation: int):
+        error = None
+        # handles are bound per connection
+        expander = Expander() if self.compact else None
         try:
-            async for raw in self._ws:
+            async for raw in ws:
+                self.frames += 1
                 try:
-                    msg = json.loads(raw)
+                    msg = self._codec.decode(raw)
+                    if expander is not None:
+                        msg = expander.expand(msg)
+                        if msg is None:
+                            continue
 
                     msg_type = msg.get("event")
                     stream_id = msg.get("stream_id")
@@ -59,54 +191,247 @@ class StreamTransport:
                     if not msg_type or not stream_id:
                         continue
 
-                    queue = self._streams.get(stream_id)
-                    if not queue:
+                    stream = self._streams.get(stream_id)
+                    if not stream:
                         continue
 
                     if msg_type == Event.STREAM_CHUNK.value:
-                        await queue.put(msg["data"]["payload"])
+                        data = msg["data"]
+                        # batched chunk: unpack in order
+                        payloads = data["payloads"] if "payloads" in data else (data["payload"],)
+                        for payload in payloads:
+                            # never block the receiver (it serves every
+                            # stream); a full queue means the server
+                            # ignored the credit window
+                            if stream.limit and stream.queue.qsize() >= stream.limit:
+                                log.warning("stream %s exceeded its credit window, chunk dropped", stream_id)
+                                continue
+                            stream.queue.put_nowait(payload)
 
                     elif msg_type == Event.STREAM_END.value:
-                        await queue.put(_STREAM_END)
+                        stream.queue.put_nowait(_STREAM_END)
+                        self._streams.pop(stream_id, None)
+
+                    elif msg_type == Event.ERROR.value:
+                        data = msg.get("data") or {}
+                        stream.queue.put_nowait(StreamError(stream_id, data.get("code"), data.get("message")))
                         self._streams.pop(stream_id, None)
 
                 except Exception as e:
-                    print("[StreamTransport] receiver error:", e)
+                    log.warning("receiver error: %s", e)
 
         except Exception as e:
-            print("[StreamTransport] receiver loop stopped:", e)
+            error = e
+            log.info("receiver loop stopped: %s", e)
         finally:
             # force reconnect on next use
-            self._ws = None
+            if self._ws is ws:
+                self._ws = None
+            if self._ping_task is not None:
+                self._ping_task.cancel()
+
+            # settle every stream that was running on this connection
+            lost = _Disconnected(error)
+            for stream in list(self._streams.values()):
+                if stream.generation == generation:
+                    stream.queue.put_nowait(lost)
 
-    async def open_stream(self, *, channel: str, payload) -> AsyncIterator:
+    async def _ping_loop(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            started = time.perf_counter()
+            try:
+                pong = await ws.ping()
+                await asyncio.wait_for(pong, self.ping_interval)
+            except asyncio.TimeoutError:
+                log.info("ping timed out after %.1fs", self.ping_interval)
+                continue
+            except Exception:
+                return
+
+            self.rtt = time.perf_counter() - started
+            self.rtt_avg = self.rtt if self.rtt_avg is None else 0.8 * self.rtt_avg + 0.2 * self.rtt
+
+    async def _send(self, message) -> None:
+        ws = self._ws
+        if ws is None:
+            raise ConnectionError("not connected")
+        await ws.send(self._codec.encode(message))
+
+    async def _start(self, stream: _Stream, start_message) -> None:
+        """
+        (Re)send stream.start, reconnecting first if needed.
+        """
         await self.connect()
+        stream.generation = self._generation
+        self._streams[stream.stream_id] = stream
+        try:
+            await self._send(start_message)
+        except websockets.ConnectionClosed:
+            # the receiver settles the stream with the rest of the connection
+            pass
 
+    async def open_stream(
+        self,
+        *,
+        channel: str,
+        payload,
+        batch=None,
+        window: Optional[int] = DEFAULT_WINDOW,
+        window_bytes: Optional[int] = None,
+        restarts: int = 3,
+        batched: bool = False,
+    ) -> AsyncIterator:
+        """
+        Start a stream and iterate its chunks.
+
+        `window` / `window_bytes` cap how many chunks / payload bytes the
+        server may send ahead of the consumer; credit is granted back as
+        the consumer drains the queue. Both None disables flow control.
+
+        With `batched`, yields lists instead: everything that arrived
+        since the previous item was taken.
+
+        If the connection drops before the first chunk, the stream is
+        started again on a new connection (up to `restarts` times);
+        after that it raises StreamInterrupted. A server error event
+        raises StreamError.
+        """
         stream_id = str(uuid.uuid4())
-        queue = asyncio.Queue()
-        self._streams[stream_id] = queue
+        meta = {}
+        if batch is not None:
+            meta["batch"] = batch
 
-        await self._ws.send(
-            json.dumps(
-                build_message(
-                    event=Event.STREAM_START,
-                    stream_id=stream_id,
-                    channel=channel,
-                    data={"payload": payload},
-                )
-            )
+        flow_control = bool(window or window_bytes)
+        if flow_control:
+            meta["credit"] = {}
+            if window:
+                meta["credit"]["chunks"] = window
+            if window_bytes:
+                meta["credit"]["bytes"] = window_bytes
+
+        # the server stays within the window, overshooting by at most one
+        # batched frame
+        stream = _Stream(stream_id, 2 * window if flow_control and window else 0)
+        start_message = build_message(
+            event=Event.STREAM_START,
+            stream_id=stream_id,
+            channel=channel,
+            data={"payload": payload},
+            meta=meta or None,
         )
 
+        consumed = consumed_bytes = 0
+        # end/error/disconnect marker met while draining a batch
+        held = None
+        # whether the server may still be running the stream
+        running = False
+
         try:
+            await self._start(stream, start_message)
+            running = True
+
             while True:
-                item = await queue.get()
+                if held is not None:
+                    item, held = held, None
+                else:
+                    item = await stream.queue.get()
                 if item is _STREAM_END:
+                    running = False
                     break
-                yield item
+
+                if isinstance(item, _Disconnected):
+                    if stream.received == 0 and restarts > 0:
+                        restarts -= 1
+                        log.info("stream %s lost its connection before the first chunk, restarting", stream_id)
+                        running = False
+                        await self._start(stream, start_message)
+                        running = True
+                        continue
+                    running = False
+                    raise StreamInterrupted(stream_id, stream.received) from item.error
+
+                if isinstance(item, StreamError):
+                    running = False
+                    raise item
+
+                if batched:
+                    items = [item]
+                    queue = stream.queue
+                    while not queue.empty():
+                        item = queue.get_nowait()
+                        if item is _STREAM_END or isinstance(item, (_Disconnected, StreamError)):
+                            held = item
+                            break
+                        items.append(item)
+                    stream.received += len(items)
+                    yield items
+                else:
+                    items = (item,)
+                    stream.received += 1
+                    yield item
+
+                if not flow_control:
+                    continue
+
+                # Hand back credit once half a window has been consumed
+                consumed += len(items)
+                if window_bytes:
+                    consumed_bytes += sum(chunk_size(i) for i in items)
+                if (window and consumed >= max(1, window // 2)) or (
+                    window_bytes and consumed_bytes >= max(1, window_bytes // 2)
+                ):
+                    await self._grant(stream_id, channel, consumed, consumed_bytes)
+                    consumed = consumed_bytes = 0
         finally:
-            self._streams.pop(stream_id, None)
+            if self._streams.get(stream_id) is stream:
+                del self._streams[stream_id]
+            # the consumer stopped early: free the server's slot rather
+            # than leave the stream waiting for credit
+            if running:
+                await self._cancel(stream_id, channel)
+
+    async def _cancel(self, stream_id: str, channel: str):
+        try:
+            await self._send(
+                build_message(
+                    event=Event.STREAM_CANCEL,
+                    stream_id=stream_id,
+                    channel=channel,
+                )
+            )
+        except Exception as e:
+            log.info("cancel of stream %s not sent: %s", stream_id, e)
+
+    async def _grant(self, stream_id: str, channel: str, chunks: int, nbytes: int):
+        try:
+            await self._send(
+                build_message(
+                    event=Event.STREAM_CREDIT,
+                    stream_id=stream_id,
+                    channel=channel,
+                    data={"chunks": chunks, "bytes": nbytes},
+                )
+            )
+        except Exception as e:
+            log.info("credit for stream %s not sent: %s", stream_id, e)
+
+    def stats(self) -> dict:
+        queues = [s.queue.qsize() for s in self._streams.values()]
+        return {
+            "connected": self._ws is not None,
+            "streams": len(queues),
+            "queued": sum(queues),
+            "max_queued": max(queues, default=0),
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+            "rtt_ms": None if self.rtt is None else self.rtt * 1000,
+            "rtt_avg_ms": None if self.rtt_avg is None else self.rtt_avg * 1000,
+        }
 
     async def close(self):
+        if self._ping_task is not None:
+            self._ping_task.cancel()
         if self._ws:
             await self._ws.close()
             self._ws = None
@@ -1,52 +1,185 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 import asyncio
-import traceback
+import logging
+import signal
 import uuid
-from .protocol import validate_message, error_message, Event, build_message
-from .auth import authenticate, AuthError
-from .rate_limit import StreamRateLimiter, RateLimitError
+from contextlib import asynccontextmanager
+from .protocol import validate_message, error_message, Event, build_message, ProtocolError
+from .codec import JSON, Codec, negotiate
+from .auth import authenticate, AuthError, keystore
+from .rate_limit import RateLimitError, create_limiter
 from .stream_manager import StreamManager
+from .stream_registry import StreamRegistry
+from .flow_control import CreditWindow
+from .batching import BatchPolicy
 from .channel_router import router
-app = FastAPI()
+from .subscriber import OverflowPolicy, SendPolicy
+from .topics import WILDCARD, PatternError
+from .log import Sampler, configure_logging
+from .metrics import REGISTRY, gauge
+from . import settings
+
+configure_logging()
+log = logging.getLogger(__name__)
+_receive_sample = Sampler()
+
+limiter = create_limiter(settings.LIMITER_BACKEND)
+# a producer must never silently lose its own chunks: one that stops
+# reading is closed (1013) instead, whatever its channels' policies
+producer_policy = SendPolicy(settings.SEND_QUEUE_SIZE, OverflowPolicy.DISCONNECT)
+# running producer streams and their slots
+registry = StreamRegistry(limiter, router)
 manager = StreamManager()
-limiter = StreamRateLimiter()
+
+
+def _reload_plugins():
+    async def reload():
+        outcome = await manager.plugins.reload()
+        log.info("plugin reload: %s", outcome or "nothing changed")
+
+    asyncio.create_task(reload())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await router.start()
+    await limiter.start()
+    await registry.start()
+    await keystore.start()
+    await manager.startup()
+
+    # SIGHUP hot-reloads changed plugins (not available on Windows)
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, _reload_plugins)
+        reload_signal = True
+    except (AttributeError, NotImplementedError, RuntimeError):
+        reload_signal = False
+
+    try:
+        yield
+    finally:
+        if reload_signal:
+            loop.remove_signal_handler(signal.SIGHUP)
+        await manager.shutdown()
+        await keystore.close()
+        await registry.close()
+        await limiter.close()
+        await router.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+gauge("streamkit_router_subscribers", "Sockets attached to the router", fn=lambda: len(router.subscribers))
+gauge("streamkit_router_queued_frames", "Frames waiting in send queues", fn=lambda: router.stats()["queued"])
+gauge("streamkit_router_dropped_frames", "Frames dropped by overflow policies", fn=lambda: router.stats()["dropped"])
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/stats")
+def stats():
+    return {
+        "router": router.stats(),
+        "router_backend": router.backend.stats(),
+        "auth": keystore.stats(),
+        "plugins": manager.plugins.stats(),
+        "stream_cache": manager.cache.stats(),
+        "quotas": manager.quotas.stats(),
+        "streams": registry.stats(),
+        "scheduler": manager.scheduler.stats(),
+    }
+
+
+@app.get("/streams")
+def streams():
+    """
+    Running producer streams with their age, chunk count and bytes sent.
+    """
+    return {**registry.stats(), "streams": registry.list()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return REGISTRY.render()
+
+
+async def _accept(ws: WebSocket) -> Codec:
+    """
+    Accept a socket with the best codec the client offered as a
+    subprotocol (plain JSON when it offered none).
+    """
+    codec = negotiate(ws.scope.get("subprotocols", ()))
+    await ws.accept(subprotocol=codec.name if codec else None)
+    return codec or JSON
+
+
+def _compact(ws: WebSocket) -> bool:
+    """
+    Whether the socket asked for compact chunk frames (compact=1).
+    """
+    return ws.query_params.get("compact", "") not in ("", "0", "false")
+
+
+async def _receive(ws: WebSocket, codec: Codec):
+    """
+    Receive one frame and decode it with the connection's codec.
+    Returns None for frames that cannot be decoded.
+    """
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+
+    data = message.get("text")
+    if data is None:
+        data = message.get("bytes")
+
+    try:
+        return codec.decode(data)
+    except Exception:
+        return None
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     api_key = ws.query_params.get("api_key")
 
     try:
-        client_info = authenticate(api_key)
+        client_info = await authenticate(api_key)
     except AuthError:
         await ws.close(code=1008)
         return
+    except Exception:
+        # key store unavailable and nothing cached
+        log.exception("authentication failed")
+        await ws.close(code=1011)
+        return
 
     max_streams = client_info.get("max_streams", 1)
-    await ws.accept()
-
-    active_streams = {}
+    codec = await _accept(ws)
+    # everything sent to this producer goes through its own outbound queue
+    router.attach(ws, codec, _compact(ws), policy=producer_policy)
 
     try:
         while True:
-            msg = await ws.receive_json()
-            print("Received message:", msg)
-            print("CREATING STREAM TASK")
-
+            msg = await _receive(ws, codec)
+            if _receive_sample() and log.isEnabledFor(logging.DEBUG):
+                log.debug("received: %r", msg)
 
             try:
+                if msg is None:
+                    raise ProtocolError(f"Malformed {codec.name} frame")
                 validate_message(msg)
             except Exception as e:
-                print("VALIDATION ERROR:", e)
-                traceback.print_exc()
+                log.info("protocol error from %s: %s", client_info["client"], e)
 
-                await ws.send_json(
+                await router.send(
+                    ws,
                     error_message(
-                        stream_id=msg.get("stream_id"),
+                        stream_id=msg.get("stream_id") if isinstance(msg, dict) else None,
                         code="PROTOCOL_ERROR",
                         message=str(e),
                     )
@@ -57,13 +190,12 @@ async def websocket_endpoint(ws: WebSocket):
             stream_id = msg["stream_id"]
             channels = msg.get("channels") or [msg.get("channel")]
             payload = msg.get("data", {}).get("payload")
+            batch = msg.get("meta", {}).get("batch")
             plugin_name = msg.get("plugin", "llm_demo")
-            print("PLUGIN:", plugin_name)
-            print("CHANNEL:", channels)
-            print("PAYLOAD:", payload)
 
             if not channels:
-                await ws.send_json(
+                await router.send(
+                    ws,
                     error_message(
                         stream_id=stream_id,
                         code="MISSING_CHANNEL",
@@ -73,13 +205,34 @@ async def websocket_endpoint(ws: WebSocket):
                 continue
 
             if event == "stream.start":
-                if stream_id in active_streams:
+                if registry.owned(ws, stream_id):
+                    continue
+
+                try:
+                    credit = CreditWindow.from_meta(msg.get("meta", {}).get("credit"))
+                    # an explicit batch larger than the window would overflow
+                    # the client's receive queue (the manager caps defaults)
+                    requested = BatchPolicy.resolve(batch, None)
+                    if isinstance(batch, dict) and credit is not None and credit.chunks is not None and requested.max_chunks > credit.chunks:
+                        raise ValueError(
+                            f"batch max_chunks ({requested.max_chunks}) exceeds the credit window ({credit.chunks} chunks)"
+                        )
+                except ValueError as e:
+                    await router.send(
+                        ws,
+                        error_message(
+                            stream_id=stream_id,
+                            code="PROTOCOL_ERROR",
+                            message=str(e),
+                        )
+                    )
                     continue
 
                 try:
-                    limiter.acquire(api_key, max_streams)
+                    lease = await limiter.acquire(api_key, max_streams)
                 except RateLimitError as e:
-                    await ws.send_json(
+                    await router.send(
+                        ws,
                         error_message(
                             stream_id=stream_id,
                             code="RATE_LIMIT",
@@ -93,7 +246,8 @@ async def websocket_endpoint(ws: WebSocket):
                 message_id = uuid.uuid4().hex
 
                 # Optionally, notify control socket that candidate was created (so client can display it)
-                await ws.send_json(
+                await router.send(
+                    ws,
                     build_message(
                         event=Event.STREAM_START,
                         stream_id=stream_id,
@@ -103,40 +257,152 @@ async def websocket_endpoint(ws: WebSocket):
                     )
                 )
 
-                # schedule stream with candidate info
-                task = asyncio.create_task(
-                    manager.start_stream(None, stream_id, plugin_name, channels, payload, candidate_id=candidate_id, message_id=message_id)
+                # schedule stream with candidate info; the registry
+                # releases the slot whenever and however the task ends
+                entry = registry.add(ws, stream_id, lease, client=client_info["client"], plugin=plugin_name)
+                registry.run(
+                    entry,
+                    manager.start_stream(ws, stream_id, plugin_name, channels, payload, candidate_id=candidate_id, message_id=message_id, batch=batch, client_info=client_info, credit=credit, entry=entry),
                 )
 
-                active_streams[stream_id] = task
+            elif event == "stream.credit":
+                # only streams started on this socket
+                if registry.owned(ws, stream_id):
+                    data = msg["data"]
+                    try:
+                        manager.grant_credit(ws, stream_id, int(data.get("chunks", 0)), int(data.get("bytes", 0)))
+                    except (TypeError, ValueError):
+                        await router.send(
+                            ws,
+                            error_message(
+                                stream_id=stream_id,
+                                code="PROTOCOL_ERROR",
+                                message="credit chunks/bytes must be integers",
+                            )
+                        )
 
             elif event == "stream.cancel":
-                task = active_streams.pop(stream_id, None)
-                if task:
-                    task.cancel()
-                    limiter.release(api_key)
+                registry.cancel(ws, stream_id)
 
     except WebSocketDisconnect:
-        for task in active_streams.values():
-            task.cancel()
-            limiter.release(api_key)
+        pass
+    finally:
+        registry.cancel_owner(ws)
+        router.unsubscribe(ws)
+
+def _split(value):
+    """
+    Comma separated query parameter as a list (None when absent).
+    """
+    if value is None:
+        return None
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def _subscriptions(ws: WebSocket) -> dict:
+    return build_message(
+        event=Event.SUBSCRIBE,
+        data={
+            "subscriptions": [
+                {"channel": ch, "candidate": cid}
+                for ch, cid in router.patterns.subscriptions(ws)
+            ]
+        },
+    )
+
+
+async def _change_subscriptions(ws: WebSocket, msg: dict, default_candidates):
+    """
+    Apply a subscribe/unsubscribe message of an observer and answer with
+    its resulting subscriptions.
+
+    Channel patterns come from `channels` (or `channel`), candidate
+    patterns from data.candidates (or `candidate_id`). A subscribe
+    without candidates uses the socket's defaults, an unsubscribe
+    without channels or candidates drops all of them.
+    """
+    data = msg.get("data") or {}
+    channels = msg.get("channels") or ([msg["channel"]] if msg.get("channel") else None)
+    candidates = data.get("candidates") if isinstance(data, dict) else None
+    if candidates is None and msg.get("candidate_id"):
+        candidates = [msg["candidate_id"]]
+    for patterns in (channels, candidates):
+        if patterns is not None and not isinstance(patterns, list):
+            raise PatternError("channels and data.candidates must be lists")
+
+    if msg["event"] == Event.SUBSCRIBE.value:
+        router.subscribe_patterns(ws, channels or [WILDCARD], candidates or default_candidates)
+    else:
+        router.unsubscribe_patterns(ws, channels, candidates)
+    await router.send(ws, _subscriptions(ws))
+
 
 @app.websocket("/observe")
 async def observe_endpoint(ws: WebSocket):
-    print("OBSERVE SOCKET CONNECT ATTEMPT")
-    await ws.accept()
+    codec = await _accept(ws)
+    router.attach(ws, codec, _compact(ws))
 
     candidate_param = ws.query_params.get("candidate_id")
-    print("OBSERVE CANDIDATE:", candidate_param)
+    channel_patterns = _split(ws.query_params.get("channels"))
+    candidate_patterns = _split(ws.query_params.get("candidates"))
+    # candidates of a subscription that names none
+    default_candidates = [candidate_param] if candidate_param else [WILDCARD]
+    rejected = None
+
+    if channel_patterns is None and candidate_patterns is None:
+        # no subscription expression: the candidate's stream plus homepage
+        router.subscribe_candidate(ws, [candidate_param])
+        router.subscribe_service(candidate_param, ["homepage"])
+    else:
+        try:
+            router.subscribe_patterns(
+                ws,
+                channel_patterns or [WILDCARD],
+                candidate_patterns or default_candidates,
+            )
+        except PatternError as e:
+            rejected = e
 
-    router.subscribe_candidate(ws, [candidate_param])
-    router.subscribe_service(candidate_param, ["homepage"])
+    # resume_from=<message_id or stream_id>:<last seq received>; the
+    # replay is queued before any await so it joins the live stream
+    # without a gap
+    resume_from = ws.query_params.get("resume_from")
+    if resume_from:
+        stream_id, _, seq = resume_from.rpartition(":")
+        try:
+            replayed = manager.resume(ws, stream_id, int(seq))
+            log.debug("observer resumed %s after seq %s: %d frames", stream_id, seq, replayed)
+        except (LookupError, ValueError) as e:
+            await router.send(
+                ws,
+                error_message(
+                    stream_id=stream_id or None,
+                    code="RESUME_UNAVAILABLE",
+                    message=str(e),
+                ),
+            )
 
+    if rejected is not None:
+        await router.send(ws, error_message(stream_id=None, code="INVALID_SUBSCRIPTION", message=str(rejected)))
 
-    print("OBSERVE CONNECTED:", candidate_param)
+    log.debug(
+        "observer connected: candidate=%s channels=%s candidates=%s codec=%s",
+        candidate_param, channel_patterns, candidate_patterns, codec.name,
+    )
 
     try:
         while True:
-            await ws.receive_text()
+            msg = await _receive(ws, codec)
+
+            # subscriptions can change over the open socket; anything
+            # else an observer sends is ignored
+            if not isinstance(msg, dict) or msg.get("event") not in (Event.SUBSCRIBE.value, Event.UNSUBSCRIBE.value):
+                continue
+            try:
+                await _change_subscriptions(ws, msg, default_candidates)
+            except PatternError as e:
+                await router.send(ws, error_message(stream_id=None, code="INVALID_SUBSCRIPTION", message=str(e)))
     except WebSocketDisconnect:
+        pass
+    finally:
         router.unsubscribe(ws)
@@ -1,11 +1,61 @@
-from typing import Dict
+# client_server_stream/server/auth.py
+"""
+API key authentication.
+
+Keys live in a KeyStore, picked with STREAM_KEYSTORE:
+
+    ""                       the in-memory VALID_API_KEYS below
+    sqlite:///keys.db        SQLiteKeyStore, relative path (created if
+    sqlite:////var/keys.db   missing) or absolute path
+
+Stores are addressed by `key_id(api_key)`, a SHA-256 of the key, so raw
+keys are never persisted or published. Every store sits behind a
+CachedKeyStore:
+- an LRU of recent lookups, with a TTL
+- invalid keys are cached too, for a shorter TTL
+- concurrent lookups of the same key share one store query
+A reconnect wave therefore costs one query per distinct key.
+
+Changes made through a store (`put` / `revoke`) invalidate the cache
+right away. With STREAM_KEY_INVALIDATION (a Redis-protocol URL, by
+default the router's) the invalidations are also published to the
+other workers.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from . import settings
+from .metrics import counter, histogram
+from .resp import RespConnection, RespError
+
+log = logging.getLogger(__name__)
+
+KEY_CACHE = counter(
+    "streamkit_key_cache_total",
+    "API key lookups by cache result (hit, negative_hit, join, miss, stale)",
+    ("result",),
+)
+KEY_LOOKUP = histogram(
+    "streamkit_key_lookup_seconds",
+    "API key store lookup latency (cache misses only)",
+    ("store",),
+)
 
 
 class AuthError(Exception):
     """Raised when API key authentication fails."""
 
 
-# In-memory API key store (replaceable with DB / Redis later)
+# In-memory API key store (the default STREAM_KEYSTORE)
 VALID_API_KEYS = {
     "user1-key": {
         "client": "user1",
@@ -22,8 +72,385 @@ VALID_API_KEYS = {
 }
 
 
+def key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+# ----------------------------------------------------------------------
+# Stores
+# ----------------------------------------------------------------------
+
+class KeyStore(ABC):
+    """
+    Base class: maps key ids to client metadata. `put` and `revoke`
+    notify the listeners (the cache) of the changed key id.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        # called with the key id of every changed key
+        self._listeners: List[Callable[[str], None]] = []
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def lookup(self, kid: str) -> Optional[Dict]:
+        """
+        Client metadata of a key id, None if unknown or revoked.
+        """
+
+    @abstractmethod
+    async def put(self, api_key: str, info: Dict) -> None:
+        """
+        Add or replace a key.
+        """
+
+    @abstractmethod
+    async def revoke(self, api_key: str) -> None:
+        """
+        Revoke a key; later lookups return None.
+        """
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        self._listeners.append(listener)
+
+    def _changed(self, kid: str) -> None:
+        for listener in self._listeners:
+            listener(kid)
+
+    async def close(self):
+        pass
+
+
+class MemoryKeyStore(KeyStore):
+    def __init__(self, keys: Dict[str, Dict]):
+        super().__init__()
+        self._keys = {key_id(k): info for k, info in keys.items()}
+
+    async def lookup(self, kid):
+        return self._keys.get(kid)
+
+    async def put(self, api_key: str, info: Dict) -> None:
+        kid = key_id(api_key)
+        self._keys[kid] = info
+        self._changed(kid)
+
+    async def revoke(self, api_key: str) -> None:
+        kid = key_id(api_key)
+        self._keys.pop(kid, None)
+        self._changed(kid)
+
+
+class SQLiteKeyStore(KeyStore):
+    """
+    Keys in an SQLite table, queried on one dedicated thread.
+
+        api_keys(key_id TEXT PRIMARY KEY, info TEXT, revoked INTEGER)
+
+    `info` is the client metadata as JSON.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        # sqlite3 connections are used from a single thread
+        self._thread = ThreadPoolExecutor(1, thread_name_prefix="keystore")
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    async def start(self):
+        await self._run(self._open)
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS api_keys ("
+            " key_id TEXT PRIMARY KEY,"
+            " info TEXT NOT NULL,"
+            " revoked INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+
+    async def lookup(self, kid):
+        if self._db is None:
+            await self.start()
+        return await self._run(self._lookup, kid)
+
+    def _lookup(self, kid):
+        row = self._db.execute(
+            "SELECT info FROM api_keys WHERE key_id = ? AND revoked = 0", (kid,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def put(self, api_key: str, info: Dict) -> None:
+        kid = key_id(api_key)
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO api_keys (key_id, info, revoked) VALUES (?, ?, 0)",
+            (kid, json.dumps(info)),
+        )
+        self._changed(kid)
+
+    async def revoke(self, api_key: str) -> None:
+        kid = key_id(api_key)
+        await self._run(self._write, "UPDATE api_keys SET revoked = 1 WHERE key_id = ?", (kid,))
+        self._changed(kid)
+
+    def _write(self, sql, params):
+        if self._db is None:
+            self._open()
+        self._db.execute(sql, params)
+        self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._thread.shutdown(wait=False)
+
+
+# ----------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------
+
+class CachedKeyStore:
+    """
+    LRU + TTL cache with negative caching and single-flight lookups in
+    front of a KeyStore.
+    """
+
+    def __init__(
+        self,
+        store: KeyStore,
+        size: int = settings.KEY_CACHE_SIZE,
+        ttl: float = settings.KEY_CACHE_TTL,
+        negative_ttl: float = settings.KEY_NEGATIVE_TTL,
+        invalidation_url: Optional[str] = None,
+    ):
+        self.store = store
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        # key id -> (expires, info or None), least recently used first;
+        # expired entries stay until evicted, as a fallback when the
+        # store is down
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # key id -> lookup in progress
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # key ids invalidated while their lookup was in progress
+        self._stale = set()
+
+        self._channel = _InvalidationChannel(invalidation_url) if invalidation_url else None
+        store.add_listener(self.invalidate)
+
+        self.results = {"hit": 0, "negative_hit": 0, "join": 0, "miss": 0, "stale": 0}
+        self.lookup_seconds = 0.0
+
+    async def start(self):
+        await self.store.start()
+        if self._channel is not None:
+            await self._channel.start(self._evict)
+
+    async def get(self, api_key: str) -> Optional[Dict]:
+        kid = key_id(api_key)
+
+        entry = self._entries.get(kid)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(kid)
+            self._count("hit" if entry[1] is not None else "negative_hit")
+            return entry[1]
+
+        pending = self._inflight.get(kid)
+        if pending is not None:
+            self._count("join")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # the lookup we joined was cancelled with its caller: retry
+            return await self.get(api_key)
+
+        self._count("miss")
+        pending = self._inflight[kid] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        try:
+            info = await self.store.lookup(kid)
+        except Exception as e:
+            if entry is not None and entry[1] is not None:
+                # store unavailable: keep admitting keys we knew were valid
+                log.warning("key store lookup failed (%s), serving cached entry", e)
+                self._count("stale")
+                pending.set_result(entry[1])
+                return entry[1]
+            pending.set_exception(e)
+            pending.exception()
+            raise
+        else:
+            pending.set_result(info)
+            elapsed = time.perf_counter() - started
+            self.lookup_seconds += elapsed
+            KEY_LOOKUP.observe(elapsed, self.store.name)
+
+            if kid in self._stale:
+                self._stale.discard(kid)
+            else:
+                self._put(kid, info)
+            return info
+        finally:
+            # a cancelled lookup must not leave its joiners waiting
+            if not pending.done():
+                pending.cancel()
+            self._inflight.pop(kid, None)
+
+    def _put(self, kid, info):
+        ttl = self.ttl if info is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        self._entries[kid] = (time.monotonic() + ttl, info)
+        self._entries.move_to_end(kid)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _count(self, result):
+        self.results[result] += 1
+        KEY_CACHE.inc(result)
+
+    def invalidate(self, kid: Optional[str] = None) -> None:
+        """
+        Drop a key id (None: everything) here and, with an invalidation
+        channel, in the other workers.
+        """
+        self._evict(kid)
+        if self._channel is not None:
+            self._channel.publish(kid or "*")
+
+    def _evict(self, kid: Optional[str]) -> None:
+        if kid is None or kid == "*":
+            self._entries.clear()
+            self._stale.update(self._inflight)
+            return
+        self._entries.pop(kid, None)
+        if kid in self._inflight:
+            self._stale.add(kid)
+
+    async def close(self):
+        if self._channel is not None:
+            await self._channel.close()
+        await self.store.close()
+
+    def stats(self) -> dict:
+        lookups = sum(self.results.values())
+        misses = self.results["miss"]
+        return {
+            "store": self.store.name,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            **self.results,
+            "hit_rate": round(1 - misses / lookups, 4) if lookups else None,
+            "avg_lookup_ms": round(self.lookup_seconds / misses * 1000, 3) if misses else None,
+        }
+
+
+class _InvalidationChannel:
+    """
+    Key invalidations shared between workers over Redis-protocol
+    pub/sub. Messages are "<worker id> <key id>" ("*" for all).
+    """
+
+    def __init__(self, url: str, topic: str = "streamkit:keys", reconnect_delay: float = 1.0):
+        self.url = url
+        self.topic = topic
+        self.reconnect_delay = reconnect_delay
+        self.worker_id = uuid.uuid4().hex
+        self._pub: Optional[RespConnection] = None
+        self._task = None
+
+    async def start(self, on_invalidate: Callable[[str], None]):
+        self._pub = await RespConnection.open(self.url)
+        self._task = asyncio.create_task(self._subscriber(on_invalidate))
+
+    def publish(self, kid: str):
+        asyncio.get_running_loop().create_task(self._publish(kid))
+
+    async def _publish(self, kid):
+        try:
+            if self._pub is None:
+                self._pub = await RespConnection.open(self.url)
+            await self._pub.execute("PUBLISH", self.topic, f"{self.worker_id} {kid}")
+        except (OSError, ConnectionError, RespError) as e:
+            # other workers fall back to their cache TTL
+            log.warning("key invalidation not published: %s", e)
+            if self._pub is not None:
+                await self._pub.close()
+                self._pub = None
+
+    async def _subscriber(self, on_invalidate):
+        while True:
+            conn = None
+            try:
+                conn = await RespConnection.open(self.url)
+                conn.send("SUBSCRIBE", self.topic)
+                await conn.writer.drain()
+                reply = await conn.read()  # ["subscribe", topic, 1]
+                if isinstance(reply, RespError):
+                    raise reply
+                # anything may have changed while disconnected
+                on_invalidate("*")
+
+                while True:
+                    reply = await conn.read()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        worker, _, kid = reply[2].decode().partition(" ")
+                        if worker != self.worker_id:
+                            on_invalidate(kid)
+
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, RespError) as e:
+                log.warning("key invalidation subscription lost: %s", e)
+            except Exception:
+                log.exception("key invalidation subscription failed, reconnecting")
+            finally:
+                if conn is not None:
+                    await conn.close()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pub is not None:
+            await self._pub.close()
+            self._pub = None
+
+
+def create_keystore(url: Optional[str]) -> CachedKeyStore:
+    """
+    Cached store for a STREAM_KEYSTORE value.
+    """
+    if not url:
+        store = MemoryKeyStore(VALID_API_KEYS)
+    elif url.startswith("sqlite:///"):
+        store = SQLiteKeyStore(url[len("sqlite:///"):])
+    else:
+        raise ValueError(f"Unsupported key store: {url}")
+    return CachedKeyStore(store, invalidation_url=settings.KEY_INVALIDATION or None)
+
+
+keystore = create_keystore(settings.KEYSTORE)
+
 
-def authenticate(api_key: str | None) -> Dict:
+async def authenticate(api_key: Optional[str]) -> Dict:
     """
     Validate an API key and return client metadata.
 
@@ -33,7 +460,7 @@ def authenticate(api_key: str | None) -> Dict:
     if not api_key:
         raise AuthError("Missing API key")
 
-    client_info = VALID_API_KEYS.get(api_key)
+    client_info = await keystore.get(api_key)
     if not client_info:
         raise AuthError("Invalid API key")
 
@@ -0,0 +1,150 @@
+# client_server_stream/server/batching.py
+import asyncio
+import json
+from typing import Any, AsyncIterator, List, Optional
+
+from . import settings
+
+
+class BatchPolicy:
+    """
+    Flush thresholds for chunk micro-batching.
+
+    A batch is flushed as soon as it holds `max_chunks` chunks, reaches
+    `max_bytes` (approximate payload size), or its first chunk has been
+    waiting `max_delay_ms` milliseconds - whichever comes first.
+    """
+
+    __slots__ = ("max_chunks", "max_bytes", "max_delay")
+
+    def __init__(self, max_chunks: int = 32, max_bytes: int = 16384, max_delay_ms: float = 20):
+        if max_chunks < 1:
+            raise ValueError("max_chunks must be >= 1")
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be >= 1")
+        if max_delay_ms < 0:
+            raise ValueError("max_delay_ms must be >= 0")
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay_ms / 1000
+
+    def __repr__(self):
+        return (
+            f"BatchPolicy(max_chunks={self.max_chunks}, max_bytes={self.max_bytes}, "
+            f"max_delay_ms={self.max_delay * 1000:g})"
+        )
+
+    @classmethod
+    def resolve(cls, requested: Any, default: Optional["BatchPolicy"]) -> Optional["BatchPolicy"]:
+        """
+        Combine a request's `meta.batch` with the plugin default.
+
+        `requested` may be None (use the plugin default), False (disable),
+        True (plugin default, or library defaults if the plugin has none)
+        or a dict of BatchPolicy keyword arguments, clamped to the
+        settings.BATCH_MAX_* limits.
+
+        Raises:
+            ValueError: if `requested` is malformed
+        """
+        if requested is None:
+            return default
+        if requested is False:
+            return None
+        if requested is True:
+            return default or cls()
+        if isinstance(requested, dict):
+            try:
+                max_chunks = int(requested.get("max_chunks", 32))
+                max_bytes = int(requested.get("max_bytes", 16384))
+                max_delay_ms = float(requested.get("max_delay_ms", 20))
+            except (TypeError, ValueError):
+                raise ValueError("batch max_chunks, max_bytes and max_delay_ms must be numbers")
+            return cls(
+                max_chunks=min(max_chunks, settings.BATCH_MAX_CHUNKS),
+                max_bytes=min(max_bytes, settings.BATCH_MAX_BYTES),
+                max_delay_ms=min(max_delay_ms, settings.BATCH_MAX_DELAY_MS),
+            )
+        raise ValueError("batch must be a boolean or an object")
+
+    def within(self, max_chunks: int) -> "BatchPolicy":
+        """
+        This policy with at most `max_chunks` chunks per batch.
+        """
+        if self.max_chunks <= max_chunks:
+            return self
+        return BatchPolicy(max(1, max_chunks), self.max_bytes, self.max_delay * 1000)
+
+
+def chunk_size(chunk: Any) -> int:
+    if isinstance(chunk, (str, bytes)):
+        return len(chunk)
+    return len(json.dumps(chunk, default=str))
+
+
+async def _next(iterator):
+    return await iterator.__anext__()
+
+
+async def batch_chunks(source: AsyncIterator[Any], policy: BatchPolicy) -> AsyncIterator[List[Any]]:
+    """
+    Group the chunks of `source` into lists according to `policy`.
+
+    The pending `__anext__` is kept across flushes (never cancelled by
+    the timer), so a deadline flush does not disturb the plugin.
+    """
+    iterator = source.__aiter__()
+    loop = asyncio.get_running_loop()
+
+    batch = []
+    size = 0
+    deadline = 0.0
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(_next(iterator))
+
+            timeout = max(0.0, deadline - loop.time()) if batch else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+
+            if not done:
+                yield batch
+                batch, size = [], 0
+                continue
+
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # deliver what the plugin produced before failing
+                if batch:
+                    yield batch
+                    batch = []
+                raise
+
+            if not batch:
+                deadline = loop.time() + policy.max_delay
+            batch.append(chunk)
+            size += chunk_size(chunk)
+
+            if len(batch) >= policy.max_chunks or size >= policy.max_bytes:
+                yield batch
+                batch, size = [], 0
+
+        if batch:
+            yield batch
+
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,218 @@
+# client_server_stream/server/broker.py
+"""
+Local stand-in for Redis, for running several workers without one.
+
+Speaks just enough RESP for the router backend and the shared stream
+limiter: PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, MULTI/EXEC and the
+sorted-set commands ZADD, ZREM, ZCARD and ZREMRANGEBYSCORE. Not
+persistent, not for production.
+
+    python -m client_server_stream.server.broker --port 6379
+    python -m client_server_stream.server.broker --unix /tmp/streamkit.sock
+
+    STREAM_ROUTER_BACKEND=redis://127.0.0.1:6379 uvicorn \\
+        client_server_stream.server.app:app --workers 4
+"""
+import argparse
+import asyncio
+import logging
+
+from .resp import encode_command, read_reply
+
+log = logging.getLogger(__name__)
+
+
+def _simple(value: str) -> bytes:
+    return b"+%s\r\n" % value.encode()
+
+
+def _error(message: str) -> bytes:
+    return b"-ERR %s\r\n" % message.encode()
+
+
+def _integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def _subscription(kind: bytes, channel: bytes, count: int) -> bytes:
+    # [kind, channel, count]: a command array with a trailing integer
+    return b"*3\r\n" + encode_command((kind, channel))[4:] + _integer(count)
+
+
+class Session:
+    """
+    Per-connection state.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscribed = set()
+        # commands queued between MULTI and EXEC
+        self.queued = None
+
+
+class Broker:
+    def __init__(self):
+        # channel -> set(client writer)
+        self.channels = {}
+        # key -> {member: score}
+        self.zsets = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(writer)
+        try:
+            while True:
+                try:
+                    command = await read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    return
+
+                if not isinstance(command, list) or not command:
+                    writer.write(_error("expected a command array"))
+                    continue
+
+                name = command[0].decode().upper()
+                if session.queued is not None and name not in ("EXEC", "MULTI"):
+                    session.queued.append(command)
+                    writer.write(_simple("QUEUED"))
+                else:
+                    writer.write(self.execute(session, command))
+                await writer.drain()
+        finally:
+            for channel in session.subscribed:
+                self._leave(channel, writer)
+            writer.close()
+
+    def execute(self, session: Session, command) -> bytes:
+        name = command[0].decode().upper()
+        handler = getattr(self, "cmd_" + name.lower(), None)
+        if handler is None:
+            return _error(f"unknown command '{name}'")
+        try:
+            return handler(session, *command[1:])
+        except (TypeError, ValueError):
+            return _error(f"wrong arguments for '{name}'")
+
+    # ------------------------------------------------------------------
+    # Commands (return the encoded reply)
+    # ------------------------------------------------------------------
+
+    def cmd_ping(self, session, *args):
+        return _simple("PONG")
+
+    def cmd_select(self, session, db):
+        return _simple("OK")
+
+    def cmd_multi(self, session):
+        if session.queued is not None:
+            return _error("MULTI calls can not be nested")
+        session.queued = []
+        return _simple("OK")
+
+    def cmd_exec(self, session):
+        if session.queued is None:
+            return _error("EXEC without MULTI")
+        # single-threaded: the queued commands run with nothing in between
+        queued, session.queued = session.queued, None
+        return b"*%d\r\n" % len(queued) + b"".join(self.execute(session, c) for c in queued)
+
+    def cmd_publish(self, session, channel, message):
+        receivers = self.channels.get(channel, ())
+        push = encode_command((b"message", channel, message))
+        for w in receivers:
+            w.write(push)
+        return _integer(len(receivers))
+
+    def cmd_subscribe(self, session, *channels):
+        if not channels:
+            raise TypeError
+        replies = []
+        for channel in channels:
+            self.channels.setdefault(channel, set()).add(session.writer)
+            session.subscribed.add(channel)
+            replies.append(_subscription(b"subscribe", channel, len(session.subscribed)))
+        return b"".join(replies)
+
+    def cmd_unsubscribe(self, session, *channels):
+        replies = []
+        for channel in channels or list(session.subscribed):
+            self._leave(channel, session.writer)
+            session.subscribed.discard(channel)
+            replies.append(_subscription(b"unsubscribe", channel, len(session.subscribed)))
+        return b"".join(replies)
+
+    def cmd_zadd(self, session, key, *args):
+        # ZADD key [NX|XX] score member [score member ...]
+        mode = args[0].upper() if args and args[0].upper() in (b"NX", b"XX") else None
+        if mode:
+            args = args[1:]
+        if not args or len(args) % 2:
+            raise TypeError
+
+        zset = self.zsets.setdefault(key, {})
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            exists = member in zset
+            if (mode == b"NX" and exists) or (mode == b"XX" and not exists):
+                continue
+            zset[member] = float(score)
+            added += not exists
+        if not zset:
+            del self.zsets[key]
+        return _integer(added)
+
+    def cmd_zrem(self, session, key, *members):
+        if not members:
+            raise TypeError
+        zset = self.zsets.get(key, {})
+        removed = sum(zset.pop(m, None) is not None for m in members)
+        if key in self.zsets and not zset:
+            del self.zsets[key]
+        return _integer(removed)
+
+    def cmd_zcard(self, session, key):
+        return _integer(len(self.zsets.get(key, ())))
+
+    def cmd_zremrangebyscore(self, session, key, low, high):
+        low, high = float(low), float(high)
+        zset = self.zsets.get(key, {})
+        expired = [m for m, score in zset.items() if low <= score <= high]
+        for member in expired:
+            del zset[member]
+        if key in self.zsets and not zset:
+            del self.zsets[key]
+        return _integer(len(expired))
+
+    def _leave(self, channel, writer):
+        writers = self.channels.get(channel)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del self.channels[channel]
+
+
+async def serve(host=None, port=None, unix=None):
+    broker = Broker()
+    if unix:
+        server = await asyncio.start_unix_server(broker.handle, unix)
+        log.info("broker listening on unix://%s", unix)
+    else:
+        server = await asyncio.start_server(broker.handle, host, port)
+        log.info("broker listening on redis://%s:%s", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--unix", help="listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.unix))
+
+
+if __name__ == "__main__":
+    main()
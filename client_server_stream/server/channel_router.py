@@ -1,57 +1,222 @@
-from collections import defaultdict
-from email.mime import message
-import json
+from itertools import chain
+
+from .codec import JSON, Codec
+from .fanout import Frame, FanOutResult, fan_out
+from .subscriber import Subscriber, SendPolicy
+from .metrics import FANOUT_DURATION, SEND_QUEUE_DEPTH
+from .pubsub import RouterBackend, create_backend
+from .topics import WILDCARD, PatternError, SubscriptionIndex, validate_pattern
+from . import settings
+
 
 class ChannelRouter:
-    def __init__(self):
+    """
+    Maps channels, candidates and services to subscribed sockets.
+
+    Every relation is indexed in both directions so that emitting and
+    disconnecting cost O(own subscriptions), never O(all subscriptions).
+    Entries are removed as soon as they become empty.
+
+    Observers can also subscribe to channel and candidate patterns
+    ("button:*"); those are matched through the tries of
+    server/topics.py, at a cost independent of the number of patterns.
+
+    Emits are delivered to this process's sockets first, then handed to
+    `backend` so other workers can deliver them to theirs (see
+    server/pubsub.py).
+    """
+
+    def __init__(
+        self,
+        send_timeout: float = settings.FANOUT_SEND_TIMEOUT,
+        default_policy: SendPolicy = None,
+        backend: RouterBackend = None,
+    ):
         # channel_name -> set(ws)
-        self.channels = defaultdict(set)
+        self.channels = {}
         # candidate_id -> set(ws)
-        self.candidates = defaultdict(set)
-        self.client_services = defaultdict(set)
+        self.candidates = {}
+        # candidate_id -> set(service)
+        self.client_services = {}
         # candidate_id -> list(channel_name)
         self.candidate_channels = {}
 
+        # Reverse indexes
+        # ws -> set(channel_name)
+        self.ws_channels = {}
+        # ws -> set(candidate_id)
+        self.ws_candidates = {}
+        # service -> set(candidate_id)
+        self.service_candidates = {}
+        # service -> {ws: number of the ws's candidates subscribed to it};
+        # the keys are exactly the sockets emit_channel(service) reaches
+        self.service_targets = {}
+        # (channel pattern, candidate pattern) subscriptions of observers
+        self.patterns = SubscriptionIndex()
+
+        # ws -> Subscriber (outbound queue + writer task)
+        self.subscribers = {}
+        self.send_timeout = send_timeout
+        self.default_policy = default_policy or SendPolicy(
+            settings.SEND_QUEUE_SIZE, settings.SEND_OVERFLOW
+        )
+        # channel_name -> SendPolicy overriding the default
+        self.channel_policies = {}
+
+        # Fan-out reporting: last result plus running totals
+        self.last_fanout = FanOutResult()
+        self.fanout_count = 0
+        self.fanout_recipients = 0
+        # drops of subscribers that are already gone
+        self._closed_dropped = 0
+
+        self.backend = backend or RouterBackend()
+
+    # ------------------------------------------------------------------
+    # Backend
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        await self.backend.start(self.deliver)
+
+    async def close(self):
+        await self.backend.close()
+
+    # ------------------------------------------------------------------
+    # Subscribers
+    # ------------------------------------------------------------------
+
+    def attach(self, ws, codec: Codec = JSON, compact: bool = False, policy: SendPolicy = None) -> Subscriber:
+        """
+        Return the outbound queue of `ws`, creating it on first use.
+        `codec` is the socket's negotiated wire codec, `compact` whether
+        it asked for compact chunk frames, `policy` a SendPolicy that
+        overrides the channel policies for this socket.
+        """
+        sub = self.subscribers.get(ws)
+        if sub is None:
+            sub = Subscriber(
+                ws,
+                send_timeout=self.send_timeout,
+                codec=codec,
+                compact=compact,
+                policy=policy,
+                on_close=self._on_subscriber_closed,
+            )
+            self.subscribers[ws] = sub
+        return sub
+
+    def _on_subscriber_closed(self, sub: Subscriber):
+        self._closed_dropped += sub.dropped
+        if self.subscribers.get(sub.ws) is sub:
+            self.unsubscribe(sub.ws)
+
+    def set_channel_policy(self, channel, policy: SendPolicy):
+        """
+        Configure queue bound and overflow behaviour for one channel.
+        """
+        self.channel_policies[channel] = policy
+
+    def policy_for(self, channel) -> SendPolicy:
+        return self.channel_policies.get(channel, self.default_policy)
+
+    # ------------------------------------------------------------------
+    # Subscriptions
+    # ------------------------------------------------------------------
+
     # Existing channel subscribe (unchanged behaviour)
     def subscribe(self, ws, channels):
+        self.attach(ws)
+        mine = self.ws_channels.setdefault(ws, set())
         for ch in channels:
-            self.channels[ch].add(ws)
+            self.channels.setdefault(ch, set()).add(ws)
+            mine.add(ch)
 
     # New: subscribe to candidate(s)
     def subscribe_candidate(self, ws, candidate_ids):
+        self.attach(ws)
+        mine = self.ws_candidates.setdefault(ws, set())
         for cid in candidate_ids:
-            self.candidates[cid].add(ws)
+            if cid in mine:
+                continue
+            mine.add(cid)
+            self.candidates.setdefault(cid, set()).add(ws)
+            for service in self.client_services.get(cid, ()):
+                self._add_target(service, ws)
 
     def subscribe_service(self, candidate_id, services):
-        self.client_services[candidate_id].update(services)
+        current = self.client_services.setdefault(candidate_id, set())
+        sockets = self.candidates.get(candidate_id, ())
+        for service in services:
+            if service in current:
+                continue
+            current.add(service)
+            self.service_candidates.setdefault(service, set()).add(candidate_id)
+            for ws in sockets:
+                self._add_target(service, ws)
+
+    def unsubscribe_service(self, candidate_id, services=None):
+        current = self.client_services.get(candidate_id)
+        if not current:
+            return
+        sockets = self.candidates.get(candidate_id, ())
+        for service in list(current if services is None else services):
+            if service not in current:
+                continue
+            current.discard(service)
+            self._discard(self.service_candidates, service, candidate_id)
+            for ws in sockets:
+                self._remove_target(service, ws)
+        if not current:
+            del self.client_services[candidate_id]
+
+    def subscribe_patterns(self, ws, channels, candidates=(WILDCARD,)) -> int:
+        """
+        Subscribe `ws` to every pair of channel and candidate pattern (see
+        server/topics.py): exact names or prefix wildcards like
+        "button:*". Returns the number of new subscriptions.
+
+        Raises:
+            PatternError: if a pattern is malformed or the socket would
+                exceed settings.OBSERVE_MAX_PATTERNS (nothing is added)
+        """
+        pairs = [
+            (validate_pattern(ch), validate_pattern(cid))
+            for ch in channels
+            for cid in candidates
+        ]
+        mine = self.patterns.by_socket.get(ws, ())
+        if len(mine) + len(set(pairs) - set(mine)) > settings.OBSERVE_MAX_PATTERNS:
+            raise PatternError(f"At most {settings.OBSERVE_MAX_PATTERNS} subscriptions per socket")
 
-    # Unsubscribe a ws from both channels and candidates
+        self.attach(ws)
+        return sum(self.patterns.add(ws, ch, cid) for ch, cid in pairs)
+
+    def unsubscribe_patterns(self, ws, channels=None, candidates=None) -> int:
+        """
+        Drop pattern subscriptions of `ws`: the given channel patterns
+        (all when None) paired with the given candidate patterns (all
+        when None). Returns the number removed.
+        """
+        removed = 0
+        for ch, cid in self.patterns.subscriptions(ws):
+            if (channels is None or ch in channels) and (candidates is None or cid in candidates):
+                removed += self.patterns.remove(ws, ch, cid)
+        return removed
+
+    # Unsubscribe a ws from channels, candidates and patterns
     def unsubscribe(self, ws):
-        for subs in self.channels.values():
-            subs.discard(ws)
-        for subs in self.candidates.values():
-            subs.discard(ws)
+        for ch in self.ws_channels.pop(ws, ()):
+            self._discard(self.channels, ch, ws)
 
-    # Legacy emit by channel (keeps backward compatibility)
-    async def emit(self, channel, message):
-        for ws in list(self.channels[channel]):
-            try:
-                print("ROUTER EMIT:", channel, message)
-                await ws.send_text(json.dumps(message))
-            except Exception:
-                pass
+        for cid in self.ws_candidates.pop(ws, ()):
+            self._remove_candidate_socket(cid, ws)
 
-    # Broadcast to all channels
-    async def broadcast(self, message):
-        seen = set()
-        for subs in self.channels.values():
-            for ws in subs:
-                if ws not in seen:
-                    seen.add(ws)
-                    try:
-                        await ws.send_text(json.dumps(message))
-                    except Exception:
-                        pass
+        self.patterns.remove_socket(ws)
+
+        sub = self.subscribers.pop(ws, None)
+        if sub is not None:
+            sub.close()
 
     # Register which channels should also receive a candidate's stream
     def register_candidate_channels(self, candidate_id, channels):
@@ -64,45 +229,259 @@ class ChannelRouter:
     def unregister_candidate(self, candidate_id):
         # remove candidate mapping and candidate subscriptions
         self.candidate_channels.pop(candidate_id, None)
-        if candidate_id in self.candidates:
-            self.candidates.pop(candidate_id, None)
+        for ws in list(self.candidates.get(candidate_id, ())):
+            self._discard(self.ws_candidates, ws, candidate_id)
+            self._remove_candidate_socket(candidate_id, ws)
+        self.unsubscribe_service(candidate_id)
+
+    def _remove_candidate_socket(self, candidate_id, ws):
+        for service in self.client_services.get(candidate_id, ()):
+            self._remove_target(service, ws)
+
+        if self._discard(self.candidates, candidate_id, ws):
+            # Nobody observes this candidate any more; /observe registers
+            # its services again on the next connect
+            self.unsubscribe_service(candidate_id)
+
+    def _add_target(self, service, ws):
+        targets = self.service_targets.setdefault(service, {})
+        targets[ws] = targets.get(ws, 0) + 1
+
+    def _remove_target(self, service, ws):
+        targets = self.service_targets.get(service)
+        if targets is None or ws not in targets:
+            return
+        if targets[ws] > 1:
+            targets[ws] -= 1
+            return
+        del targets[ws]
+        if not targets:
+            del self.service_targets[service]
+
+    @staticmethod
+    def _discard(index, key, value) -> bool:
+        """
+        Remove `value` from index[key], dropping the key once empty.
+        Returns True if the key was dropped.
+        """
+        values = index.get(key)
+        if values is None:
+            return False
+        values.discard(value)
+        if not values:
+            del index[key]
+            return True
+        return False
+
+    def reaches_service(self, ws, service) -> bool:
+        """
+        Whether emit_channel(service) delivers to `ws`.
+        """
+        return ws in self.service_targets.get(service, ())
+
+    def reaches_candidate(self, ws, candidate_id) -> bool:
+        """
+        Whether emit_candidate(candidate_id) delivers to `ws`.
+        """
+        if ws in self.candidates.get(candidate_id, ()):
+            return True
+        return any(ws in self.channels.get(ch, ()) for ch in self.client_services.get(candidate_id, ()))
+
+    def reaches_pattern(self, ws, channel, candidate_id) -> bool:
+        """
+        Whether a pattern subscription of `ws` matches a chunk of
+        `candidate_id` on `channel`.
+        """
+        return self.patterns.matches(ws, channel, candidate_id)
+
+    def stats(self) -> dict:
+        subs = list(self.subscribers.values())
+        return {
+            "subscribers": len(subs),
+            "queued": sum(s.depth for s in subs),
+            "max_depth": max((s.depth for s in subs), default=0),
+            "dropped": self._closed_dropped + sum(s.dropped for s in subs),
+            "fanouts": self.fanout_count,
+            "recipients": self.fanout_recipients,
+            "last_fanout_ms": self.last_fanout.duration * 1000,
+            "patterns": len(self.patterns),
+        }
+
+    # ------------------------------------------------------------------
+    # Fan-out engine: encode once, enqueue on every target
+    # ------------------------------------------------------------------
+
+    def _fan_out(self, targets, message, channel=None) -> FanOutResult:
+        frame = message if isinstance(message, Frame) else Frame(message)
+        subscribers = self.subscribers
+        subs = [subscribers[ws] for ws in targets if ws in subscribers]
+        return self._record(fan_out(subs, frame, self.policy_for(channel)))
+
+    def _record(self, result: FanOutResult) -> FanOutResult:
+        self.last_fanout = result
+        self.fanout_count += 1
+        self.fanout_recipients += result.queued
+        if result.recipients:
+            FANOUT_DURATION.observe(result.duration)
+            SEND_QUEUE_DEPTH.observe(result.max_depth)
+        return result
+
+    async def send(self, ws, message, channel=None) -> FanOutResult:
+        """
+        Queue a message for a single attached socket (e.g. the producing
+        /ws client). Sockets that were never attached, or already
+        unsubscribed, are skipped.
+        """
+        return self._fan_out((ws,), message, channel)
+
+    def preload(self, ws, frames) -> int:
+        """
+        Queue frames for `ws` ahead of any live traffic, bypassing the
+        overflow policy (resume replay).
+        """
+        sub = self.subscribers.get(ws)
+        return sub.preload(frames) if sub is not None else 0
+
+    # Legacy emit by channel (keeps backward compatibility)
+    async def emit(self, channel, message):
+        return self._publish("emit", channel, channel, message)
+
+    # Broadcast to all channels
+    async def broadcast(self, message):
+        return self._publish("broadcast", None, None, message)
 
     # Emit to candidate subscribers, and also to any channel subscribers mapped to this candidate
-    async def emit_candidate(self, candidate_id, message):
-        seen = set()
-
-        for ws in list(self.candidates.get(candidate_id, set())):
-            if ws not in seen:
-                seen.add(ws)
-                await ws.send_text(json.dumps(message))
-
-
-        # also send to channel subscribers that were registered for this candidate
-        for ch in self.client_services.get(candidate_id, []):
-            for ws in list(self.channels.get(ch, set())):
-                try:
-                    print(f"ROUTER EMIT CANDIDATE->CHANNEL: {candidate_id} -> {ch}", message)
-                    await ws.send_text(json.dumps(message))
-                except Exception:
-                    pass
+    async def emit_candidate(self, candidate_id, message, channel=None):
+        return self._publish("emit_candidate", candidate_id, channel, message)
+
     async def emit_channel(self, channel, message):
         """
         Broadcast message to all candidates subscribed to a service.
         """
+        return self._publish("emit_channel", channel, channel, message)
+
+    async def emit_routes(self, routes, frame_for, sender=None, candidate_id=None) -> FanOutResult:
+        """
+        Emit one chunk on several channels at once.
+
+        `routes` is a list of (channel, op, key): the channel and the emit
+        that reaches its audience, e.g. ("button:1", "emit_candidate",
+        candidate_id). Each socket reached by any route gets exactly one
+        frame, `frame_for(channels)`, where `channels` is the tuple of
+        channels it matched (in route order). `sender` (the producing
+        socket) matches every channel. Pattern subscriptions are matched
+        against each channel and `candidate_id`, the stream's candidate.
+        """
+        channels = tuple(route[0] for route in routes)
+        result = self._deliver_routes(routes, frame_for, sender, candidate_id)
+        self.backend.publish("emit_routes", [list(route) for route in routes], None, frame_for(channels))
+        return result
+
+    def _deliver_routes(self, routes, frame_for, sender=None, candidate_id=None) -> FanOutResult:
+        # ws -> channels it matched
+        matched = {}
+        if sender is not None:
+            matched[sender] = [route[0] for route in routes]
+        for channel, op, key in routes:
+            targets = self._targets(op, key)
+            if self.patterns:
+                targets = chain(targets, self.patterns.match(channel, candidate_id))
+            for ws in targets:
+                if ws is sender:
+                    continue
+                channels = matched.get(ws)
+                if channels is None:
+                    matched[ws] = [channel]
+                elif channels[-1] != channel:
+                    channels.append(channel)
+
+        # sockets that matched the same channels share a frame
+        groups = {}
+        subscribers = self.subscribers
+        for ws, channels in matched.items():
+            sub = subscribers.get(ws)
+            if sub is not None:
+                groups.setdefault(tuple(channels), []).append(sub)
+
+        result = FanOutResult()
+        for channels, subs in groups.items():
+            part = fan_out(subs, frame_for(channels), self.policy_for(channels[0]))
+            result.recipients += part.recipients
+            result.queued += part.queued
+            result.dropped += part.dropped
+            result.max_depth = max(result.max_depth, part.max_depth)
+            result.duration += part.duration
+        return self._record(result)
+
+    def _publish(self, op, key, channel, message) -> FanOutResult:
+        frame = message if isinstance(message, Frame) else Frame(message)
+        result = self.deliver(op, key, channel, frame)
+        self.backend.publish(op, key, channel, frame)
+        return result
+
+    def deliver(self, op, key, channel, frame) -> FanOutResult:
+        """
+        Fan an emit out to the sockets of this process only. Called for
+        local emits and for emits received from other workers.
+        """
+        if op == "emit_routes":
+            return self._deliver_routes(
+                [tuple(route) for route in key],
+                _derived_frames(frame),
+                candidate_id=frame.message.get("candidate_id"),
+            )
+
+        targets = self._targets(op, key)
+        if self.patterns and channel is not None:
+            candidate_id = key if op == "emit_candidate" else frame.message.get("candidate_id")
+            matched = self.patterns.match(channel, candidate_id)
+            if matched:
+                matched.update(targets)
+                targets = matched
+        return self._fan_out(targets, frame, channel)
+
+    def _targets(self, op, key):
+        if op == "emit_candidate":
+            targets = self.candidates.get(key, ())
+
+            # also send to channel subscribers that were registered for this candidate
+            services = self.client_services.get(key)
+            if services:
+                targets = set(targets)
+                for ch in services:
+                    targets.update(self.channels.get(ch, ()))
+            return targets
+
+        if op == "emit_channel":
+            return self.service_targets.get(key, ())
+        if op == "emit":
+            return self.channels.get(key, ())
+        if op == "broadcast":
+            return self.ws_channels.keys()
+        raise ValueError(f"Unknown router operation: {op}")
+
+
+def _derived_frames(frame: Frame):
+    """
+    frame_for() of an emit_routes received from another worker: frames
+    for subsets of the channels, derived from the all-channels frame.
+    """
+    message = frame.message
+    frames = {tuple(message.get("channels") or (message.get("channel"),)): frame}
 
-        seen = set()
+    def frame_for(channels):
+        derived = frames.get(channels)
+        if derived is None:
+            derived_message = dict(message)
+            derived_message["channel"] = channels[0]
+            if len(channels) > 1:
+                derived_message["channels"] = list(channels)
+            else:
+                derived_message.pop("channels", None)
+            derived = frames[channels] = Frame(derived_message)
+        return derived
 
-        for candidate_id, services in self.client_services.items():
-            if channel in services:
-                for ws in self.candidates.get(candidate_id, []):
-                    if ws not in seen:
-                        seen.add(ws)
-                        try:
-                            print(f"BROADCAST {channel} -> {candidate_id}", message)
-                            await ws.send_text(json.dumps(message))
-                        except Exception:
-                            pass
+    return frame_for
 
-            
 
-router = ChannelRouter()
+router = ChannelRouter(backend=create_backend(settings.ROUTER_BACKEND))
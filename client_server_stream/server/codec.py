@@ -0,0 +1,129 @@
+# client_server_stream/server/codec.py
+"""
+Wire codecs shared by the server and StreamTransport.
+
+The codec of a connection is chosen by WebSocket subprotocol
+negotiation: the client offers the subprotocols it supports, the server
+picks the first one in its own preference order. A client that offers
+none gets plain stdlib JSON text frames, as before.
+
+orjson and msgpack are optional; codecs whose library is missing are
+simply not offered.
+"""
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+class Codec(ABC):
+    """
+    Encodes protocol messages to WebSocket frames and back.
+    """
+
+    name: str  # WebSocket subprotocol
+    binary: bool = False  # bytes frames instead of text frames
+
+    @abstractmethod
+    def encode(self, message: Dict[str, Any]) -> Union[str, bytes]:
+        """
+        Frame payload for a message.
+        """
+
+    @abstractmethod
+    def decode(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        """
+        Message of a received frame; raises if it cannot be decoded.
+        """
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+
+class JsonCodec(Codec):
+    name = "streamkit.json"
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """
+    Same JSON text on the wire, produced by orjson.
+    """
+
+    name = "streamkit.orjson"
+
+    def encode(self, message):
+        return orjson.dumps(message).decode("utf-8")
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "streamkit.msgpack"
+    binary = True
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+JSON = JsonCodec()
+
+# Available codecs, most preferred first
+CODECS: Dict[str, Codec] = {}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+CODECS[JSON.name] = JSON
+
+
+def get_codec(name: Optional[str]) -> Codec:
+    """
+    Codec for a negotiated subprotocol (JSON when none was agreed).
+    """
+    if not name:
+        return JSON
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unsupported codec: {name}") from None
+
+
+def negotiate(offered: Iterable[str]) -> Optional[Codec]:
+    """
+    Pick the server's preferred codec among the client's offered
+    subprotocols. Returns None if the client offered none we support.
+    """
+    offered = set(offered)
+    for name, codec in CODECS.items():
+        if name in offered:
+            return codec
+    return None
+
+
+def subprotocols(preferred: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Subprotocols a client should offer: `preferred` filtered to the
+    available codecs, or all of them.
+    """
+    if preferred is None:
+        return list(CODECS)
+    return [name for name in preferred if name in CODECS]
@@ -0,0 +1,151 @@
+# client_server_stream/server/compact.py
+"""
+Compact chunk frames.
+
+A socket opts in with `compact=1` on its URL (/ws and /observe). Its
+chunk and end frames then drop the envelope. The first frame of every
+(stream, channel) it receives is sent in full, plus a numeric handle
+that binds the envelope:
+
+    {"protocol": ..., "event": "stream.chunk", "stream_id": ..., ..., "h": 7}
+
+After that, each frame carries only the handle, the seq and the data:
+
+    {"h": 7, "s": 12, "p": "token"}          payload
+    {"h": 7, "s": 12, "ps": [...]}           batched payloads
+    {"h": 7, "s": 12, "d": {"current": 13}}  dict payload, keys changed
+                                             since the previous chunk
+    {"h": 7, "s": 13, "e": 1}                stream.end
+
+plus `"m": meta` when the meta is not empty. A delta is only sent when
+the socket got the previous chunk of that handle. After a gap (a frame
+dropped by an overflow policy) the full payload goes out instead.
+`Expander` turns compact frames back into regular messages.
+"""
+import itertools
+from typing import Any, Dict, Optional
+
+from .protocol import Event, PROTOCOL_VERSION
+
+_handles = itertools.count(1)
+
+
+def next_handle() -> int:
+    """
+    Handle for a new (stream, channel) envelope, unique in this process.
+    """
+    return next(_handles)
+
+
+def delta(previous: Any, payload: Any) -> Optional[Dict[str, Any]]:
+    """
+    Keys of `payload` that are new or changed since `previous`, or None
+    if the payload cannot be expressed as a delta (not dicts, or keys
+    were removed).
+    """
+    if not isinstance(previous, dict) or not isinstance(payload, dict):
+        return None
+    if previous.keys() - payload.keys():
+        return None
+    return {k: v for k, v in payload.items() if k not in previous or previous[k] != v}
+
+
+class CompactChunk:
+    """
+    Compact form of one chunk or end frame of a stream envelope.
+    """
+
+    __slots__ = ("handle", "seq", "base", "data", "delta", "meta", "end")
+
+    def __init__(
+        self,
+        handle: int,
+        seq: int,
+        data: Optional[Dict[str, Any]] = None,
+        meta: Optional[Dict[str, Any]] = None,
+        base: Optional[int] = None,
+        delta: Optional[Dict[str, Any]] = None,
+        end: bool = False,
+    ):
+        self.handle = handle
+        self.seq = seq
+        self.data = data or {}
+        self.meta = meta
+        # seq of the chunk `delta` applies to
+        self.base = base
+        self.delta = delta
+        self.end = end
+
+    def message(self, use_delta: bool) -> Dict[str, Any]:
+        message = {"h": self.handle, "s": self.seq}
+        if self.end:
+            message["e"] = 1
+        elif use_delta:
+            message["d"] = self.delta
+        elif "payloads" in self.data:
+            message["ps"] = self.data["payloads"]
+        else:
+            message["p"] = self.data.get("payload")
+        if self.meta:
+            message["m"] = self.meta
+        return message
+
+
+class Expander:
+    """
+    Client side: rebuilds regular messages from compact frames of one
+    connection.
+    """
+
+    def __init__(self):
+        # handle -> [envelope fields, last payload]
+        self._bound = {}
+
+    def expand(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Regular message for `message` (returned as is when not compact).
+        Returns None for a compact frame of an unknown handle.
+        """
+        handle = message.get("h")
+        if handle is None:
+            return message
+
+        if "event" in message:
+            # binding frame: full message plus its handle
+            del message["h"]
+            if message["event"] == Event.STREAM_CHUNK.value:
+                self._bound[handle] = [message, message["data"].get("payload")]
+            return message
+
+        bound = self._bound.get(handle)
+        if bound is None:
+            return None
+        envelope, previous = bound
+
+        if "e" in message:
+            del self._bound[handle]
+            event, data = Event.STREAM_END, {}
+        elif "d" in message:
+            payload = {**previous, **message["d"]}
+            bound[1] = payload
+            event, data = Event.STREAM_CHUNK, {"payload": payload}
+        elif "ps" in message:
+            event, data = Event.STREAM_CHUNK, {"payloads": message["ps"]}
+        else:
+            bound[1] = message.get("p")
+            event, data = Event.STREAM_CHUNK, {"payload": bound[1]}
+
+        expanded = {
+            "protocol": PROTOCOL_VERSION,
+            "event": event.value,
+            "stream_id": envelope["stream_id"],
+            "channel": envelope.get("channel"),
+        }
+        if "channels" in envelope:
+            expanded["channels"] = envelope["channels"]
+        expanded["candidate_id"] = envelope.get("candidate_id")
+        expanded["message_id"] = envelope.get("message_id")
+        expanded["seq"] = message["s"]
+        expanded["data"] = data
+        expanded["meta"] = message.get("m") or {}
+        return expanded
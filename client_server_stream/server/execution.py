@@ -0,0 +1,277 @@
+# client_server_stream/server/execution.py
+"""
+Where plugin streams run.
+
+A plugin picks an execution mode with its `execution` attribute:
+
+    "async"    iterated inline on the event loop (default for async
+               generators)
+    "thread"   iterated on the shared thread pool (default for plain
+               generators); for blocking I/O or CPU work that releases
+               the GIL
+    "process"  iterated in a child of the shared process pool; for CPU
+               work that holds the GIL. The plugin class must be
+               importable and constructible without arguments in the child.
+
+`stream` may be an async generator or a plain generator in any mode.
+Off-loop modes hand chunks back through a bounded queue of
+`queue_size` chunks. A producer that gets ahead of the consumer blocks.
+Cancelling the stream stops the producer at its next chunk.
+
+Pool sizes: STREAM_THREAD_WORKERS and STREAM_PROCESS_WORKERS. A running
+off-loop stream holds one pool worker; streams beyond the pool size wait
+for a free one.
+"""
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterator
+
+from . import settings
+
+log = logging.getLogger(__name__)
+
+EXECUTION_MODES = ("async", "thread", "process")
+
+# seconds a blocked producer or queue reader waits before rechecking
+# for cancellation
+_POLL = 0.1
+
+
+def execution_mode(plugin) -> str:
+    mode = getattr(plugin, "execution", None)
+    if mode is None:
+        return "async" if inspect.isasyncgenfunction(plugin.stream) else "thread"
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Plugin {plugin.name}: unknown execution mode {mode!r}")
+    return mode
+
+
+def _iterate_sync(stream) -> Iterator[Any]:
+    """
+    Iterate a generator or async generator from a thread with no
+    running event loop; always closes it.
+    """
+    if not inspect.isasyncgen(stream):
+        try:
+            yield from stream
+        finally:
+            stream.close()
+        return
+
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
+
+
+# ----------------------------------------------------------------------
+# Thread mode
+# ----------------------------------------------------------------------
+
+class _ThreadBridge:
+    """
+    Bounded handoff from one producer thread to the event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.stop = threading.Event()
+        self._items = deque()
+        self._slots = threading.Semaphore(maxsize)
+        self._ready = asyncio.Event()
+
+    # producer thread
+    def put(self, kind: str, value=None) -> bool:
+        while not self._slots.acquire(timeout=_POLL):
+            if self.stop.is_set():
+                return False
+        if self.stop.is_set():
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._push, (kind, value))
+        except RuntimeError:
+            # loop closed
+            return False
+        return True
+
+    def _push(self, item):
+        self._items.append(item)
+        self._ready.set()
+
+    # event loop
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        item = self._items.popleft()
+        self._slots.release()
+        return item
+
+
+def _produce_threaded(bridge: _ThreadBridge, plugin, payload):
+    try:
+        for chunk in _iterate_sync(plugin.stream(payload)):
+            if not bridge.put("chunk", chunk):
+                return
+        bridge.put("end")
+    except BaseException as e:
+        bridge.put("error", e)
+
+
+# ----------------------------------------------------------------------
+# Process mode
+# ----------------------------------------------------------------------
+
+def _produce_in_process(plugin_cls, payload, chunks, stop):
+    """
+    Runs in a pool process: one stream of a freshly built plugin.
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for chunk in _iterate_sync(plugin_cls().stream(payload)):
+            if not put(("chunk", chunk)):
+                return
+        put(("end", None))
+    except BaseException as e:
+        try:
+            put(("error", e))
+        except Exception:
+            # exception not picklable
+            put(("error", RuntimeError(repr(e))))
+
+
+def _get_from_process(chunks, stop):
+    while not stop.is_set():
+        try:
+            return chunks.get(timeout=_POLL)
+        except queue.Empty:
+            continue
+    return ("end", None)
+
+
+# ----------------------------------------------------------------------
+# Executor
+# ----------------------------------------------------------------------
+
+class PluginExecutor:
+    """
+    Shared pools and the bridges that turn any plugin stream into an
+    async iterator on the event loop.
+    """
+
+    def __init__(
+        self,
+        thread_workers: int = settings.THREAD_WORKERS,
+        process_workers: int = settings.PROCESS_WORKERS,
+        queue_size: int = settings.PLUGIN_QUEUE_SIZE,
+    ):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.queue_size = queue_size
+
+        self._threads = None
+        self._processes = None
+        self._manager = None
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.thread_workers, thread_name_prefix="plugin")
+        return self._threads
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(self.process_workers)
+            # queues and events that can be handed to pool processes
+            self._manager = multiprocessing.Manager()
+        return self._processes
+
+    def stream(self, plugin, payload) -> AsyncIterator[Any]:
+        mode = execution_mode(plugin)
+        if mode == "thread":
+            return self._threaded(plugin, payload)
+        if mode == "process":
+            return self._in_process(plugin, payload)
+        if inspect.isasyncgenfunction(plugin.stream):
+            return plugin.stream(payload)
+        return self._inline(plugin, payload)
+
+    @staticmethod
+    async def _inline(plugin, payload):
+        # plain generator on the loop: yield the loop between chunks
+        stream = plugin.stream(payload)
+        try:
+            for chunk in stream:
+                yield chunk
+                await asyncio.sleep(0)
+        finally:
+            stream.close()
+
+    async def _threaded(self, plugin, payload):
+        loop = asyncio.get_running_loop()
+        bridge = _ThreadBridge(loop, getattr(plugin, "queue_size", None) or self.queue_size)
+        loop.run_in_executor(self.threads, _produce_threaded, bridge, plugin, payload)
+        try:
+            while True:
+                kind, value = await bridge.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "end":
+                    return
+                else:
+                    raise value
+        finally:
+            bridge.stop.set()
+
+    async def _in_process(self, plugin, payload):
+        loop = asyncio.get_running_loop()
+        processes = self.processes
+        chunks = self._manager.Queue(getattr(plugin, "queue_size", None) or self.queue_size)
+        stop = self._manager.Event()
+
+        producer = loop.run_in_executor(processes, _produce_in_process, type(plugin), payload, chunks, stop)
+        try:
+            while True:
+                # the default executor does the blocking reads so that
+                # they never hold a plugin thread
+                kind, value = await loop.run_in_executor(None, _get_from_process, chunks, stop)
+                if kind == "chunk":
+                    yield value
+                elif kind == "end":
+                    break
+                else:
+                    raise value
+            await producer
+        finally:
+            stop.set()
+
+    def shutdown(self):
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+            self._manager.shutdown()
+            self._manager = None
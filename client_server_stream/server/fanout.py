@@ -0,0 +1,131 @@
+# client_server_stream/server/fanout.py
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from .codec import JSON, Codec
+
+
+class Frame:
+    """
+    A protocol message encoded once per codec and shared by every
+    recipient.
+
+    Encodings are produced lazily on first use, so a fan-out to N
+    sockets pays for exactly one encode per codec in use. `encoder`
+    replaces `json.dumps` for the JSON text, e.g. with
+    `EnvelopeTemplate.encode`.
+
+    `compact` is the frame's compact form (server/compact.py) for
+    sockets that negotiated compact mode, None if it has none.
+    """
+
+    __slots__ = ("message", "compact", "_encoder", "_text", "_encoded")
+
+    def __init__(
+        self,
+        message: Dict[str, Any],
+        encoder: Optional[Callable[[Dict[str, Any]], str]] = None,
+        compact=None,
+    ):
+        self.message = message
+        self.compact = compact
+        self._encoder = encoder
+        self._text = None
+        self._encoded = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "Frame":
+        """
+        Frame for a message that arrived already JSON-encoded (e.g. from
+        another worker), keeping the original text.
+        """
+        frame = cls(json.loads(text))
+        frame._text = text
+        return frame
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = (self._encoder or json.dumps)(self.message)
+        return self._text
+
+    def encode(self, codec: Codec) -> Union[str, bytes]:
+        if codec is JSON:
+            return self.text
+
+        if self._encoded is None:
+            self._encoded = {}
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.message)
+        return data
+
+    def encode_compact(self, codec: Codec, kind: str) -> Union[str, bytes]:
+        """
+        Compact encoding, also shared by every recipient: "bind" (the
+        full message plus its handle), "delta" or "full".
+        """
+        if self._encoded is None:
+            self._encoded = {}
+        key = (codec.name, kind)
+        data = self._encoded.get(key)
+        if data is None:
+            if kind == "bind":
+                message = {**self.message, "h": self.compact.handle}
+            else:
+                message = self.compact.message(kind == "delta")
+            data = self._encoded[key] = codec.encode(message)
+        return data
+
+
+class FanOutResult:
+    """
+    Outcome of a single fan-out.
+    """
+
+    __slots__ = ("recipients", "queued", "dropped", "max_depth", "duration")
+
+    def __init__(self, recipients=0, queued=0, dropped=0, max_depth=0, duration=0.0):
+        self.recipients = recipients
+        self.queued = queued
+        self.dropped = dropped
+        # deepest recipient queue after enqueueing
+        self.max_depth = max_depth
+        # seconds spent handing the frame to every recipient
+        self.duration = duration
+
+    def __repr__(self):
+        return (
+            f"FanOutResult(recipients={self.recipients}, queued={self.queued}, "
+            f"dropped={self.dropped}, max_depth={self.max_depth}, "
+            f"duration={self.duration * 1000:.3f}ms)"
+        )
+
+
+def fan_out(subscribers: Iterable, frame: Frame, policy) -> FanOutResult:
+    """
+    Hand one frame to every subscriber's outbound queue.
+
+    Each subscriber's writer task does the actual send (the first one
+    to reach the frame encodes it for all), so this never waits on a
+    socket.
+    """
+    start = time.perf_counter()
+    result = FanOutResult()
+    max_depth = 0
+
+    for sub in subscribers:
+        result.recipients += 1
+        if sub.enqueue(frame, policy):
+            result.queued += 1
+        else:
+            result.dropped += 1
+        depth = len(sub.queue)
+        if depth > max_depth:
+            max_depth = depth
+
+    result.max_depth = max_depth
+
+    result.duration = time.perf_counter() - start
+    return result
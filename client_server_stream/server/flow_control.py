@@ -0,0 +1,88 @@
+# client_server_stream/server/flow_control.py
+"""
+Credit-based flow control for producer streams.
+
+A client opts in by sending an initial window with stream.start:
+
+    "meta": {"credit": {"chunks": 64, "bytes": 262144}}
+
+Either dimension may be left out (unlimited). Each emitted chunk spends
+one chunk credit and `chunk_size(payload)` byte credits. When either
+runs out the server stops pulling from the plugin until the client
+grants more:
+
+    {"event": "stream.credit", "stream_id": ..., "data": {"chunks": 32, "bytes": 131072}}
+
+A batched frame is spent as a whole, so a stream can overshoot its
+window by at most one batch.
+"""
+import asyncio
+from typing import Any, Optional
+
+from .batching import chunk_size
+from .metrics import counter
+
+CREDIT_WAIT = counter(
+    "streamkit_credit_wait_seconds_total",
+    "Time producer streams were suspended waiting for client credit",
+    ("plugin",),
+)
+
+
+class CreditWindow:
+    __slots__ = ("chunks", "bytes", "_granted")
+
+    def __init__(self, chunks: Optional[int] = None, bytes: Optional[int] = None):
+        # remaining credit per dimension; None = not limited
+        self.chunks = chunks
+        self.bytes = bytes
+        self._granted = asyncio.Event()
+
+    @classmethod
+    def from_meta(cls, value: Any) -> Optional["CreditWindow"]:
+        """
+        Window for a stream.start `meta.credit`, None when absent.
+        """
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise ValueError("credit must be an object")
+        chunks = _amount(value, "chunks")
+        nbytes = _amount(value, "bytes")
+        if chunks is None and nbytes is None:
+            raise ValueError("credit needs 'chunks' and/or 'bytes'")
+        return cls(chunks, nbytes)
+
+    def available(self) -> bool:
+        return (self.chunks is None or self.chunks > 0) and (self.bytes is None or self.bytes > 0)
+
+    def spend(self, payloads) -> None:
+        if self.chunks is not None:
+            self.chunks -= len(payloads)
+        if self.bytes is not None:
+            self.bytes -= sum(chunk_size(p) for p in payloads)
+
+    def grant(self, chunks: int = 0, nbytes: int = 0) -> None:
+        if self.chunks is not None:
+            self.chunks += chunks
+        if self.bytes is not None:
+            self.bytes += nbytes
+        if self.available():
+            self._granted.set()
+
+    async def wait(self) -> None:
+        """
+        Return once there is credit left in every limited dimension.
+        """
+        while not self.available():
+            self._granted.clear()
+            await self._granted.wait()
+
+
+def _amount(value: dict, key: str) -> Optional[int]:
+    amount = value.get(key)
+    if amount is None:
+        return None
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount < 0:
+        raise ValueError(f"credit {key} must be a non-negative integer")
+    return amount
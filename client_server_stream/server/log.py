@@ -0,0 +1,46 @@
+# client_server_stream/server/log.py
+"""
+Leveled, sampled logging for the server.
+
+Per-message events (received frames, plugin chunks, emits) go through a
+Sampler so that even at DEBUG level only every Nth one is formatted.
+"""
+import logging
+
+from . import settings
+
+ROOT = "client_server_stream"
+
+
+def configure_logging() -> None:
+    """
+    Apply settings.LOG_LEVEL to the package loggers. Installs a stderr
+    handler only if the host (e.g. uvicorn) has not configured one.
+    """
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(settings.LOG_LEVEL)
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+
+
+class Sampler:
+    """
+    Lets one call in `every` through; `every=0` disables.
+    """
+
+    __slots__ = ("every", "_count")
+
+    def __init__(self, every: int = settings.LOG_SAMPLE_EVERY):
+        self.every = every
+        self._count = 0
+
+    def __call__(self) -> bool:
+        if not self.every:
+            return False
+        self._count += 1
+        if self._count >= self.every:
+            self._count = 0
+            return True
+        return False
@@ -0,0 +1,205 @@
+# client_server_stream/server/metrics.py
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Hot-path cost is a dict lookup plus an integer add (counters) or a
+bisect (histograms); nothing is formatted until /metrics is scraped.
+"""
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# seconds: 100us .. 10s
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """
+        (name suffix, rendered labels, value) of every exposed series.
+        """
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonic counter, optionally split by labels (passed positionally).
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield "", _labels(self.labelnames, labels), value
+
+
+class Gauge(Metric):
+    """
+    Point-in-time value; either set explicitly or read from `fn` at
+    scrape time.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn: Callable[[], float] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+    def samples(self):
+        if self._fn is not None:
+            yield "", "", self._fn()
+        for labels, value in list(self._values.items()):
+            yield "", _labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    """
+    Cumulative-bucket histogram.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(float(bound)) + '"'
+                yield "_bucket", _labels(self.labelnames, labels, le), cumulative
+            yield "_sum", _labels(self.labelnames, labels), total
+            yield "_count", _labels(self.labelnames, labels), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=(), fn=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, fn))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# ----------------------------------------------------------------------
+# Server metrics
+# ----------------------------------------------------------------------
+
+STREAMS_STARTED = counter(
+    "streamkit_streams_started_total", "Streams started", ("plugin", "client")
+)
+STREAMS_ENDED = counter(
+    "streamkit_streams_ended_total", "Streams that ran to completion", ("plugin", "client")
+)
+STREAMS_CANCELLED = counter(
+    "streamkit_streams_cancelled_total", "Streams cancelled before completion", ("plugin", "client")
+)
+STREAMS_ERRORED = counter(
+    "streamkit_streams_errored_total", "Streams whose plugin raised", ("plugin", "client")
+)
+CHUNKS_SENT = counter(
+    "streamkit_chunks_total", "Chunk messages emitted", ("plugin",)
+)
+
+TIME_TO_FIRST_CHUNK = histogram(
+    "streamkit_time_to_first_chunk_seconds", "Stream start to first plugin chunk", ("plugin",)
+)
+INTER_CHUNK_GAP = histogram(
+    "streamkit_inter_chunk_gap_seconds", "Time between consecutive plugin chunks", ("plugin",)
+)
+FANOUT_DURATION = histogram(
+    "streamkit_fanout_duration_seconds", "Time to hand one frame to all recipients"
+)
+SEND_QUEUE_DEPTH = histogram(
+    "streamkit_send_queue_depth",
+    "Deepest recipient send queue per fan-out",
+    buckets=DEPTH_BUCKETS,
+)
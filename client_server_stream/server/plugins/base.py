@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import AsyncIterator, Any
+from typing import AsyncIterator, Any, Optional
+
+from ..batching import BatchPolicy
+from .. import settings
 
 
 class StreamPlugin(ABC):
@@ -9,6 +12,48 @@ class StreamPlugin(ABC):
 
     name: str  # REQUIRED, must be unique
 
+    # Default micro-batching of chunks; None sends every chunk as its own
+    # frame. Requests can override it through `meta.batch`.
+    batch: Optional[BatchPolicy] = None
+
+    # Opt-in result sharing (see server/stream_cache.py): None disables,
+    # 0 only dedupes concurrent identical requests, > 0 also replays
+    # completed streams for that many seconds.
+    cache_ttl: Optional[float] = None
+
+    # Recent chunks kept per stream so /observe can resume mid-stream;
+    # 0 disables resume for this plugin.
+    replay_buffer: int = settings.REPLAY_BUFFER_SIZE
+
+    # Scheduling class (server/scheduler.py): "interactive", "normal" or
+    # "batch"; decides the stream's share of the event loop.
+    priority: str = "normal"
+
+    # Where `stream` runs (server/execution.py): "async", "thread" or
+    # "process". None picks "async" for async generators and "thread"
+    # for plain generators. Off-loop modes buffer at most `queue_size`
+    # chunks (None: STREAM_PLUGIN_QUEUE_SIZE).
+    execution: Optional[str] = None
+    queue_size: Optional[int] = None
+
+    # Seconds a stream may run in total, and without emitting a chunk,
+    # before it is cancelled (server/stream_registry.py); 0 disables.
+    max_duration: float = settings.STREAM_MAX_DURATION
+    idle_timeout: float = settings.STREAM_IDLE_TIMEOUT
+
+    async def startup(self) -> None:
+        """
+        Called once when the app starts; open shared resources here.
+        """
+
+    async def shutdown(self) -> None:
+        """
+        Called once when the app stops; release shared resources here.
+        """
+
     @abstractmethod
     async def stream(self, payload: Any) -> AsyncIterator[Any]:
-        pass
+        """
+        Yield the chunks for `payload`. May also be a plain (sync)
+        generator, see `execution`.
+        """
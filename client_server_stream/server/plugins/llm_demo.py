@@ -1,22 +1,73 @@
+import logging
+
 import httpx
 from .base import StreamPlugin
+from .. import settings
+
+log = logging.getLogger(__name__)
+
+
+def _build_client() -> httpx.AsyncClient:
+    kwargs = dict(
+        timeout=httpx.Timeout(
+            connect=settings.LLM_DEMO_CONNECT_TIMEOUT,
+            read=settings.LLM_DEMO_READ_TIMEOUT,
+            write=settings.LLM_DEMO_CONNECT_TIMEOUT,
+            pool=settings.LLM_DEMO_CONNECT_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_DEMO_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_DEMO_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_DEMO_KEEPALIVE_EXPIRY,
+        ),
+        headers={"ngrok-skip-browser-warning": "true"},
+    )
+
+    if settings.LLM_DEMO_HTTP2:
+        try:
+            return httpx.AsyncClient(http2=True, **kwargs)
+        except ImportError:
+            log.warning("h2 not installed, llm_demo upstream falls back to HTTP/1.1")
+
+    return httpx.AsyncClient(**kwargs)
 
 
 class LLMDemoPlugin(StreamPlugin):
     name = "llm_demo"
+    # identical prompts share one upstream generation
+    cache_ttl = settings.LLM_DEMO_CACHE_TTL
+    # token latency is user-visible
+    priority = "interactive"
+
+    def __init__(self):
+        # One pooled client per process, shared by every stream
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Opened by startup(); created lazily when used outside the app lifespan
+        if self._client is None or self._client.is_closed:
+            self._client = _build_client()
+        return self._client
+
+    async def startup(self):
+        if self._client is None:
+            self._client = _build_client()
+
+    async def shutdown(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def stream(self, prompt: str):
-        print("CALLING HF SERVICE:", prompt)
-
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream(
-                "POST",
-                "https://unirritable-onomatopoetically-donna.ngrok-free.dev/generate",
-                headers={"ngrok-skip-browser-warning": "true"},
-                json={"prompt": prompt},
-            ) as response:
-
-                async for chunk in response.aiter_text():
-                    if chunk.strip():
-                        print("TOKEN:", chunk)
-                        yield chunk
+        log.debug("calling HF service: %r", prompt)
+
+        async with self.client.stream(
+            "POST",
+            settings.LLM_DEMO_URL,
+            json={"prompt": prompt},
+        ) as response:
+
+            async for chunk in response.aiter_text():
+                if chunk.strip():
+                    yield chunk
@@ -1,18 +1,32 @@
 # client_server_stream/server/plugins/loader.py
+import ast
 import importlib
+import json
+import logging
+import os
 import pkgutil
-from typing import Dict
+from typing import Dict, Optional
 
 from client_server_stream.server.plugins.base import StreamPlugin
 import client_server_stream.server.plugins as plugins_pkg
 
+log = logging.getLogger(__name__)
+
+# Entry point group through which installed packages declare plugins:
+#     [project.entry-points."streamkit.plugins"]
+#     my_plugin = "my_package.plugin:MyPlugin"
+ENTRY_POINT_GROUP = "streamkit.plugins"
+
+# Modules of the package that never hold plugins
+_SKIP = ("base", "loader", "registry")
+
 
 def discover_plugins() -> Dict[str, StreamPlugin]:
     plugins: Dict[str, StreamPlugin] = {}
 
     # IMPORTANT: use the package's __path__, not this module's
     for _, module_name, _ in pkgutil.iter_modules(plugins_pkg.__path__):
-        if module_name in ("base", "loader"):
+        if module_name in _SKIP:
             continue
 
         module = importlib.import_module(
@@ -40,3 +54,123 @@ def discover_plugins() -> Dict[str, StreamPlugin]:
                 plugins[instance.name] = instance
 
     return plugins
+
+
+# ----------------------------------------------------------------------
+# Manifest: plugin name -> "module:Class", without importing anything
+# ----------------------------------------------------------------------
+
+def _module_files() -> Dict[str, str]:
+    files = {}
+    for finder, module_name, is_pkg in pkgutil.iter_modules(plugins_pkg.__path__):
+        if module_name in _SKIP or is_pkg:
+            continue
+        files[f"{plugins_pkg.__name__}.{module_name}"] = os.path.join(finder.path, module_name + ".py")
+    return files
+
+
+def _scan_module(module: str, path: str) -> Dict[str, str]:
+    """
+    Plugin classes defined in one source file, found by parsing it.
+
+    A class counts when it derives (directly or through other classes of
+    the same file) from StreamPlugin and assigns `name` a string literal.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    plugin_classes = {"StreamPlugin"}
+    found = {}
+    # classes are defined before their subclasses, one pass suffices
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        bases = {b.id if isinstance(b, ast.Name) else getattr(b, "attr", None) for b in node.bases}
+        if not bases & plugin_classes:
+            continue
+        plugin_classes.add(node.name)
+
+        for stmt in node.body:
+            if (
+                isinstance(stmt, ast.Assign)
+                and any(isinstance(t, ast.Name) and t.id == "name" for t in stmt.targets)
+            ):
+                if isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+                    found[stmt.value.value] = f"{module}:{node.name}"
+                else:
+                    log.warning("plugin %s.%s: name is not a string literal, skipped", module, node.name)
+                break
+    return found
+
+
+def _entry_points() -> Dict[str, str]:
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    # Python < 3.10 returns a dict of groups
+    eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, "select") else eps.get(ENTRY_POINT_GROUP, ())
+    return {ep.name: ep.value for ep in eps}
+
+
+def build_manifest(cache_path: Optional[str] = None) -> Dict[str, str]:
+    """
+    Map every plugin name to its "module:Class" target.
+
+    Built-in plugins are found by parsing the modules of this package,
+    installed ones through the `streamkit.plugins` entry point group.
+    With `cache_path`, the scan of the package is cached in that JSON
+    file and reused while no module changed.
+    """
+    files = _module_files()
+    mtimes = {module: os.path.getmtime(path) for module, path in files.items()}
+
+    builtin = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("modules") == mtimes:
+                builtin = cached["plugins"]
+        except (OSError, ValueError, KeyError):
+            log.warning("plugin manifest %s unreadable, rebuilding", cache_path)
+
+    if builtin is None:
+        builtin = {}
+        for module, path in files.items():
+            for name, target in _scan_module(module, path).items():
+                if name in builtin:
+                    raise RuntimeError(f"Duplicate plugin name: {name}")
+                builtin[name] = target
+
+        if cache_path:
+            try:
+                with open(cache_path, "w", encoding="utf-8") as f:
+                    json.dump({"modules": mtimes, "plugins": builtin}, f)
+            except OSError as e:
+                log.warning("plugin manifest %s not written: %s", cache_path, e)
+
+    manifest = dict(builtin)
+    for name, target in _entry_points().items():
+        if name in manifest:
+            raise RuntimeError(f"Duplicate plugin name: {name}")
+        manifest[name] = target
+    return manifest
+
+
+def load_plugin(target: str, name: str, reload: bool = False) -> StreamPlugin:
+    """
+    Import the "module:Class" `target` and instantiate it.
+    """
+    module_name, _, class_name = target.partition(":")
+    module = importlib.import_module(module_name)
+    if reload:
+        module = importlib.reload(module)
+
+    cls = getattr(module, class_name)
+    if not (isinstance(cls, type) and issubclass(cls, StreamPlugin)):
+        raise RuntimeError(f"{target} is not a StreamPlugin")
+
+    instance = cls()
+    if getattr(instance, "name", None) != name:
+        raise RuntimeError(f"{target} is named {getattr(instance, 'name', None)!r}, not {name!r}")
+    return instance
@@ -5,6 +5,10 @@ from .base import StreamPlugin
 
 class ProgressStreamPlugin(StreamPlugin):
     name = "progress"
+    # concurrent identical jobs share one run; finished runs are not
+    # replayed since the pacing is part of the output
+    cache_ttl = 0
+    priority = "batch"
 
     async def stream(self, payload: dict):
         """
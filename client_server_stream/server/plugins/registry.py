@@ -0,0 +1,238 @@
+# client_server_stream/server/plugins/registry.py
+"""
+Lazy plugin registry.
+
+The registry starts from a manifest (name -> "module:Class", see
+loader.build_manifest) and imports nothing up front. A plugin is
+imported, instantiated and started on its first stream. Concurrent
+first streams share that one load. The import runs in a worker thread,
+so it does not stall the event loop. `warm` loads plugins ahead of
+time.
+
+`reload` re-reads the manifest and swaps in freshly imported instances
+of plugins whose source changed. Streams that are already running keep
+the instance they started with. A replaced instance is shut down once
+its last stream ends.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from .base import StreamPlugin
+from .loader import build_manifest, load_plugin
+from ..execution import execution_mode
+from ..metrics import histogram
+from .. import settings
+
+log = logging.getLogger(__name__)
+
+PLUGIN_LOAD = histogram(
+    "streamkit_plugin_load_seconds",
+    "Time to import, instantiate and start a plugin",
+    ("plugin",),
+)
+
+
+def _source_mtime(plugin: StreamPlugin) -> Optional[float]:
+    try:
+        return os.path.getmtime(inspect.getfile(type(plugin)))
+    except (OSError, TypeError):
+        return None
+
+
+class PluginRegistry:
+    def __init__(self, manifest_path: Optional[str] = settings.PLUGIN_MANIFEST):
+        self.manifest_path = manifest_path or None
+        self.manifest: Dict[str, str] = build_manifest(self.manifest_path)
+
+        # name -> current instance
+        self.loaded: Dict[str, StreamPlugin] = {}
+        # instance -> streams using it
+        self._users: Dict[StreamPlugin, int] = {}
+        # replaced instances, shut down when their last stream ends
+        self._retired = set()
+        # name -> load in progress (single flight)
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._mtimes: Dict[str, Optional[float]] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._reload_lock = asyncio.Lock()
+
+    def __contains__(self, name) -> bool:
+        return name in self.manifest
+
+    def names(self):
+        return list(self.manifest)
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    async def get(self, name) -> Optional[StreamPlugin]:
+        """
+        The current instance of `name`, loading it on first use. Returns
+        None for unknown plugins; raises if the plugin fails to load.
+        """
+        plugin = self.loaded.get(name)
+        if plugin is not None:
+            return plugin
+        if name not in self.manifest:
+            return None
+
+        pending = self._loading.get(name)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # the load we joined was cancelled with its caller: retry
+            return await self.get(name)
+
+        pending = self._loading[name] = asyncio.get_running_loop().create_future()
+        try:
+            plugin = await self._instantiate(name)
+        except Exception as e:
+            pending.set_exception(e)
+            # retrieved here so a load nobody else waited for is not reported twice
+            pending.exception()
+            raise
+        else:
+            self.loaded[name] = plugin
+            pending.set_result(plugin)
+            return plugin
+        finally:
+            # a cancelled load must not leave its joiners waiting
+            if not pending.done():
+                pending.cancel()
+            del self._loading[name]
+
+    async def acquire(self, name) -> Optional[StreamPlugin]:
+        """
+        `get` for a stream: the instance stays alive until `release`.
+        """
+        plugin = await self.get(name)
+        if plugin is not None:
+            self._users[plugin] = self._users.get(plugin, 0) + 1
+        return plugin
+
+    def release(self, plugin: StreamPlugin) -> None:
+        users = self._users.get(plugin, 0) - 1
+        if users > 0:
+            self._users[plugin] = users
+            return
+        self._users.pop(plugin, None)
+        if plugin in self._retired:
+            self._retired.discard(plugin)
+            asyncio.get_running_loop().create_task(self._shutdown(plugin))
+
+    async def _instantiate(self, name, reload: bool = False) -> StreamPlugin:
+        target = self.manifest[name]
+        started = time.perf_counter()
+
+        plugin = await asyncio.to_thread(load_plugin, target, name, reload)
+        # fail before the first stream, not in it
+        execution_mode(plugin)
+        await plugin.startup()
+
+        elapsed = time.perf_counter() - started
+        PLUGIN_LOAD.observe(elapsed, name)
+        self._load_seconds[name] = elapsed
+        self._mtimes[name] = _source_mtime(plugin)
+        log.info("plugin %s loaded from %s in %.1f ms", name, target, elapsed * 1000)
+        return plugin
+
+    async def warm(self, names: Iterable[str] = ()) -> None:
+        """
+        Load plugins ahead of their first stream ("*" for all of them).
+        Failures are logged, the plugin is retried on first use.
+        """
+        names = list(names)
+        if "*" in names:
+            names = self.names()
+        for name in names:
+            try:
+                if await self.get(name) is None:
+                    log.warning("cannot warm unknown plugin %s", name)
+            except Exception:
+                log.exception("plugin %s failed to load", name)
+
+    # ------------------------------------------------------------------
+    # Hot reload
+    # ------------------------------------------------------------------
+
+    async def reload(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Re-read the manifest and reload loaded plugins: those in `names`,
+        or (None) those whose source file changed since they were loaded.
+        A plugin that fails to reload keeps its current instance.
+
+        Returns name -> outcome ("reloaded", "removed" or "failed").
+        """
+        async with self._reload_lock:
+            self.manifest = await asyncio.to_thread(build_manifest, self.manifest_path)
+            outcome = {}
+
+            for name, current in list(self.loaded.items()):
+                if name not in self.manifest:
+                    del self.loaded[name]
+                    await self._retire(current)
+                    outcome[name] = "removed"
+                    continue
+
+                if names is None:
+                    if _source_mtime(current) == self._mtimes.get(name):
+                        continue
+                elif name not in names:
+                    continue
+
+                try:
+                    plugin = await self._instantiate(name, reload=True)
+                except Exception:
+                    log.exception("plugin %s failed to reload, keeping the running version", name)
+                    outcome[name] = "failed"
+                    continue
+
+                self.loaded[name] = plugin
+                await self._retire(current)
+                outcome[name] = "reloaded"
+
+            return outcome
+
+    async def _retire(self, plugin: StreamPlugin):
+        if self._users.get(plugin):
+            self._retired.add(plugin)
+        else:
+            await self._shutdown(plugin)
+
+    @staticmethod
+    async def _shutdown(plugin: StreamPlugin):
+        try:
+            await plugin.shutdown()
+        except Exception:
+            log.exception("plugin %s shutdown failed", plugin.name)
+
+    async def shutdown(self):
+        """
+        Run the shutdown hooks of every loaded plugin (app lifespan end).
+        """
+        plugins = list(self.loaded.values()) + list(self._retired)
+        self.loaded.clear()
+        self._retired.clear()
+        for plugin in plugins:
+            await self._shutdown(plugin)
+
+    def stats(self) -> dict:
+        return {
+            "available": self.names(),
+            "loaded": {
+                name: {
+                    "streams": self._users.get(plugin, 0),
+                    "load_ms": round(self._load_seconds.get(name, 0.0) * 1000, 3),
+                }
+                for name, plugin in self.loaded.items()
+            },
+            "retired": len(self._retired),
+        }
@@ -1,7 +1,9 @@
-from email.mime import message
-from typing import Any, Dict, Optional
+import json
+from typing import Any, Dict, List, Optional
 from enum import Enum
 
+from . import settings
+
 PROTOCOL_VERSION = "streamkit/1.0"
 
 
@@ -10,6 +12,9 @@ class Event(str, Enum):
     STREAM_CHUNK = "stream.chunk"
     STREAM_END = "stream.end"
     STREAM_CANCEL = "stream.cancel"
+    STREAM_CREDIT = "stream.credit"
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
     ERROR = "error"
 
 
@@ -26,11 +31,6 @@ class ProtocolError(Exception):
     """Raised when a protocol violation occurs."""
 
 
-# add to the top imports if needed
-from typing import Any, Dict, Optional
-
-# Keep PROTOCOL_VERSION, Event, REQUIRED_FIELDS as-is
-
 def validate_message(message: Dict[str, Any]) -> None:
     if not isinstance(message, dict):
         raise ProtocolError("Message must be a JSON object")
@@ -73,6 +73,10 @@ def validate_message(message: Dict[str, Any]) -> None:
         if not isinstance(message["message_id"], str):
             raise ProtocolError("message_id must be a string")
 
+    if "seq" in message and message["seq"] is not None:
+        if not isinstance(message["seq"], int) or isinstance(message["seq"], bool):
+            raise ProtocolError("seq must be an integer")
+
     if not isinstance(message["data"], dict):
         raise ProtocolError("data must be an object")
 
@@ -89,7 +93,15 @@ def build_message(
     message_id: Optional[str] = None,
     data: Optional[Dict[str, Any]] = None,
     meta: Optional[Dict[str, Any]] = None,
+    validate: Optional[bool] = None,
 ) -> Dict[str, Any]:
+    """
+    Build an outbound protocol message.
+
+    Messages built here come from trusted code, so they are only
+    validated when `validate` is set or in debug mode
+    (settings.DEBUG_VALIDATE).
+    """
     message = {
         "protocol": PROTOCOL_VERSION,
         "event": event.value,
@@ -101,10 +113,104 @@ def build_message(
         "meta": meta or {},
     }
 
-    validate_message(message)
+    if validate if validate is not None else settings.DEBUG_VALIDATE:
+        validate_message(message)
     return message
 
 
+class EnvelopeTemplate:
+    """
+    Pre-encoded envelope for the outbound messages of one stream.
+
+    Built once at stream.start: the invariant fields (protocol,
+    stream_id, channel, candidate_id, message_id) are JSON-encoded a
+    single time, so each chunk only serializes its own seq, data and
+    meta and splices them in. `encode(message)` produces exactly what
+    `json.dumps` would.
+
+    `channels` lists every channel a frame is delivered on when there is
+    more than one (`channel` is then the first of them).
+    """
+
+    __slots__ = ("stream_id", "channel", "channels", "candidate_id", "message_id", "_fields", "_prefixes")
+
+    def __init__(
+        self,
+        *,
+        stream_id: Optional[str] = None,
+        channel: Optional[str] = None,
+        candidate_id: Optional[str] = None,
+        message_id: Optional[str] = None,
+        channels: Optional[List[str]] = None,
+    ):
+        self.stream_id = stream_id
+        self.channel = channel
+        self.channels = channels
+        self.candidate_id = candidate_id
+        self.message_id = message_id
+
+        fields = {"stream_id": stream_id, "channel": channel}
+        if channels:
+            fields["channels"] = channels
+        fields["candidate_id"] = candidate_id
+        fields["message_id"] = message_id
+        encoded = json.dumps(fields)
+        # '"stream_id": ..., "message_id": ...' without the braces
+        self._fields = encoded[1:-1]
+        # event value -> '{"protocol": ..., "message_id": ..., '
+        self._prefixes = {}
+
+    def message(
+        self,
+        event: Event,
+        data: Optional[Dict[str, Any]] = None,
+        meta: Optional[Dict[str, Any]] = None,
+        seq: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Build a message on this envelope (validated only in debug mode).
+        """
+        message = {
+            "protocol": PROTOCOL_VERSION,
+            "event": event.value,
+            "stream_id": self.stream_id,
+            "channel": self.channel,
+        }
+        if self.channels:
+            message["channels"] = self.channels
+        message["candidate_id"] = self.candidate_id
+        message["message_id"] = self.message_id
+        if seq is not None:
+            message["seq"] = seq
+        message["data"] = data or {}
+        message["meta"] = meta or {}
+
+        if settings.DEBUG_VALIDATE:
+            validate_message(message)
+        return message
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        """
+        Serialize a message built by `message()`.
+        """
+        event = message["event"]
+        prefix = self._prefixes.get(event)
+        if prefix is None:
+            prefix = self._prefixes[event] = (
+                f'{{"protocol": {json.dumps(PROTOCOL_VERSION)}, "event": {json.dumps(event)}, '
+                f'{self._fields}, '
+            )
+
+        seq = message.get("seq")
+        meta = message["meta"]
+        return (
+            prefix
+            + ('"data": ' if seq is None else f'"seq": {seq:d}, "data": ')
+            + json.dumps(message["data"])
+            + (', "meta": ' + json.dumps(meta) + "}" if meta else ', "meta": {}}')
+        )
+
+
 def error_message(
     *,
     stream_id: Optional[str],
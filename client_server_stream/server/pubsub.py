@@ -0,0 +1,259 @@
+# client_server_stream/server/pubsub.py
+"""
+Router backends: how fan-outs reach sockets held by other worker
+processes.
+
+The router always delivers to its own sockets first and then hands the
+fan-out to its backend. `LocalBackend` (the default) stops there, which
+is the single-process behaviour. `RedisBackend` publishes fan-outs to a
+shared Redis-protocol channel, batched per event-loop tick, and delivers
+what other workers published to the local sockets. Workers tag their
+batches with a random worker id and ignore their own, so nothing is
+delivered twice.
+
+The backend is picked with STREAM_ROUTER_BACKEND (empty for local,
+redis://host:port/db or unix:///path for shared). For development,
+server/broker.py is a stand-in that speaks enough of the protocol.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable, Optional
+
+from .fanout import Frame
+from .metrics import counter
+from .resp import RespConnection, RespError
+
+log = logging.getLogger(__name__)
+
+BACKEND_MESSAGES = counter(
+    "streamkit_router_backend_messages_total",
+    "Fan-outs exchanged with other workers (published, received, dropped)",
+    ("direction",),
+)
+
+# deliver(op, key, channel, frame) where op is one of the router's
+# emit operations: "emit", "broadcast", "emit_candidate", "emit_channel",
+# or "emit_routes" (key is then the list of routes)
+Deliver = Callable[[str, Optional[str], Optional[str], Frame], None]
+
+
+class RouterBackend:
+    """
+    Base class; the default implementation is in-process only.
+    """
+
+    name = "local"
+
+    async def start(self, deliver: Deliver):
+        pass
+
+    def publish(self, op: str, key, channel, frame: Frame):
+        """
+        Hand a fan-out that was already delivered locally to the other
+        workers. Must not block.
+        """
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+LocalBackend = RouterBackend
+
+
+class RedisBackend(RouterBackend):
+    """
+    Pub/sub over a Redis-protocol server.
+
+    One connection publishes, one subscribes. Fan-outs published during
+    the same tick (e.g. one chunk going to several channels) are sent as
+    a single PUBLISH of a JSON batch {"w": worker_id, "m": [[op, key,
+    channel, frame_text], ...]}.
+
+    At most `max_buffer` fan-outs wait to be published; beyond that the
+    oldest are dropped. When a publish fails, everything buffered is
+    dropped too: remote observers would only get a stale backlog once
+    the server is back.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        topic: str = "streamkit:router",
+        max_batch: int = 512,
+        reconnect_delay: float = 1.0,
+        max_buffer: int = 10000,
+    ):
+        self.url = url
+        self.topic = topic
+        self.max_batch = max_batch
+        self.reconnect_delay = reconnect_delay
+        self.max_buffer = max_buffer
+        self.worker_id = uuid.uuid4().hex
+
+        self._deliver: Optional[Deliver] = None
+        self._pub: Optional[RespConnection] = None
+        self._buffer = []
+        self._pending = asyncio.Event()
+        self._tasks = []
+
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._pub = await RespConnection.open(self.url)
+        subscribed = asyncio.get_running_loop().create_future()
+        self._tasks = [
+            asyncio.create_task(self._publisher()),
+            asyncio.create_task(self._subscriber(subscribed)),
+        ]
+        await subscribed
+        log.info("router backend %s started (worker %s)", self.url, self.worker_id)
+
+    def publish(self, op, key, channel, frame):
+        if len(self._buffer) >= self.max_buffer:
+            del self._buffer[0]
+            self._count_dropped(1)
+        self._buffer.append([op, key, channel, frame.text])
+        self._pending.set()
+
+    def _count_dropped(self, n):
+        self.dropped += n
+        BACKEND_MESSAGES.inc("dropped", amount=n)
+
+    # ------------------------------------------------------------------
+    # Outbound
+    # ------------------------------------------------------------------
+
+    async def _publisher(self):
+        while True:
+            await self._pending.wait()
+            # let the rest of this tick's fan-outs join the batch
+            await asyncio.sleep(0)
+            self._pending.clear()
+
+            while self._buffer:
+                batch = self._buffer[:self.max_batch]
+                del self._buffer[:self.max_batch]
+                await self._send(batch)
+
+    async def _send(self, batch):
+        payload = json.dumps({"w": self.worker_id, "m": batch}, separators=(",", ":"))
+        try:
+            if self._pub is None:
+                self._pub = await RespConnection.open(self.url)
+            await self._pub.execute("PUBLISH", self.topic, payload)
+        except (OSError, ConnectionError, RespError) as e:
+            # remote observers miss this batch and what queued up behind
+            # it; local ones already have it
+            self._count_dropped(len(batch) + len(self._buffer))
+            self._buffer.clear()
+            log.warning("router backend publish failed: %s", e)
+            if self._pub is not None:
+                await self._pub.close()
+                self._pub = None
+            await asyncio.sleep(self.reconnect_delay)
+            return
+
+        self.published += len(batch)
+        BACKEND_MESSAGES.inc("published", amount=len(batch))
+
+    # ------------------------------------------------------------------
+    # Inbound
+    # ------------------------------------------------------------------
+
+    async def _subscriber(self, subscribed: asyncio.Future):
+        while True:
+            conn = None
+            try:
+                conn = await RespConnection.open(self.url)
+                conn.send("SUBSCRIBE", self.topic)
+                await conn.writer.drain()
+                reply = await conn.read()  # ["subscribe", topic, 1]
+                if isinstance(reply, RespError):
+                    raise reply
+                if not subscribed.done():
+                    subscribed.set_result(None)
+
+                while True:
+                    reply = await conn.read()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self._receive(reply[2])
+
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, RespError) as e:
+                if not subscribed.done():
+                    subscribed.set_exception(e)
+                    return
+                log.warning("router backend subscription lost: %s", e)
+            except Exception as e:
+                if not subscribed.done():
+                    subscribed.set_exception(e)
+                    return
+                log.exception("router backend subscription failed, reconnecting")
+            finally:
+                if conn is not None:
+                    await conn.close()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _receive(self, payload: bytes):
+        try:
+            batch = json.loads(payload)
+            messages = batch.get("m", ())
+        except (ValueError, AttributeError):
+            messages = None
+        if not isinstance(messages, list):
+            log.warning("router backend: undecodable batch ignored")
+            return
+
+        if batch.get("w") == self.worker_id:
+            return
+
+        for message in messages:
+            self.received += 1
+            BACKEND_MESSAGES.inc("received")
+            try:
+                op, key, channel, text = message
+                self._deliver(op, key, channel, Frame.from_text(text))
+            except Exception:
+                log.exception("router backend: delivering a fan-out failed")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pub is not None:
+            await self._pub.close()
+            self._pub = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "pending": len(self._buffer),
+        }
+
+
+def create_backend(url: Optional[str]) -> RouterBackend:
+    """
+    Backend for a STREAM_ROUTER_BACKEND value.
+    """
+    if not url:
+        return LocalBackend()
+    if url.startswith(("redis://", "tcp://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported router backend: {url}")
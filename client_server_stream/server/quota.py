@@ -0,0 +1,145 @@
+# client_server_stream/server/quota.py
+"""
+Throughput quotas per API key: token buckets on chunks/sec and
+bytes/sec, configured with `max_streams` in the key metadata (server/auth.py):
+
+    "user1-key": {
+        "client": "user1",
+        "max_streams": 5,
+        "chunks_per_sec": 500,     # optional
+        "bytes_per_sec": 1000000,  # optional
+        "chunks_burst": 1000,      # optional, defaults to one second's worth
+        "bytes_burst": 2000000,    # optional
+    }
+
+Keys without these fields are not limited (the built-in keys have
+none). A stream over budget is paced (StreamManager sleeps before
+pulling its next chunk), never cut off. All streams of a key share its
+buckets. Buckets are per process; with several workers each enforces
+the limit on its own share of the streams.
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from .metrics import counter
+
+QUOTA_CHUNKS = counter("streamkit_quota_chunks_total", "Chunks emitted per client", ("client",))
+QUOTA_BYTES = counter("streamkit_quota_bytes_total", "Encoded chunk bytes emitted per client", ("client",))
+QUOTA_THROTTLED = counter(
+    "streamkit_quota_throttled_seconds_total",
+    "Time streams were paced by their client's quota",
+    ("client",),
+)
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `burst`. Taking more than
+    is available goes into debt; the caller waits it off.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, amount: float, now: float) -> float:
+        """
+        Consume `amount` tokens; returns the seconds to wait until the
+        bucket is out of debt (0 if it is not in debt).
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Quota:
+    """
+    Buckets and consumption counters of one client.
+    """
+
+    def __init__(
+        self,
+        client: str,
+        chunks_per_sec: Optional[float] = None,
+        bytes_per_sec: Optional[float] = None,
+        chunks_burst: Optional[float] = None,
+        bytes_burst: Optional[float] = None,
+    ):
+        self.client = client
+        self.chunks = TokenBucket(chunks_per_sec, chunks_burst) if chunks_per_sec else None
+        self.bytes = TokenBucket(bytes_per_sec, bytes_burst) if bytes_per_sec else None
+
+        self.used_chunks = 0
+        self.used_bytes = 0
+        self.throttled = 0.0
+
+    @classmethod
+    def from_client_info(cls, client_info: dict) -> "Quota":
+        return cls(
+            client_info["client"],
+            chunks_per_sec=client_info.get("chunks_per_sec"),
+            bytes_per_sec=client_info.get("bytes_per_sec"),
+            chunks_burst=client_info.get("chunks_burst"),
+            bytes_burst=client_info.get("bytes_burst"),
+        )
+
+    async def pace(self, chunks: int, nbytes: int) -> float:
+        """
+        Account for emitted chunks and sleep off any debt. Returns the
+        seconds slept.
+        """
+        self.used_chunks += chunks
+        self.used_bytes += nbytes
+        QUOTA_CHUNKS.inc(self.client, amount=chunks)
+        QUOTA_BYTES.inc(self.client, amount=nbytes)
+
+        if self.chunks is None and self.bytes is None:
+            return 0.0
+
+        now = time.monotonic()
+        delay = 0.0
+        if self.chunks is not None:
+            delay = self.chunks.take(chunks, now)
+        if self.bytes is not None:
+            delay = max(delay, self.bytes.take(nbytes, now))
+
+        if delay > 0:
+            self.throttled += delay
+            QUOTA_THROTTLED.inc(self.client, amount=delay)
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self) -> dict:
+        return {
+            "chunks": self.used_chunks,
+            "bytes": self.used_bytes,
+            "throttled_s": round(self.throttled, 3),
+            "chunks_per_sec": self.chunks.rate if self.chunks else None,
+            "bytes_per_sec": self.bytes.rate if self.bytes else None,
+        }
+
+
+class QuotaRegistry:
+    """
+    One Quota per client, created on first use from its key metadata.
+    """
+
+    def __init__(self):
+        self.quotas: Dict[str, Quota] = {}
+
+    def get(self, client_info: dict) -> Quota:
+        quota = self.quotas.get(client_info["client"])
+        if quota is None:
+            quota = self.quotas[client_info["client"]] = Quota.from_client_info(client_info)
+        return quota
+
+    def stats(self) -> dict:
+        return {client: quota.stats() for client, quota in self.quotas.items()}
@@ -1,39 +1,238 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
 from collections import defaultdict
+from typing import Dict
+
+from . import settings
+from .resp import RespConnection, RespError
+
+log = logging.getLogger(__name__)
 
 
 class RateLimitError(Exception):
     """Raised when a client exceeds its allowed stream quota."""
 
 
-class StreamRateLimiter:
+class Lease:
+    """
+    One reserved stream slot. Releasing is idempotent.
+    """
+
+    __slots__ = ("api_key", "lease_id", "released")
+
+    def __init__(self, api_key: str, lease_id: str):
+        self.api_key = api_key
+        self.lease_id = lease_id
+        self.released = False
+
+
+class StreamRateLimiter(ABC):
     """
-    In-memory limiter for concurrent streams per API key.
+    Concurrent streams per API key, as leases.
 
-    NOTE:
-    - This is per-process.
-    - Replace with Redis for multi-instance deployments.
+    Subclasses decide where the leases live: InMemoryRateLimiter keeps
+    them in this process, SharedRateLimiter in a Redis-protocol store
+    shared by all workers.
     """
 
     def __init__(self):
-        self._active_streams = defaultdict(int)
+        self._ids = itertools.count(1)
+        self._prefix = uuid.uuid4().hex[:12]
+        # api_key -> {lease_id: Lease} held by this process
+        self._leases: Dict[str, Dict[str, Lease]] = defaultdict(dict)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def held(self, api_key: str) -> int:
+        """
+        Slots this process holds for `api_key`.
+        """
+        return len(self._leases.get(api_key, ()))
+
+    def _new_lease(self, api_key: str) -> Lease:
+        lease = Lease(api_key, f"{self._prefix}:{next(self._ids)}")
+        self._leases[api_key][lease.lease_id] = lease
+        return lease
+
+    def _forget(self, lease: Lease) -> bool:
+        if lease.released:
+            return False
+        lease.released = True
+        leases = self._leases.get(lease.api_key)
+        if leases is not None:
+            leases.pop(lease.lease_id, None)
+            if not leases:
+                del self._leases[lease.api_key]
+        return True
 
-    def acquire(self, api_key: str, max_streams: int) -> None:
+    @staticmethod
+    def _exceeded(max_streams: int) -> RateLimitError:
+        return RateLimitError(f"Max concurrent streams exceeded ({max_streams})")
+
+    @abstractmethod
+    async def acquire(self, api_key: str, max_streams: int) -> Lease:
         """
         Attempt to reserve a stream slot.
 
         Raises:
             RateLimitError: if limit is exceeded
         """
-        if self._active_streams[api_key] >= max_streams:
-            raise RateLimitError(
-                f"Max concurrent streams exceeded ({max_streams})"
-            )
-
-        self._active_streams[api_key] += 1
 
-    def release(self, api_key: str) -> None:
+    @abstractmethod
+    async def release(self, lease: Lease) -> None:
         """
         Release a previously acquired stream slot.
         """
-        if self._active_streams[api_key] > 0:
-            self._active_streams[api_key] -= 1
+
+
+class InMemoryRateLimiter(StreamRateLimiter):
+    """
+    Per-process limiter; enough for a single worker and for tests.
+    """
+
+    async def acquire(self, api_key: str, max_streams: int) -> Lease:
+        if self.held(api_key) >= max_streams:
+            raise self._exceeded(max_streams)
+        return self._new_lease(api_key)
+
+    async def release(self, lease: Lease) -> None:
+        self._forget(lease)
+
+
+class SharedRateLimiter(StreamRateLimiter):
+    """
+    Limiter shared by all workers through a Redis-protocol store.
+
+    Each API key is a sorted set of lease ids scored by expiry time.
+    Acquiring is one pipelined MULTI/EXEC round trip that drops expired
+    leases, adds the new one and counts; if the count is over the limit
+    the lease is removed again. A heartbeat re-scores this worker's
+    leases every `ttl / 3`, so the slots of a crashed worker free
+    themselves after `ttl` seconds.
+
+    Two workers racing for the last slot may both be refused, but are
+    never both admitted.
+    """
+
+    def __init__(self, url: str, ttl: float = settings.LEASE_TTL, key_prefix: str = "streamkit:slots:"):
+        super().__init__()
+        self.url = url
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._conn = None
+        self._heartbeat = None
+
+    async def start(self):
+        self._conn = await RespConnection.open(self.url)
+        self._heartbeat = asyncio.create_task(self._renew_loop())
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+
+        # hand our slots back right away instead of waiting for expiry
+        leases = [lease for held in self._leases.values() for lease in held.values()]
+        if leases and self._conn is not None:
+            try:
+                await self._conn.pipeline([
+                    ("ZREM", self.key_prefix + lease.api_key, lease.lease_id) for lease in leases
+                ])
+            except (OSError, ConnectionError):
+                pass
+
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def acquire(self, api_key: str, max_streams: int) -> Lease:
+        # this worker alone is already at the limit: no round trip needed
+        if self.held(api_key) >= max_streams:
+            raise self._exceeded(max_streams)
+
+        lease = self._new_lease(api_key)
+        key = self.key_prefix + api_key
+        now = time.time()
+
+        try:
+            replies = await self._connection_pipeline([
+                ("MULTI",),
+                ("ZREMRANGEBYSCORE", key, "-inf", now),
+                ("ZADD", key, now + self.ttl, lease.lease_id),
+                ("ZCARD", key),
+                ("EXEC",),
+            ])
+            active = replies[-1][2]
+        except (OSError, ConnectionError, IndexError, TypeError) as e:
+            # store unreachable: fall back to the per-process count above
+            log.warning("lease store unavailable, limiting per process: %s", e)
+            return lease
+
+        if active > max_streams:
+            await self.release(lease)
+            raise self._exceeded(max_streams)
+        return lease
+
+    async def release(self, lease: Lease) -> None:
+        if not self._forget(lease):
+            return
+        try:
+            await self._connection_pipeline([("ZREM", self.key_prefix + lease.api_key, lease.lease_id)])
+        except (OSError, ConnectionError) as e:
+            # the lease expires on its own once the heartbeat stops renewing it
+            log.warning("lease release failed: %s", e)
+
+    async def _connection_pipeline(self, commands):
+        if self._conn is None:
+            self._conn = await RespConnection.open(self.url)
+        try:
+            return await self._conn.pipeline(commands)
+        except (OSError, ConnectionError):
+            await self._conn.close()
+            self._conn = None
+            raise
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            leases = [lease for held in self._leases.values() for lease in held.values()]
+            if not leases:
+                continue
+
+            expires = time.time() + self.ttl
+            try:
+                replies = await self._connection_pipeline([
+                    ("ZADD", self.key_prefix + lease.api_key, "XX", expires, lease.lease_id)
+                    for lease in leases
+                ])
+            except (OSError, ConnectionError) as e:
+                log.warning("lease heartbeat failed: %s", e)
+                continue
+            except Exception:
+                # keep renewing: a dead heartbeat lets every lease expire
+                log.exception("lease heartbeat failed")
+                continue
+
+            errors = [reply for reply in replies if isinstance(reply, RespError)]
+            if errors:
+                log.warning("lease heartbeat: %d of %d renewals refused: %s", len(errors), len(replies), errors[0])
+
+
+def create_limiter(url: str) -> StreamRateLimiter:
+    """
+    Limiter for a STREAM_LIMITER_BACKEND value.
+    """
+    if not url:
+        return InMemoryRateLimiter()
+    if url.startswith(("redis://", "tcp://", "unix://")):
+        return SharedRateLimiter(url)
+    raise ValueError(f"Unsupported limiter backend: {url}")
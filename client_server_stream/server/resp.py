@@ -0,0 +1,128 @@
+# client_server_stream/server/resp.py
+"""
+Minimal asyncio client for the Redis serialization protocol (RESP2).
+
+Only what the router backend and the lease limiter need: commands,
+pipelines and pub/sub pushes, over TCP (redis://host:port/db) or a Unix
+socket (unix:///path/to/sock). Works against Redis and against the
+stand-in broker in server/broker.py.
+"""
+import asyncio
+from typing import Any, List, Sequence
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    """Raised for error replies (-ERR ...)."""
+
+
+def encode_command(args: Sequence[Any]) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode("utf-8")
+        else:
+            data = str(arg).encode("ascii")
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    Read one reply. Bulk strings are returned as bytes, error replies
+    are returned (not raised) as RespError instances.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+
+    kind, rest = line[:1], line[1:-2]
+
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+
+    raise ConnectionError(f"invalid RESP reply: {line!r}")
+
+
+class RespConnection:
+    """
+    One RESP connection. Not safe for concurrent use from several tasks
+    unless callers serialize through `lock`.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, url: str) -> "RespConnection":
+        parsed = urlparse(url)
+
+        if parsed.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(unquote(parsed.path))
+        elif parsed.scheme in ("redis", "tcp"):
+            reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        else:
+            raise ValueError(f"Unsupported backend URL scheme: {parsed.scheme}")
+
+        conn = cls(reader, writer)
+        if parsed.password:
+            await conn.execute("AUTH", unquote(parsed.password))
+        db = parsed.path.strip("/") if parsed.scheme != "unix" else ""
+        if db:
+            await conn.execute("SELECT", db)
+        return conn
+
+    async def execute(self, *args) -> Any:
+        async with self.lock:
+            self.writer.write(encode_command(args))
+            await self.writer.drain()
+            reply = await read_reply(self.reader)
+
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """
+        Send all commands in one write and read all replies: one round
+        trip. Error replies are returned in place, not raised.
+        """
+        async with self.lock:
+            self.writer.write(b"".join(encode_command(c) for c in commands))
+            await self.writer.drain()
+            return [await read_reply(self.reader) for _ in commands]
+
+    def send(self, *args) -> None:
+        """
+        Queue a command without waiting for its reply (pub/sub mode).
+        """
+        self.writer.write(encode_command(args))
+
+    async def read(self) -> Any:
+        return await read_reply(self.reader)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
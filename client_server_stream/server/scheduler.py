@@ -0,0 +1,213 @@
+# client_server_stream/server/scheduler.py
+"""
+Weighted fair scheduling of plugin streams on the event loop.
+
+Every stream gets a Ticket and calls `await ticket.checkpoint()` after
+each chunk. A stream runs uninterrupted for one turn: `turn_chunks`
+chunks or `turn_us` microseconds, whichever comes first. Then it parks
+and a dispatcher resumes parked streams one per event-loop pass, so
+socket writers, receives and other streams get the loop in between.
+
+Which parked stream goes next is weighted fair queuing over flows. A
+flow is one (client, priority class) pair. Its weight is the class
+weight times the client's optional `weight` from its key metadata. The
+cost of a turn is its number of chunks. An interactive stream emitting
+one token per turn is therefore picked long before a batch job that
+burned through a full turn.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from . import settings
+from .metrics import histogram
+
+# Relative share of the loop per priority class
+PRIORITY_WEIGHTS = {
+    "interactive": 8.0,
+    "normal": 4.0,
+    "batch": 1.0,
+}
+
+SCHEDULING_DELAY = histogram(
+    "streamkit_scheduling_delay_seconds",
+    "Time a stream waited for its next turn after yielding",
+    ("plugin",),
+)
+
+
+class Flow:
+    __slots__ = ("key", "weight", "finish", "waiting", "streams")
+
+    def __init__(self, key, weight: float):
+        self.key = key
+        self.weight = weight
+        # virtual finish time of the flow's last charged turn
+        self.finish = 0.0
+        # parked tickets, first come first served within the flow
+        self.waiting = deque()
+        self.streams = 0
+
+
+class Ticket:
+    """
+    Scheduling state of one stream.
+    """
+
+    __slots__ = (
+        "scheduler", "owner", "stream_id", "flow", "label",
+        "turn_started", "turn_chunks", "parked_at", "future", "tag",
+        "turns", "waited", "max_wait",
+    )
+
+    def __init__(self, scheduler: "StreamScheduler", owner, stream_id, flow: Flow, label: str):
+        self.scheduler = scheduler
+        # socket that started the stream
+        self.owner = owner
+        self.stream_id = stream_id
+        self.flow = flow
+        self.label = label
+
+        self.turn_started = time.perf_counter()
+        self.turn_chunks = 0
+        self.parked_at = 0.0
+        self.future: Optional[asyncio.Future] = None
+        # virtual finish time of the turn it is waiting to follow up on
+        self.tag = 0.0
+
+        self.turns = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    async def checkpoint(self):
+        """
+        Count one chunk; yield the loop when the turn is used up.
+        """
+        self.turn_chunks += 1
+        scheduler = self.scheduler
+        if (
+            self.turn_chunks < scheduler.turn_chunks
+            and time.perf_counter() - self.turn_started < scheduler.turn_seconds
+        ):
+            return
+
+        await scheduler._park(self)
+
+        wait = time.perf_counter() - self.parked_at
+        self.turns += 1
+        self.waited += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        SCHEDULING_DELAY.observe(wait, self.label)
+
+        self.turn_chunks = 0
+        self.turn_started = time.perf_counter()
+
+    def close(self):
+        self.scheduler._close(self)
+
+    def stats(self) -> dict:
+        return {
+            "stream_id": self.stream_id,
+            "flow": list(self.flow.key),
+            "turns": self.turns,
+            "waited_s": round(self.waited, 6),
+            "max_wait_s": round(self.max_wait, 6),
+        }
+
+
+class StreamScheduler:
+    def __init__(
+        self,
+        turn_chunks: int = settings.SCHED_TURN_CHUNKS,
+        turn_us: float = settings.SCHED_TURN_US,
+    ):
+        self.turn_chunks = max(1, turn_chunks)
+        self.turn_seconds = turn_us / 1e6
+
+        self.flows: Dict[Tuple, Flow] = {}
+        # (owner socket, stream_id) -> Ticket; two producers may pick
+        # the same stream_id
+        self.tickets: Dict[Tuple[object, str], Ticket] = {}
+        # virtual time: finish tag of the turn granted last
+        self.vtime = 0.0
+        self._parked = 0
+        self._dispatching = False
+
+    def register(self, owner, stream_id, client, priority="normal", weight: float = 1.0, label: str = "") -> Ticket:
+        key = (client, priority)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = Flow(key, PRIORITY_WEIGHTS.get(priority, 1.0) * weight)
+            flow.finish = self.vtime
+        flow.streams += 1
+
+        ticket = Ticket(self, owner, stream_id, flow, label)
+        self.tickets[(owner, stream_id)] = ticket
+        return ticket
+
+    async def _park(self, ticket: Ticket):
+        flow = ticket.flow
+        # charge the finished turn; a flow that was idle starts at the
+        # current virtual time instead of cashing in old credit
+        flow.finish = ticket.tag = max(flow.finish, self.vtime) + ticket.turn_chunks / flow.weight
+
+        ticket.parked_at = time.perf_counter()
+        ticket.future = asyncio.get_running_loop().create_future()
+        flow.waiting.append(ticket)
+        self._parked += 1
+
+        if not self._dispatching:
+            self._dispatching = True
+            asyncio.get_running_loop().call_soon(self._dispatch)
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # cancelled while parked: leave the queue
+            if ticket in flow.waiting:
+                flow.waiting.remove(ticket)
+                self._parked -= 1
+            raise
+
+    def _dispatch(self):
+        """
+        Resume the parked stream with the smallest finish tag, then come
+        back on the next loop pass if more are waiting.
+        """
+        while self._parked > 0:
+            best = None
+            for flow in self.flows.values():
+                if flow.waiting and (best is None or flow.waiting[0].tag < best.waiting[0].tag):
+                    best = flow
+
+            ticket = best.waiting.popleft()
+            self._parked -= 1
+            # skip streams cancelled in this loop pass
+            if not ticket.future.done():
+                self.vtime = max(self.vtime, ticket.tag)
+                ticket.future.set_result(None)
+                break
+
+        if self._parked > 0:
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        else:
+            self._dispatching = False
+
+    def _close(self, ticket: Ticket):
+        key = (ticket.owner, ticket.stream_id)
+        if self.tickets.get(key) is ticket:
+            del self.tickets[key]
+
+        flow = ticket.flow
+        flow.streams -= 1
+        if flow.streams <= 0 and not flow.waiting and self.flows.get(flow.key) is flow:
+            del self.flows[flow.key]
+
+    def stats(self) -> dict:
+        return {
+            "flows": len(self.flows),
+            "parked": self._parked,
+            "streams": [t.stats() for t in self.tickets.values()],
+        }
@@ -0,0 +1,125 @@
+# client_server_stream/server/settings.py
+"""
+Process-wide server settings.
+
+Every value can be overridden through an environment variable so the
+same build can be tuned per deployment (Procfile / Railway variables).
+"""
+import os
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Max seconds a single recipient send may take during router fan-out
+FANOUT_SEND_TIMEOUT = _env_float("STREAM_FANOUT_SEND_TIMEOUT", 5.0)
+
+# Default bound and overflow policy of each subscriber's outbound queue
+# (drop_oldest | drop_newest | coalesce | disconnect)
+SEND_QUEUE_SIZE = _env_int("STREAM_SEND_QUEUE_SIZE", 256)
+SEND_OVERFLOW = os.environ.get("STREAM_SEND_OVERFLOW", "drop_oldest")
+
+# Re-validate every outbound protocol message (debug aid; inbound messages
+# are always validated)
+DEBUG_VALIDATE = os.environ.get("STREAMKIT_DEBUG_VALIDATE", "") not in ("", "0", "false")
+
+# Package log level, and 1-in-N sampling of per-message debug logs
+# (0 disables them entirely)
+LOG_LEVEL = os.environ.get("STREAM_LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_EVERY = _env_int("STREAM_LOG_SAMPLE_EVERY", 100)
+
+# Upstream generation endpoint of the llm_demo plugin
+LLM_DEMO_URL = os.environ.get(
+    "LLM_DEMO_URL",
+    "https://unirritable-onomatopoetically-donna.ngrok-free.dev/generate",
+)
+
+# Stamp every chunk with its server emit time (meta.ts, epoch seconds);
+# used by the load-test suite to measure end-to-end latency
+STAMP_CHUNKS = os.environ.get("STREAM_STAMP_CHUNKS", "") not in ("", "0", "false")
+
+# Pooled upstream HTTP client of the llm_demo plugin (one per process)
+LLM_DEMO_CONNECT_TIMEOUT = _env_float("LLM_DEMO_CONNECT_TIMEOUT", 5.0)
+LLM_DEMO_READ_TIMEOUT = _env_float("LLM_DEMO_READ_TIMEOUT", 60.0)  # max gap between tokens
+LLM_DEMO_MAX_CONNECTIONS = _env_int("LLM_DEMO_MAX_CONNECTIONS", 100)
+LLM_DEMO_MAX_KEEPALIVE = _env_int("LLM_DEMO_MAX_KEEPALIVE", 20)
+LLM_DEMO_KEEPALIVE_EXPIRY = _env_float("LLM_DEMO_KEEPALIVE_EXPIRY", 30.0)
+# HTTP/2 needs the `h2` package; without it the client falls back to HTTP/1.1
+LLM_DEMO_HTTP2 = os.environ.get("LLM_DEMO_HTTP2", "1") not in ("", "0", "false")
+
+# Bounds of the completed-stream replay cache (server/stream_cache.py)
+STREAM_CACHE_MAX_ENTRIES = _env_int("STREAM_CACHE_MAX_ENTRIES", 256)
+STREAM_CACHE_MAX_BYTES = _env_int("STREAM_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+# Bytes of one running shared stream kept for late joiners, and how many
+# chunks its plugin may run ahead of the slowest reader
+STREAM_CACHE_REPLAY_MAX_BYTES = _env_int("STREAM_CACHE_REPLAY_MAX_BYTES", 1024 * 1024)
+STREAM_CACHE_READAHEAD = _env_int("STREAM_CACHE_READAHEAD", 16)
+# Seconds a completed llm_demo answer is replayed for identical prompts
+LLM_DEMO_CACHE_TTL = _env_float("LLM_DEMO_CACHE_TTL", 60.0)
+
+# Chunks kept per active stream for /observe resume, and how long a
+# finished stream's buffer stays available
+REPLAY_BUFFER_SIZE = _env_int("STREAM_REPLAY_BUFFER_SIZE", 256)
+REPLAY_LINGER = _env_float("STREAM_REPLAY_LINGER", 30.0)
+
+# Cross-worker fan-out: empty for in-process only, or a Redis-protocol
+# URL (redis://host:port/db, unix:///path) shared by all workers
+ROUTER_BACKEND = os.environ.get("STREAM_ROUTER_BACKEND", "")
+
+# Where concurrent-stream leases live: empty for per-process, or a
+# Redis-protocol URL shared by all workers (defaults to the router's).
+# A lease a worker stops renewing expires after STREAM_LEASE_TTL seconds.
+LIMITER_BACKEND = os.environ.get("STREAM_LIMITER_BACKEND", ROUTER_BACKEND)
+LEASE_TTL = _env_float("STREAM_LEASE_TTL", 15.0)
+
+# Stream scheduler turn (server/scheduler.py): a stream yields the event
+# loop after this many chunks or microseconds, whichever comes first
+SCHED_TURN_CHUNKS = _env_int("STREAM_SCHED_TURN_CHUNKS", 16)
+SCHED_TURN_US = _env_float("STREAM_SCHED_TURN_US", 5000.0)
+
+# Shared pools for plugins running off the event loop (server/execution.py)
+# and the bound of each stream's handoff queue, in chunks
+THREAD_WORKERS = _env_int("STREAM_THREAD_WORKERS", 16)
+PROCESS_WORKERS = _env_int("STREAM_PROCESS_WORKERS", os.cpu_count() or 2)
+PLUGIN_QUEUE_SIZE = _env_int("STREAM_PLUGIN_QUEUE_SIZE", 64)
+
+# Plugin registry (server/plugins/registry.py): optional JSON file caching
+# the scan of the plugins package, and plugins to load in the background
+# at startup (comma separated, "*" for all; the rest load on first use)
+PLUGIN_MANIFEST = os.environ.get("STREAM_PLUGIN_MANIFEST", "")
+PLUGIN_WARM = [name.strip() for name in os.environ.get("STREAM_PLUGIN_WARM", "").split(",") if name.strip()]
+
+# API key store (server/auth.py): empty for the built-in keys, or
+# sqlite:///path/to/keys.db. Lookups are cached for KEY_CACHE_TTL seconds,
+# unknown keys for KEY_NEGATIVE_TTL; invalidations are shared through
+# STREAM_KEY_INVALIDATION (a Redis-protocol URL, defaults to the router's)
+KEYSTORE = os.environ.get("STREAM_KEYSTORE", "")
+KEY_CACHE_SIZE = _env_int("STREAM_KEY_CACHE_SIZE", 10000)
+KEY_CACHE_TTL = _env_float("STREAM_KEY_CACHE_TTL", 60.0)
+KEY_NEGATIVE_TTL = _env_float("STREAM_KEY_NEGATIVE_TTL", 5.0)
+KEY_INVALIDATION = os.environ.get("STREAM_KEY_INVALIDATION", ROUTER_BACKEND)
+
+# Stream lifecycle (server/stream_registry.py): default limits of a
+# producer stream in seconds, overridable per plugin (0 disables), and
+# how often they are checked
+STREAM_MAX_DURATION = _env_float("STREAM_MAX_DURATION", 600.0)
+STREAM_IDLE_TIMEOUT = _env_float("STREAM_IDLE_TIMEOUT", 120.0)
+STREAM_WATCHDOG_INTERVAL = _env_float("STREAM_WATCHDOG_INTERVAL", 1.0)
+
+# Pattern subscriptions of one /observe socket (server/topics.py), counted
+# as (channel pattern, candidate pattern) pairs
+OBSERVE_MAX_PATTERNS = _env_int("STREAM_OBSERVE_MAX_PATTERNS", 256)
+
+# Upper bounds of a request's `meta.batch` (server/batching.py); larger
+# values are clamped so a client cannot make the server buffer
+# arbitrarily large batches
+BATCH_MAX_CHUNKS = _env_int("STREAM_BATCH_MAX_CHUNKS", 256)
+BATCH_MAX_BYTES = _env_int("STREAM_BATCH_MAX_BYTES", 1_048_576)
+BATCH_MAX_DELAY_MS = _env_float("STREAM_BATCH_MAX_DELAY_MS", 1000.0)
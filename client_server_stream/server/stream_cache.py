@@ -0,0 +1,230 @@
+# client_server_stream/server/stream_cache.py
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from .batching import chunk_size
+from .metrics import counter
+from . import settings
+
+CACHE_REQUESTS = counter(
+    "streamkit_stream_cache_requests_total",
+    "Cached plugin invocations by result (hit, join, miss)",
+    ("plugin", "result"),
+)
+
+
+class SharedStream:
+    """
+    One upstream iteration fanned out to any number of readers.
+
+    The upstream runs at most `readahead` chunks ahead of the slowest
+    reader, so a reader held back by flow control, quotas or the
+    scheduler also holds back the plugin.
+
+    Chunks are kept so a reader that joins late replays from the first
+    chunk, up to `max_bytes`. Past that the stream stops being
+    `replayable`: it admits no new readers, is not cached once complete,
+    and only keeps the chunks its slowest reader has not consumed yet.
+    When the last reader goes away before completion, the upstream is
+    cancelled.
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[Any],
+        on_done: Callable[["SharedStream"], None],
+        max_bytes: int = settings.STREAM_CACHE_REPLAY_MAX_BYTES,
+        readahead: int = settings.STREAM_CACHE_READAHEAD,
+    ):
+        # chunks[i] is chunk number offset + i
+        self.chunks: List[Any] = []
+        self.offset = 0
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.readahead = max(1, readahead)
+        self.replayable = True
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.readers = 0
+        # reader -> number of the next chunk it reads
+        self._positions: Dict[object, int] = {}
+        # set once the upstream is being cancelled; no new readers
+        self.abandoned = False
+
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        # set when a reader moves on or leaves; the pump waits on it
+        self._advanced = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self.size += chunk_size(chunk)
+                if self.size > self.max_bytes:
+                    self.replayable = False
+                if not self.replayable:
+                    self._trim()
+                self._notify()
+
+                while self._ahead() >= self.readahead:
+                    self._advanced.clear()
+                    await self._advanced.wait()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done(self)
+
+    def _ahead(self) -> int:
+        # chunks pulled that the slowest reader has not read yet
+        end = self.offset + len(self.chunks)
+        return end - min(self._positions.values(), default=end)
+
+    def _trim(self):
+        # drop the chunks every reader is past
+        low = min(self._positions.values(), default=self.offset + len(self.chunks))
+        if low > self.offset:
+            del self.chunks[:low - self.offset]
+            self.offset = low
+
+    def _notify(self):
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    def iterate(self) -> AsyncIterator[Any]:
+        """
+        A new reader, starting at the oldest chunk kept. It is registered
+        right away, so the chunks it has not read yet are kept even
+        before it starts iterating.
+        """
+        self.readers += 1
+        reader = object()
+        self._positions[reader] = self.offset
+        return self._read(reader)
+
+    async def _read(self, reader) -> AsyncIterator[Any]:
+        positions = self._positions
+        index = positions[reader]
+        try:
+            while True:
+                if index < self.offset + len(self.chunks):
+                    chunk = self.chunks[index - self.offset]
+                    index += 1
+                    positions[reader] = index
+                    self._advanced.set()
+                    yield chunk
+                    continue
+
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+
+                await self._changed.wait()
+        finally:
+            self.readers -= 1
+            del positions[reader]
+            self._advanced.set()
+            if self.readers == 0 and not self.done:
+                self.abandoned = True
+                self._task.cancel()
+
+
+class StreamCache:
+    """
+    Single-flight deduplication plus a TTL'd LRU of completed streams,
+    keyed on plugin name + canonicalized payload.
+
+    Plugins opt in with `cache_ttl`: None disables caching, 0 only
+    shares concurrent identical invocations, > 0 also replays completed
+    streams for that many seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = settings.STREAM_CACHE_MAX_ENTRIES,
+        max_bytes: int = settings.STREAM_CACHE_MAX_BYTES,
+        stream_max_bytes: int = settings.STREAM_CACHE_REPLAY_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # replay buffer of one running stream, also the largest entry
+        self.stream_max_bytes = min(stream_max_bytes, max_bytes)
+        self.bytes = 0
+
+        self._inflight: Dict[str, SharedStream] = {}
+        # key -> (expires_at, chunks, size), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def key(plugin_name: str, payload: Any) -> str:
+        return plugin_name + "\0" + json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+
+    def stream(self, plugin, payload, open_source: Callable[[], AsyncIterator[Any]] = None) -> AsyncIterator[Any]:
+        """
+        Iterate `plugin.stream(payload)`, sharing or replaying it when an
+        identical invocation is running or cached. `open_source` replaces
+        `plugin.stream(payload)` as the upstream on a miss.
+        """
+        key = self.key(plugin.name, payload)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(plugin.name, "hit")
+                return self._replay(entry[1])
+            self._evict(key)
+
+        shared = self._inflight.get(key)
+        if shared is not None and not shared.done and not shared.abandoned and shared.replayable:
+            CACHE_REQUESTS.inc(plugin.name, "join")
+            return shared.iterate()
+
+        CACHE_REQUESTS.inc(plugin.name, "miss")
+        shared = SharedStream(
+            open_source() if open_source else plugin.stream(payload),
+            on_done=lambda s: self._completed(key, s, plugin.cache_ttl),
+            max_bytes=self.stream_max_bytes,
+        )
+        self._inflight[key] = shared
+        return shared.iterate()
+
+    @staticmethod
+    async def _replay(chunks):
+        for chunk in chunks:
+            yield chunk
+
+    def _completed(self, key: str, shared: SharedStream, ttl: float):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+
+        if shared.error is not None or not ttl or not shared.replayable:
+            return
+
+        self._evict(key)
+        self._entries[key] = (time.monotonic() + ttl, shared.chunks, shared.size)
+        self.bytes += shared.size
+
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "inflight": len(self._inflight),
+        }
@@ -1,14 +1,161 @@
-from fastapi.websockets import WebSocketState
-from .protocol import Event, build_message
-from .plugins.loader import discover_plugins
-from .channel_router import router
+import asyncio
+import logging
+import time
 import uuid
+from collections import deque
+
+from .protocol import Event, EnvelopeTemplate, error_message
+from .plugins.registry import PluginRegistry
+from .channel_router import router
+from .fanout import Frame
+from .compact import CompactChunk, delta, next_handle
+from .batching import BatchPolicy, batch_chunks
+from .stream_cache import StreamCache
+from .quota import QuotaRegistry
+from .scheduler import StreamScheduler
+from .execution import PluginExecutor
+from .flow_control import CREDIT_WAIT, CreditWindow
+from .log import Sampler
+from . import settings
+from .metrics import (
+    CHUNKS_SENT,
+    INTER_CHUNK_GAP,
+    STREAMS_CANCELLED,
+    STREAMS_ENDED,
+    STREAMS_ERRORED,
+    STREAMS_STARTED,
+    TIME_TO_FIRST_CHUNK,
+)
+
+log = logging.getLogger(__name__)
+
+
+class ActiveStream:
+    """
+    Per-stream state: the chunk sequence counter, a bounded ring of
+    recently emitted chunks for resuming observers and the producer's
+    credit window (None without flow control).
+    """
+
+    __slots__ = (
+        "stream_id", "candidate_id", "message_id", "channels",
+        "seq", "replay", "ended", "window", "_envelopes",
+    )
+
+    def __init__(
+        self,
+        stream_id,
+        candidate_id,
+        replay_size: int,
+        window: CreditWindow = None,
+        message_id=None,
+        channels=(),
+    ):
+        self.stream_id = stream_id
+        self.candidate_id = candidate_id
+        self.message_id = message_id
+        self.channels = tuple(channels)
+        self.seq = 0
+        # StreamChunk per emitted chunk, oldest first
+        self.replay = deque(maxlen=replay_size)
+        self.ended = False
+        self.window = window
+        # channels -> (EnvelopeTemplate, compact handle)
+        self._envelopes = {}
+
+    def next_seq(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def envelope(self, channels: tuple):
+        """
+        Pre-encoded envelope (and compact handle) of frames delivered on
+        `channels`, built once per stream and set of channels.
+        """
+        envelope = self._envelopes.get(channels)
+        if envelope is None:
+            template = EnvelopeTemplate(
+                stream_id=self.stream_id,
+                channel=channels[0],
+                channels=list(channels) if len(channels) > 1 else None,
+                candidate_id=self.candidate_id,
+                message_id=self.message_id,
+            )
+            envelope = self._envelopes[channels] = (template, next_handle())
+        return envelope
+
+    def record(self, chunk: "StreamChunk"):
+        if self.replay.maxlen:
+            self.replay.append(chunk)
+
+
+class StreamChunk:
+    """
+    One chunk (or the end) of a stream. Its frame for each set of
+    matched channels is built on first use and shared by every socket
+    that matched the same set, live or on resume.
+    """
+
+    __slots__ = ("state", "event", "seq", "data", "meta", "delta", "_frames")
+
+    def __init__(self, state: ActiveStream, event: Event, seq: int, data=None, meta=None, delta=None):
+        self.state = state
+        self.event = event
+        self.seq = seq
+        self.data = data
+        self.meta = meta
+        self.delta = delta
+        self._frames = {}
+
+    def frame(self, channels: tuple) -> Frame:
+        frame = self._frames.get(channels)
+        if frame is None:
+            template, handle = self.state.envelope(channels)
+            if self.event is Event.STREAM_END:
+                compact = CompactChunk(handle, self.seq, end=True)
+            else:
+                compact = CompactChunk(handle, self.seq, self.data, self.meta, base=self.seq - 1, delta=self.delta)
+            frame = self._frames[channels] = Frame(
+                template.message(self.event, self.data, self.meta, self.seq),
+                template.encode,
+                compact,
+            )
+        return frame
 
 
 class StreamManager:
     def __init__(self):
-        self.plugins = discover_plugins()
-        print("PLUGINS LOADED:", self.plugins)
+        # imported on first use (see server/plugins/registry.py)
+        self.plugins = PluginRegistry()
+        log.info("plugins available: %s", ", ".join(self.plugins.names()))
+        self._warm_task = None
+        self.executor = PluginExecutor()
+        self._chunk_sample = Sampler()
+        self.cache = StreamCache()
+        self.quotas = QuotaRegistry()
+        self.scheduler = StreamScheduler()
+        # (producer socket, stream_id) -> ActiveStream, kept REPLAY_LINGER
+        # seconds after the end; stream ids are only unique per producer
+        self.streams = {}
+        # message_id -> the same ActiveStream, for resuming observers
+        self.messages = {}
+
+    async def startup(self):
+        """
+        Start loading the STREAM_PLUGIN_WARM plugins in the background
+        (app lifespan start); the others load on their first stream.
+        """
+        if settings.PLUGIN_WARM:
+            self._warm_task = asyncio.create_task(self.plugins.warm(settings.PLUGIN_WARM))
+
+    async def shutdown(self):
+        """
+        Run plugin shutdown hooks (app lifespan end).
+        """
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+        await self.plugins.shutdown()
+        self.executor.shutdown()
 
     async def start_stream(
         self,
@@ -19,73 +166,253 @@ class StreamManager:
         payload,
         candidate_id=None,
         message_id=None,
+        batch=None,
+        client_info=None,
+        credit: CreditWindow = None,
+        entry=None,
     ):
-        print("STREAM STARTED:", plugin_name, channels, payload)
-
+        """
+        Run one producer stream. `entry` is the stream's StreamRegistry
+        entry, told about its limits and progress (optional).
+        """
         if not candidate_id:
             raise ValueError("candidate_id required")
 
         if not message_id:
             message_id = uuid.uuid4().hex
 
-        plugin = self.plugins.get(plugin_name)
+        try:
+            plugin = await self.plugins.acquire(plugin_name)
+        except Exception:
+            log.exception("stream %s: plugin %s failed to load", stream_id, plugin_name)
+            await router.send(
+                ws,
+                error_message(stream_id=stream_id, code="PLUGIN_LOAD_FAILED", message=f"Plugin {plugin_name} failed to load"),
+            )
+            return
 
         if not plugin:
-            print("PLUGIN NOT FOUND:", plugin_name)
+            log.warning("plugin not found: %s (stream %s)", plugin_name, stream_id)
+            await router.send(
+                ws,
+                error_message(stream_id=stream_id, code="PLUGIN_NOT_FOUND", message=f"Unknown plugin: {plugin_name}"),
+            )
             return
 
-        print("PLUGIN FOUND:", plugin)
+        if entry is not None:
+            entry.max_duration = plugin.max_duration
+            entry.idle_timeout = plugin.idle_timeout
 
-        # Normalize channels
+        # Normalize channels (duplicates would only repeat deliveries)
         if isinstance(channels, str):
             channels = [channels]
+        channels = tuple(dict.fromkeys(channels))
+
+        client = (client_info or {}).get("client", candidate_id)
+        log.debug("stream %s started: plugin=%s channels=%s", stream_id, plugin_name, channels)
+        STREAMS_STARTED.inc(plugin_name, client)
+
+        # How each channel's audience is reached, resolved once per stream
+        routes = self._routes(channels, candidate_id)
+
+        # chunks/sec and bytes/sec budget shared by the client's streams
+        quota = self.quotas.get(client_info) if client_info else None
+
+        state = ActiveStream(stream_id, candidate_id, plugin.replay_buffer, credit, message_id, channels)
+        self.streams[(ws, stream_id)] = state
+        self.messages[message_id] = state
+
+        # Interleaves this stream's plugin iteration with the others
+        ticket = self.scheduler.register(
+            ws,
+            stream_id,
+            client,
+            plugin.priority,
+            weight=(client_info or {}).get("weight", 1.0),
+            label=plugin_name,
+        )
+
+        stamp = settings.STAMP_CHUNKS
+        outcome = STREAMS_CANCELLED
+        started = last = time.perf_counter()
+        first = True
+        # previous payload, the base of compact deltas
+        previous = None
 
         try:
-            print("STARTING PLUGIN STREAM...")
+            policy = BatchPolicy.resolve(batch, plugin.batch)
+            # a batch never exceeds the client's initial credit window,
+            # which is what its receive queue is sized for
+            if policy and credit is not None and credit.chunks is not None:
+                policy = policy.within(credit.chunks)
+
+            if credit is not None:
+                await self._wait_credit(credit, plugin_name)
+
+            # nothing awaits between opening the source and iterating it:
+            # a shared stream holds its upstream for readers not started
+            if plugin.cache_ttl is None:
+                source = self.executor.stream(plugin, payload)
+            else:
+                source = self.cache.stream(plugin, payload, lambda: self.executor.stream(plugin, payload))
+            if policy:
+                source = batch_chunks(source, policy)
+
+            async for chunk in source:
+                now = time.perf_counter()
+                if first:
+                    TIME_TO_FIRST_CHUNK.observe(now - started, plugin_name)
+                    first = False
+                else:
+                    INTER_CHUNK_GAP.observe(now - last, plugin_name)
+                last = now
+
+                if self._chunk_sample() and log.isEnabledFor(logging.DEBUG):
+                    log.debug("stream %s chunk: %r", stream_id, chunk)
+
+                # A batch of one goes out as a plain chunk
+                if not policy:
+                    data = {"payload": chunk}
+                elif len(chunk) == 1:
+                    data = {"payload": chunk[0]}
+                else:
+                    data = {"payloads": chunk}
+
+                meta = {"ts": time.time()} if stamp else None
+
+                changed = None
+                if not policy:
+                    changed = delta(previous, chunk)
+                    previous = chunk
+
+                # Every target socket gets one frame, tagged with the
+                # channels it matched. Each frame is encoded once and
+                # shared by the producer and observers; the router only
+                # queues it, sockets are written by their own writer tasks
+                emitted = StreamChunk(state, Event.STREAM_CHUNK, state.next_seq(), data, meta, changed)
+                await router.emit_routes(routes, emitted.frame, ws, state.candidate_id)
+
+                state.record(emitted)
+                CHUNKS_SENT.inc(plugin_name)
 
-            async for chunk in plugin.stream(payload):
-                print("PLUGIN CHUNK:", chunk)
+                if quota is not None or entry is not None:
+                    # what the producer's socket actually carries
+                    producer = router.subscribers.get(ws)
+                    nbytes = producer.wire_size(emitted.frame(channels)) if producer is not None else 0
+                    if entry is not None:
+                        entry.sent(nbytes)
+                    # Over budget: hold off pulling the next chunk
+                    if quota is not None:
+                        await quota.pace(len(chunk) if policy else 1, nbytes)
 
-                # Emit chunk to EACH channel
-                for ch in channels:
-                    chunk_msg = build_message(
-                        event=Event.STREAM_CHUNK,
-                        stream_id=stream_id,
-                        candidate_id=candidate_id,
-                        channel=ch,
-                        message_id=message_id,
-                        data={"payload": chunk},
-                    )
+                # Client's window is used up: suspend the plugin iterator
+                if credit is not None:
+                    credit.spend(chunk if policy else (chunk,))
+                    await self._wait_credit(credit, plugin_name)
 
-                    if ws and ws.application_state == WebSocketState.CONNECTED:
-                        await ws.send_json(chunk_msg)
+                await ticket.checkpoint()
 
-                    if ch == "homepage":
-                        await router.emit_channel("homepage", chunk_msg)
-                    else:
-                        await router.emit_candidate(candidate_id, chunk_msg)
+            outcome = STREAMS_ENDED
 
+        except asyncio.CancelledError:
+            raise
 
-        except Exception as e:
-            print("PLUGIN STREAM ERROR:", e)
+        except Exception:
+            outcome = STREAMS_ERRORED
+            log.exception("stream %s: plugin %s failed", stream_id, plugin_name)
 
         finally:
-            print("STREAM COMPLETE")
-
-            for ch in channels:
-                end_msg = build_message(
-                    event=Event.STREAM_END,
-                    stream_id=stream_id,
-                    candidate_id=candidate_id,
-                    channel=ch,
-                    message_id=message_id,
-                )
-
-                if ws and ws.application_state == WebSocketState.CONNECTED:
-                    await ws.send_json(end_msg)
-
-                if ch == "homepage":
-                    await router.emit_channel("homepage", end_msg)
-                else:
-                    await router.emit_candidate(candidate_id, end_msg)
+            ticket.close()
+            self.plugins.release(plugin)
+            outcome.inc(plugin_name, client)
+            log.debug("stream %s complete", stream_id)
+
+            emitted = StreamChunk(state, Event.STREAM_END, state.next_seq())
+            await router.emit_routes(routes, emitted.frame, ws, state.candidate_id)
+
+            state.record(emitted)
+            state.ended = True
+            asyncio.get_running_loop().call_later(settings.REPLAY_LINGER, self._forget, ws, state)
+
+    @staticmethod
+    async def _wait_credit(window: CreditWindow, plugin_name):
+        if window.available():
+            return
+        started = time.perf_counter()
+        await window.wait()
+        CREDIT_WAIT.inc(plugin_name, amount=time.perf_counter() - started)
+
+    def grant_credit(self, ws, stream_id, chunks: int = 0, nbytes: int = 0) -> bool:
+        """
+        Add credit to a flow-controlled stream that `ws` started
+        (stream.credit). Returns False if the stream is unknown or not
+        flow controlled.
+        """
+        state = self.streams.get((ws, stream_id))
+        if state is None or state.window is None:
+            return False
+        state.window.grant(chunks, nbytes)
+        return True
+
+    @staticmethod
+    def _routes(channels, candidate_id):
+        # (channel, router op, key) per channel, see router.emit_routes
+        return [
+            (ch, "emit_channel", "homepage") if ch == "homepage" else (ch, "emit_candidate", candidate_id)
+            for ch in channels
+        ]
+
+    @staticmethod
+    def _reaches(ws, ch, candidate_id) -> bool:
+        # mirrors the routing in _routes, plus pattern subscriptions
+        if router.reaches_pattern(ws, ch, candidate_id):
+            return True
+        if ch == "homepage":
+            return router.reaches_service(ws, "homepage")
+        return router.reaches_candidate(ws, candidate_id)
+
+    def _forget(self, owner, state: ActiveStream):
+        if self.streams.get((owner, state.stream_id)) is state:
+            del self.streams[(owner, state.stream_id)]
+        if self.messages.get(state.message_id) is state:
+            del self.messages[state.message_id]
+
+    def _lookup(self, stream_ref) -> ActiveStream:
+        state = self.messages.get(stream_ref)
+        if state is not None:
+            return state
+        # a stream_id only identifies a stream while no other producer uses it
+        found = [state for (_, stream_id), state in self.streams.items() if stream_id == stream_ref]
+        if len(found) > 1:
+            raise LookupError(f"Stream id {stream_ref} is used by several producers, resume by message_id")
+        return found[0] if found else None
+
+    def resume(self, ws, stream_id, after_seq: int) -> int:
+        """
+        Queue the buffered frames of a stream with seq > `after_seq` that
+        `ws` would have received live, ahead of live traffic. `stream_id`
+        is the stream's message_id, or its stream_id if no other
+        producer uses the same one.
+
+        Must be called right after subscribing `ws`, without awaiting in
+        between, so the replay joins the live stream with no gap or
+        duplicate. Returns the number of frames replayed.
+
+        Raises:
+            LookupError: if the stream is unknown/expired or ambiguous, or
+                the buffer no longer reaches back to `after_seq`
+        """
+        state = self._lookup(stream_id)
+        if state is None or not state.replay:
+            raise LookupError(f"No replay buffer for stream {stream_id}")
+
+        oldest = state.replay[0].seq
+        if after_seq + 1 < oldest:
+            raise LookupError(f"Stream {stream_id} can only resume from seq {oldest - 1}")
 
+        # the channels `ws` would have matched live
+        channels = tuple(ch for ch in state.channels if self._reaches(ws, ch, state.candidate_id))
+        if not channels:
+            return 0
+        frames = [chunk.frame(channels) for chunk in state.replay if chunk.seq > after_seq]
+        return router.preload(ws, frames)
@@ -0,0 +1,222 @@
+# client_server_stream/server/stream_registry.py
+"""
+Lifecycle of running producer streams.
+
+Every stream task started by /ws is registered together with its
+concurrent-stream lease, under its owner socket and the client-chosen
+stream_id (two producers may pick the same id). The registry then does
+the following:
+- releases the lease exactly once, from the task's done callback
+  (normal end, plugin error, cancel or disconnect)
+- drops the entry at the same moment
+- enforces the plugin's `max_duration` (seconds since start) and
+  `idle_timeout` (seconds without a chunk) from a watchdog task; a
+  stream over either limit gets a STREAM_TIMEOUT error and is cancelled
+- lists live streams for the /streams admin endpoint
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Dict, Optional, Tuple
+
+from . import settings
+from .metrics import counter
+from .protocol import error_message
+
+log = logging.getLogger(__name__)
+
+STREAMS_TIMED_OUT = counter(
+    "streamkit_streams_timed_out_total",
+    "Streams cancelled by a max duration or idle timeout",
+    ("plugin", "reason"),
+)
+
+
+class StreamEntry:
+    __slots__ = (
+        "stream_id", "owner", "client", "plugin", "task", "lease",
+        "started", "last_chunk", "chunks", "bytes",
+        "max_duration", "idle_timeout", "finished",
+    )
+
+    def __init__(self, stream_id, owner, client, plugin, lease):
+        self.stream_id = stream_id
+        # socket that started the stream
+        self.owner = owner
+        self.client = client
+        self.plugin = plugin
+        # set by StreamRegistry.run
+        self.task = None
+        self.lease = lease
+
+        self.started = self.last_chunk = time.monotonic()
+        self.chunks = 0
+        self.bytes = 0
+        # seconds; set by the manager once the plugin is known (0 = off)
+        self.max_duration = 0.0
+        self.idle_timeout = 0.0
+        self.finished = False
+
+    def sent(self, nbytes: int) -> None:
+        self.chunks += 1
+        self.bytes += nbytes
+        self.last_chunk = time.monotonic()
+
+    def stats(self, now: float) -> dict:
+        return {
+            "stream_id": self.stream_id,
+            "client": self.client,
+            "plugin": self.plugin,
+            "age_s": round(now - self.started, 3),
+            "idle_s": round(now - self.last_chunk, 3),
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+        }
+
+
+class StreamRegistry:
+    def __init__(self, limiter, router, check_interval: float = settings.STREAM_WATCHDOG_INTERVAL):
+        self.limiter = limiter
+        self.router = router
+        self.check_interval = check_interval
+
+        # (owner socket, stream_id) -> StreamEntry of running streams
+        self.entries: Dict[Tuple[object, str], StreamEntry] = {}
+        # owner socket -> {stream_id: StreamEntry}
+        self._by_owner: Dict[object, Dict[str, StreamEntry]] = {}
+        self._watchdog = None
+
+        self.finished = 0
+        self.timed_out = 0
+
+    async def start(self):
+        if self.check_interval > 0:
+            self._watchdog = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            await asyncio.gather(self._watchdog, return_exceptions=True)
+            self._watchdog = None
+
+    # ------------------------------------------------------------------
+    # Registration
+    # ------------------------------------------------------------------
+
+    def add(self, owner, stream_id, lease, client=None, plugin=None) -> StreamEntry:
+        """
+        Register a stream of `owner`. Its task must be started right away,
+        with `run`; the entry is what the stream reports its progress to.
+        """
+        entry = StreamEntry(stream_id, owner, client, plugin, lease)
+        self.entries[(owner, stream_id)] = entry
+        self._by_owner.setdefault(owner, {})[stream_id] = entry
+        return entry
+
+    def run(self, entry: StreamEntry, coro: Awaitable) -> asyncio.Task:
+        """
+        Run the stream of `entry`; whenever and however the task ends,
+        the entry is dropped and its lease released.
+        """
+        entry.task = asyncio.create_task(coro)
+        entry.task.add_done_callback(lambda _: self._finished(entry))
+        return entry.task
+
+    def get(self, owner, stream_id) -> Optional[StreamEntry]:
+        return self.entries.get((owner, stream_id))
+
+    def owned(self, owner, stream_id) -> bool:
+        return stream_id in self._by_owner.get(owner, ())
+
+    def cancel(self, owner, stream_id) -> bool:
+        """
+        Cancel a stream started by `owner`. Returns False if it is not
+        running (or not theirs).
+        """
+        entry = self.entries.get((owner, stream_id))
+        if entry is None or entry.task is None:
+            return False
+        entry.task.cancel()
+        return True
+
+    def cancel_owner(self, owner) -> int:
+        """
+        Cancel every stream of a disconnected socket.
+        """
+        entries = list(self._by_owner.get(owner, {}).values())
+        for entry in entries:
+            if entry.task is not None:
+                entry.task.cancel()
+        return len(entries)
+
+    def _finished(self, entry: StreamEntry):
+        if entry.finished:
+            return
+        entry.finished = True
+        self.finished += 1
+
+        key = (entry.owner, entry.stream_id)
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+        owned = self._by_owner.get(entry.owner)
+        if owned is not None and owned.get(entry.stream_id) is entry:
+            del owned[entry.stream_id]
+            if not owned:
+                del self._by_owner[entry.owner]
+
+        if entry.lease is not None:
+            asyncio.get_running_loop().create_task(self._release(entry))
+
+    async def _release(self, entry: StreamEntry):
+        try:
+            await self.limiter.release(entry.lease)
+        except Exception:
+            # a shared lease that could not be removed expires on its own
+            log.exception("stream %s: releasing its slot failed", entry.stream_id)
+
+    # ------------------------------------------------------------------
+    # Timeouts
+    # ------------------------------------------------------------------
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self._check(time.monotonic())
+            except Exception:
+                log.exception("stream watchdog failed")
+
+    async def _check(self, now: float):
+        for entry in list(self.entries.values()):
+            if entry.max_duration and now - entry.started > entry.max_duration:
+                await self._time_out(entry, "max_duration", f"Stream exceeded its maximum duration of {entry.max_duration:g}s")
+            elif entry.idle_timeout and now - entry.last_chunk > entry.idle_timeout:
+                await self._time_out(entry, "idle", f"No chunk for {entry.idle_timeout:g}s")
+
+    async def _time_out(self, entry: StreamEntry, reason: str, message: str):
+        if entry.finished or entry.task is None or entry.task.done():
+            return
+        log.info("stream %s (%s) timed out: %s", entry.stream_id, entry.plugin, message)
+        self.timed_out += 1
+        STREAMS_TIMED_OUT.inc(entry.plugin, reason)
+
+        await self.router.send(
+            entry.owner,
+            error_message(stream_id=entry.stream_id, code="STREAM_TIMEOUT", message=message),
+        )
+        entry.task.cancel()
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def list(self) -> list:
+        now = time.monotonic()
+        return [entry.stats(now) for entry in self.entries.values()]
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.entries),
+            "finished": self.finished,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,258 @@
+# client_server_stream/server/subscriber.py
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Callable, Optional
+
+from .codec import JSON, Codec
+from .fanout import Frame
+
+# WebSocket close code "Try Again Later", used for evicted slow consumers
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+class SendPolicy:
+    """
+    Bound and overflow behaviour of a subscriber's outbound queue.
+    """
+
+    __slots__ = ("maxsize", "overflow")
+
+    def __init__(self, maxsize: int = 256, overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.overflow = OverflowPolicy(overflow)
+
+    def __repr__(self):
+        return f"SendPolicy(maxsize={self.maxsize}, overflow={self.overflow.value})"
+
+
+class Subscriber:
+    """
+    Outbound side of one WebSocket: a bounded queue drained by its own
+    writer task.
+
+    Producers only ever call `enqueue`, which never awaits, so a stalled
+    socket can delay nothing but its own queue.
+
+    With `compact`, frames that have a compact form are sent as such
+    (see server/compact.py); the subscriber tracks which handles it has
+    bound and the last seq it sent on each.
+
+    `policy`, when set, overrides the policy of every fan-out to this
+    subscriber (e.g. producers, which must not lose frames).
+    """
+
+    def __init__(
+        self,
+        ws,
+        *,
+        send_timeout: float,
+        codec: Codec = JSON,
+        compact: bool = False,
+        policy: Optional[SendPolicy] = None,
+        on_close: Optional[Callable[["Subscriber"], None]] = None,
+    ):
+        self.ws = ws
+        self.policy = policy
+        self.codec = codec
+        self.compact = compact
+        # handle -> seq of the last frame sent on it (compact mode)
+        self.handles = {}
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+
+        self.queue = deque()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def enqueue(self, frame: Frame, policy: SendPolicy) -> bool:
+        """
+        Queue a frame for sending, applying `policy` when the queue is full.
+
+        Returns False if the frame was not queued.
+        """
+        if self.closed:
+            return False
+
+        policy = self.policy or policy
+        if len(self.queue) >= policy.maxsize:
+            overflow = policy.overflow
+
+            if overflow is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+
+            if overflow is OverflowPolicy.DISCONNECT:
+                self.close(code=CLOSE_TRY_AGAIN_LATER)
+                return False
+
+            if overflow is OverflowPolicy.COALESCE:
+                self._coalesce(frame)
+            else:
+                self.queue.popleft()
+                self.dropped += 1
+
+        self.queue.append(frame)
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._writer())
+        return True
+
+    def preload(self, frames) -> int:
+        """
+        Queue frames ahead of live traffic regardless of the bound (used
+        for resume replay, which is bounded by the replay buffer).
+        """
+        if self.closed:
+            return 0
+
+        count = len(self.queue)
+        self.queue.extend(frames)
+        count = len(self.queue) - count
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+
+        if count:
+            self._wakeup.set()
+            if self._task is None:
+                self._task = asyncio.get_running_loop().create_task(self._writer())
+        return count
+
+    def _coalesce(self, frame: Frame) -> None:
+        # Keep only the latest frame per stream: queued frames of the same
+        # stream are superseded by the new one.
+        key = frame.message.get("stream_id")
+        kept = deque(f for f in self.queue if f.message.get("stream_id") != key)
+
+        removed = len(self.queue) - len(kept)
+        if removed:
+            self.queue = kept
+            self.dropped += removed
+        else:
+            self.queue.popleft()
+            self.dropped += 1
+
+    async def _writer(self):
+        ws = self.ws
+        codec = self.codec
+        send = ws.send_bytes if codec.binary else ws.send_text
+        # Task.cancelling() exists from 3.11 on
+        cancelling = getattr(asyncio.current_task(), "cancelling", None)
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                frame = self.queue.popleft()
+                try:
+                    data = self._encode_compact(frame) if self.compact else frame.encode(codec)
+                    await asyncio.wait_for(send(data), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self.close(code=CLOSE_TRY_AGAIN_LATER)
+                    return
+                except Exception:
+                    # Socket is gone; the endpoint will notice the disconnect
+                    self.close()
+                    return
+
+                self.sent += 1
+
+                # wait_for (before 3.12) swallows a cancellation that lands
+                # as the send completes; don't keep running after one
+                if cancelling is not None and cancelling():
+                    return
+        except asyncio.CancelledError:
+            pass
+
+    def wire_size(self, frame: Frame) -> int:
+        """
+        Bytes `frame` takes on this socket, in its codec. A compact frame
+        is counted in its usual (delta or full) form, not its one-off
+        binding. The encoding is cached on the frame for the writer.
+        """
+        chunk = frame.compact
+        if self.compact and chunk is not None and not chunk.end:
+            data = frame.encode_compact(self.codec, "delta" if chunk.delta is not None else "full")
+        else:
+            data = frame.encode(self.codec)
+        return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+
+    def _encode_compact(self, frame: Frame):
+        chunk = frame.compact
+        if chunk is None:
+            return frame.encode(self.codec)
+
+        last = self.handles.get(chunk.handle)
+        if chunk.end:
+            self.handles.pop(chunk.handle, None)
+            if last is None:
+                return frame.encode(self.codec)
+        else:
+            self.handles[chunk.handle] = chunk.seq
+
+        if last is None:
+            kind = "bind"
+        elif chunk.delta is not None and last == chunk.base:
+            kind = "delta"
+        else:
+            # first chunk, or a gap: the delta's base never got here
+            kind = "full"
+        return frame.encode_compact(self.codec, kind)
+
+    def close(self, code: Optional[int] = None) -> None:
+        """
+        Stop the writer and drop pending frames. With `code`, also close
+        the WebSocket (used to evict slow consumers).
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        self.dropped += len(self.queue)
+        self.queue.clear()
+
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+        if code is not None:
+            asyncio.get_running_loop().create_task(self._close_socket(code))
+
+        if self.on_close:
+            self.on_close(self)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,204 @@
+# client_server_stream/server/topics.py
+"""
+Pattern subscriptions of observers.
+
+A subscription pairs a channel pattern with a candidate pattern. Both
+are either an exact name ("homepage", "button:1", "alice") or a prefix
+wildcard ending in "*": "button:*" matches "button:1" and
+"button:1:hover", "team-*" every candidate starting with "team-", and
+"*" alone matches everything.
+
+Exact patterns are dict entries and prefix wildcards live in a
+character trie that is walked along the matched name. Finding the
+sockets of a chunk therefore costs O(length of its channel and
+candidate id), no matter how many patterns are subscribed.
+"""
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+WILDCARD = "*"
+
+
+class PatternError(Exception):
+    """Raised for a malformed subscription pattern."""
+
+
+def validate_pattern(pattern) -> str:
+    if not isinstance(pattern, str) or not pattern:
+        raise PatternError("Patterns must be non-empty strings")
+    if WILDCARD in pattern[:-1]:
+        raise PatternError(f"Invalid pattern {pattern!r}: '*' is only allowed at the end")
+    return pattern
+
+
+def pattern_matches(pattern: str, name: Optional[str]) -> bool:
+    name = name or ""
+    if pattern.endswith(WILDCARD):
+        return name.startswith(pattern[:-1])
+    return name == pattern
+
+
+class _Node:
+    __slots__ = ("children", "value")
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+
+
+class PatternTrie:
+    """
+    Values keyed by pattern, looked up by the names they match.
+    """
+
+    def __init__(self):
+        # exact pattern -> value
+        self.exact = {}
+        # prefix wildcards, one node per character of the prefix
+        self._root = _Node()
+        self._prefixes = 0
+
+    def __len__(self) -> int:
+        return len(self.exact) + self._prefixes
+
+    def get(self, pattern):
+        if not pattern.endswith(WILDCARD):
+            return self.exact.get(pattern)
+        node = self._root
+        for char in pattern[:-1]:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node.value
+
+    def setdefault(self, pattern, factory):
+        """
+        The value of `pattern`, created with `factory()` if missing.
+        """
+        if not pattern.endswith(WILDCARD):
+            value = self.exact.get(pattern)
+            if value is None:
+                value = self.exact[pattern] = factory()
+            return value
+
+        node = self._root
+        for char in pattern[:-1]:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        if node.value is None:
+            node.value = factory()
+            self._prefixes += 1
+        return node.value
+
+    def pop(self, pattern):
+        if not pattern.endswith(WILDCARD):
+            return self.exact.pop(pattern, None)
+
+        prefix = pattern[:-1]
+        path = [self._root]
+        for char in prefix:
+            node = path[-1].children.get(char)
+            if node is None:
+                return None
+            path.append(node)
+
+        value, path[-1].value = path[-1].value, None
+        if value is None:
+            return None
+        self._prefixes -= 1
+        # prune the branch up to the last node still in use
+        for depth in range(len(prefix), 0, -1):
+            node = path[depth]
+            if node.value is not None or node.children:
+                break
+            del path[depth - 1].children[prefix[depth - 1]]
+        return value
+
+    def match(self, name: Optional[str]) -> Iterator:
+        """
+        Values of every pattern matching `name`.
+        """
+        name = name or ""
+        value = self.exact.get(name)
+        if value is not None:
+            yield value
+        node = self._root
+        if node.value is not None:
+            yield node.value
+        for char in name:
+            node = node.children.get(char)
+            if node is None:
+                return
+            if node.value is not None:
+                yield node.value
+
+
+class SubscriptionIndex:
+    """
+    Sockets subscribed to (channel pattern, candidate pattern) pairs.
+    """
+
+    def __init__(self):
+        # channel pattern -> PatternTrie(candidate pattern -> set(ws))
+        self._channels = PatternTrie()
+        # ws -> set((channel pattern, candidate pattern))
+        self.by_socket: Dict[object, Set[Tuple[str, str]]] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, ws, channel: str, candidate: str = WILDCARD) -> bool:
+        mine = self.by_socket.setdefault(ws, set())
+        if (channel, candidate) in mine:
+            return False
+        mine.add((channel, candidate))
+        candidates = self._channels.setdefault(channel, PatternTrie)
+        candidates.setdefault(candidate, set).add(ws)
+        self._count += 1
+        return True
+
+    def remove(self, ws, channel: str, candidate: str = WILDCARD) -> bool:
+        mine = self.by_socket.get(ws)
+        if not mine or (channel, candidate) not in mine:
+            return False
+        mine.discard((channel, candidate))
+        if not mine:
+            del self.by_socket[ws]
+
+        candidates = self._channels.get(channel)
+        sockets = candidates.get(candidate)
+        sockets.discard(ws)
+        if not sockets:
+            candidates.pop(candidate)
+            if not candidates:
+                self._channels.pop(channel)
+        self._count -= 1
+        return True
+
+    def remove_socket(self, ws) -> int:
+        subscriptions = list(self.by_socket.get(ws, ()))
+        for channel, candidate in subscriptions:
+            self.remove(ws, channel, candidate)
+        return len(subscriptions)
+
+    def subscriptions(self, ws) -> List[Tuple[str, str]]:
+        return sorted(self.by_socket.get(ws, ()))
+
+    def match(self, channel: Optional[str], candidate_id: Optional[str]) -> Set:
+        """
+        Sockets with a subscription matching a chunk of `candidate_id` on
+        `channel`.
+        """
+        targets = set()
+        for candidates in self._channels.match(channel):
+            for sockets in candidates.match(candidate_id):
+                targets.update(sockets)
+        return targets
+
+    def matches(self, ws, channel: Optional[str], candidate_id: Optional[str]) -> bool:
+        return any(
+            pattern_matches(ch, channel) and pattern_matches(cid, candidate_id)
+            for ch, cid in self.by_socket.get(ws, ())
+        )
@@ -0,0 +1,74 @@
+"""
+A scriptable streamkit server on localhost for client tests.
+"""
+import asyncio
+import json
+
+import websockets
+
+from client_server_stream.server.protocol import Event, build_message
+
+
+def chunk(stream_id, *payloads):
+    if len(payloads) == 1:
+        data = {"payload": payloads[0]}
+    else:
+        data = {"payloads": list(payloads)}
+    return json.dumps(build_message(event=Event.STREAM_CHUNK, stream_id=stream_id, data=data))
+
+
+def end(stream_id):
+    return json.dumps(build_message(event=Event.STREAM_END, stream_id=stream_id))
+
+
+def error(stream_id, code, message="failed"):
+    return json.dumps(build_message(
+        event=Event.ERROR,
+        stream_id=stream_id,
+        data={"code": code, "message": message},
+    ))
+
+
+class FakeServer:
+    """
+    Calls `on_message(server, conn, msg)` for every decoded message;
+    `received` keeps (connection number, msg) for all of them.
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.received = []
+        self.connections = []
+        self.url = None
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await websockets.serve(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"ws://127.0.0.1:{port}/ws"
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, conn):
+        self.connections.append(conn)
+        number = len(self.connections)
+        try:
+            async for raw in conn:
+                msg = json.loads(raw)
+                self.received.append((number, msg))
+                await self.on_message(self, conn, msg)
+        except websockets.ConnectionClosed:
+            pass
+
+    def events(self, event):
+        return [msg for _, msg in self.received if msg["event"] == event]
+
+    async def wait_for(self, event, count=1, timeout=2.0):
+        async def poll():
+            while len(self.events(event)) < count:
+                await asyncio.sleep(0.005)
+        await asyncio.wait_for(poll(), timeout)
+        return self.events(event)
@@ -0,0 +1,23 @@
+"""
+The in-process RESP broker (server/broker.py) on a free local port.
+"""
+import asyncio
+
+from client_server_stream.server.broker import Broker
+
+
+class LocalBroker:
+    def __init__(self):
+        self.broker = Broker()
+        self.url = None
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self.broker.handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"redis://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
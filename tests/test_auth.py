@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+from client_server_stream.server.auth import CachedKeyStore, KeyStore, MemoryKeyStore, key_id
+from client_server_stream.server.resp import RespConnection
+from local_broker import LocalBroker
+
+USER1 = {"client": "user1", "max_streams": 5}
+
+
+class SlowKeyStore(MemoryKeyStore):
+    """
+    Memory store whose lookups wait for `release` and can be made to fail.
+    """
+
+    def __init__(self, keys):
+        super().__init__(keys)
+        self.lookups = 0
+        self.release = asyncio.Event()
+        self.release.set()
+        self.error = None
+
+    async def lookup(self, kid):
+        self.lookups += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return await super().lookup(kid)
+
+
+def test_key_store_is_abstract():
+    with pytest.raises(TypeError):
+        KeyStore()
+
+
+def test_hits_and_negative_hits_skip_the_store():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+        assert await cache.get("user1-key") == USER1
+        assert await cache.get("user1-key") == USER1
+        assert await cache.get("bad-key") is None
+        assert await cache.get("bad-key") is None
+        return store, cache
+
+    store, cache = asyncio.run(scenario())
+    assert store.lookups == 2
+    assert cache.results == {"hit": 1, "negative_hit": 1, "join": 0, "miss": 2, "stale": 0}
+
+
+def test_concurrent_misses_share_one_lookup():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        store.release.clear()
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+
+        gets = [asyncio.ensure_future(cache.get("user1-key")) for _ in range(5)]
+        await asyncio.sleep(0)
+        store.release.set()
+        return store, cache, await asyncio.gather(*gets)
+
+    store, cache, results = asyncio.run(scenario())
+    assert results == [USER1] * 5
+    assert store.lookups == 1
+    assert cache.results["join"] == 4
+    assert cache._inflight == {}
+
+
+def test_joiners_retry_when_the_leader_is_cancelled():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        store.release.clear()
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+
+        leader = asyncio.ensure_future(cache.get("user1-key"))
+        await asyncio.sleep(0)
+        joiner = asyncio.ensure_future(cache.get("user1-key"))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await asyncio.sleep(0)
+        store.release.set()
+        return store, await joiner, await asyncio.gather(leader, return_exceptions=True)
+
+    store, joined, (leader,) = asyncio.run(scenario())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert joined == USER1
+    assert store.lookups == 2
+
+
+def test_store_changes_invalidate_the_cache():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+        assert await cache.get("user1-key") == USER1
+
+        await store.revoke("user1-key")
+        assert await cache.get("user1-key") is None
+
+        await store.put("user1-key", {"client": "user1", "max_streams": 1})
+        return await cache.get("user1-key")
+
+    assert asyncio.run(scenario()) == {"client": "user1", "max_streams": 1}
+
+
+def test_invalidation_during_a_lookup_is_not_cached():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        store.release.clear()
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+
+        pending = asyncio.ensure_future(cache.get("user1-key"))
+        await asyncio.sleep(0)
+        cache.invalidate(key_id("user1-key"))
+        store.release.set()
+        await pending
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache._entries == {}
+    assert cache._stale == set()
+
+
+def test_expired_entry_is_served_while_the_store_is_down():
+    async def scenario():
+        store = SlowKeyStore({"user1-key": USER1})
+        cache = CachedKeyStore(store, size=10, ttl=60, negative_ttl=60)
+        assert await cache.get("user1-key") == USER1
+
+        kid = key_id("user1-key")
+        cache._entries[kid] = (0.0, USER1)
+        store.error = ConnectionError("down")
+        assert await cache.get("user1-key") == USER1
+
+        with pytest.raises(ConnectionError):
+            await cache.get("unknown-key")
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.results["stale"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    async def scenario():
+        store = SlowKeyStore({"a": USER1, "b": USER1, "c": USER1})
+        cache = CachedKeyStore(store, size=2, ttl=60, negative_ttl=60)
+        await cache.get("a")
+        await cache.get("b")
+        await cache.get("a")
+        await cache.get("c")
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert list(cache._entries) == [key_id("a"), key_id("c")]
+
+
+async def _invalidation_pair(url):
+    store_a = MemoryKeyStore({"user1-key": USER1})
+    store_b = MemoryKeyStore({"user1-key": USER1})
+    a = CachedKeyStore(store_a, size=10, ttl=60, negative_ttl=60, invalidation_url=url)
+    b = CachedKeyStore(store_b, size=10, ttl=60, negative_ttl=60, invalidation_url=url)
+    for cache in (a, b):
+        cache._channel.reconnect_delay = 0.01
+        await cache.start()
+    return store_a, a, b
+
+
+async def _until(condition, timeout=2.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_invalidations_reach_other_workers():
+    async def scenario():
+        async with LocalBroker() as broker:
+            store_a, a, b = await _invalidation_pair(broker.url)
+            try:
+                await _until(lambda: len(broker.broker.channels.get(b"streamkit:keys", ())) == 2)
+                await b.get("user1-key")
+                assert key_id("user1-key") in b._entries
+
+                await store_a.revoke("user1-key")
+                await _until(lambda: key_id("user1-key") not in b._entries)
+            finally:
+                await a.close()
+                await b.close()
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_subscriber_survives_a_malformed_message():
+    async def scenario():
+        async with LocalBroker() as broker:
+            store_a, a, b = await _invalidation_pair(broker.url)
+            try:
+                channel = b"streamkit:keys"
+                await _until(lambda: len(broker.broker.channels.get(channel, ())) == 2)
+
+                conn = await RespConnection.open(broker.url)
+                # not utf-8: the subscriber fails to decode it
+                await conn.execute("PUBLISH", "streamkit:keys", b"\xff\xfe")
+                await conn.close()
+                await _until(lambda: len(broker.broker.channels.get(channel, ())) == 2)
+
+                await b.get("user1-key")
+                await store_a.revoke("user1-key")
+                await _until(lambda: key_id("user1-key") not in b._entries)
+                return b._channel._task.done()
+            finally:
+                await a.close()
+                await b.close()
+
+    assert asyncio.run(scenario()) is False
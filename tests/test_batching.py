@@ -0,0 +1,141 @@
+import asyncio
+import json
+
+import pytest
+
+from client_server_stream.server import settings
+from client_server_stream.server.batching import BatchPolicy, batch_chunks
+from client_server_stream.server.channel_router import router
+from client_server_stream.server.flow_control import CreditWindow
+from client_server_stream.server.stream_manager import StreamManager
+
+
+async def ticks(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+async def collect(source):
+    return [batch async for batch in source]
+
+
+def test_flush_on_max_chunks():
+    policy = BatchPolicy(max_chunks=3, max_bytes=10**6, max_delay_ms=1000)
+    batches = asyncio.run(collect(batch_chunks(ticks(range(8)), policy)))
+    assert batches == [[0, 1, 2], [3, 4, 5], [6, 7]]
+
+
+def test_flush_on_max_bytes():
+    policy = BatchPolicy(max_chunks=100, max_bytes=5, max_delay_ms=1000)
+    batches = asyncio.run(collect(batch_chunks(ticks(["abc", "de", "f", "ghijkl", "m"]), policy)))
+    assert batches == [["abc", "de"], ["f", "ghijkl"], ["m"]]
+
+
+def test_flush_on_deadline_without_losing_the_pending_chunk():
+    async def slow():
+        yield 1
+        yield 2
+        await asyncio.sleep(0.1)
+        yield 3
+
+    policy = BatchPolicy(max_chunks=100, max_bytes=10**6, max_delay_ms=20)
+    assert asyncio.run(collect(batch_chunks(slow(), policy))) == [[1, 2], [3]]
+
+
+def test_chunks_before_a_plugin_error_are_delivered():
+    async def failing():
+        yield 1
+        yield 2
+        raise RuntimeError("plugin failed")
+
+    async def scenario():
+        got = []
+        with pytest.raises(RuntimeError):
+            async for batch in batch_chunks(failing(), BatchPolicy(10, 10**6, 1000)):
+                got.append(batch)
+        return got
+
+    assert asyncio.run(scenario()) == [[1, 2]]
+
+
+def test_closing_the_batcher_closes_the_source():
+    closed = []
+
+    async def endless():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0)
+        finally:
+            closed.append(True)
+
+    async def scenario():
+        batches = batch_chunks(endless(), BatchPolicy(2, 10**6, 1000))
+        first = await batches.__anext__()
+        await batches.aclose()
+        return first
+
+    assert asyncio.run(scenario()) == ["x", "x"]
+    assert closed == [True]
+
+
+def test_resolve_requested_batches():
+    default = BatchPolicy(4)
+    assert BatchPolicy.resolve(None, default) is default
+    assert BatchPolicy.resolve(False, default) is None
+    assert BatchPolicy.resolve(True, default) is default
+    assert BatchPolicy.resolve(True, None).max_chunks == 32
+
+    clamped = BatchPolicy.resolve({"max_chunks": 10**9, "max_bytes": 10**12, "max_delay_ms": 10**9}, None)
+    assert clamped.max_chunks == settings.BATCH_MAX_CHUNKS
+    assert clamped.max_bytes == settings.BATCH_MAX_BYTES
+    assert clamped.max_delay == settings.BATCH_MAX_DELAY_MS / 1000
+
+    for bad in ("yes", 3, {"max_chunks": "many"}, {"max_chunks": 0}, {"max_delay_ms": -1}):
+        with pytest.raises(ValueError):
+            BatchPolicy.resolve(bad, None)
+
+
+def test_within_caps_the_batch_to_a_credit_window():
+    policy = BatchPolicy(32, 100, 5)
+    assert policy.within(64) is policy
+    capped = policy.within(8)
+    assert (capped.max_chunks, capped.max_bytes, capped.max_delay) == (8, 100, 0.005)
+    assert policy.within(0).max_chunks == 1
+
+
+class FakeSocket:
+    def __init__(self):
+        self.data = []
+
+    async def send_text(self, text):
+        msg = json.loads(text)
+        if msg["event"] == "stream.chunk":
+            self.data.append(msg["data"])
+
+
+def test_batches_stay_within_the_credit_window():
+    async def scenario():
+        manager = StreamManager()
+        ws = FakeSocket()
+        router.attach(ws)
+        task = asyncio.ensure_future(manager.start_stream(
+            ws, "s1", "progress", ["c"], {"total": 10, "delay": 0},
+            candidate_id="cand", batch={"max_chunks": 8, "max_delay_ms": 1000},
+            credit=CreditWindow(chunks=3),
+        ))
+        try:
+            await asyncio.sleep(0.05)
+            manager.grant_credit(ws, "s1", chunks=10)
+            await asyncio.wait_for(task, 1)
+            await asyncio.sleep(0.01)
+        finally:
+            router.unsubscribe(ws)
+        return ws.data
+
+    data = asyncio.run(scenario())
+    sizes = [len(d["payloads"]) if "payloads" in d else 1 for d in data]
+    assert sizes == [3, 3, 3, 1]
+    assert data[-1]["payload"]["current"] == 10
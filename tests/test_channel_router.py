@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from client_server_stream.server.channel_router import ChannelRouter
+from client_server_stream.server.fanout import Frame
+
+ROUTES = [
+    ("homepage", "emit_channel", "homepage"),
+    ("button:1", "emit_candidate", "cand"),
+    ("button:2", "emit_candidate", "cand"),
+]
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+
+def frame_for(seq):
+    def build(channels):
+        return Frame({"channel": channels[0], "channels": list(channels), "seq": seq})
+    return build
+
+
+async def drain(router):
+    while any(sub.queue for sub in router.subscribers.values()):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+
+
+def received(ws):
+    return [(f["seq"], tuple(f["channels"])) for f in ws.frames]
+
+
+async def _emit_overlapping():
+    router = ChannelRouter()
+    producer, overlapping, patterns, other = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+    for ws in (producer, overlapping, patterns, other):
+        router.attach(ws)
+
+    # reaches every channel several times over: as a candidate observer
+    # (homepage service included), a channel subscriber mapped to the
+    # candidate and through two overlapping patterns
+    router.subscribe_candidate(overlapping, ["cand"])
+    router.subscribe_service("cand", ["homepage", "button:1"])
+    router.subscribe(overlapping, ["button:1"])
+    router.subscribe_patterns(overlapping, ["button:*", "*"])
+    router.subscribe_patterns(overlapping, ["button:1"], ["ca*"])
+
+    # only the button channels, twice each
+    router.subscribe_patterns(patterns, ["button:*", "button:2"], ["cand", "c*"])
+
+    # patterns that match none of the routes
+    router.subscribe_patterns(other, ["homepage"], ["someone-else"])
+    router.subscribe_patterns(other, ["button:3*"])
+
+    for seq in (1, 2, 3):
+        await router.emit_routes(ROUTES, frame_for(seq), sender=producer, candidate_id="cand")
+    await drain(router)
+    return producer, overlapping, patterns, other
+
+
+def test_emit_routes_delivers_each_chunk_once_per_socket():
+    producer, overlapping, patterns, other = asyncio.run(_emit_overlapping())
+
+    everything = ("homepage", "button:1", "button:2")
+    assert received(producer) == [(seq, everything) for seq in (1, 2, 3)]
+    assert received(overlapping) == [(seq, everything) for seq in (1, 2, 3)]
+    assert received(patterns) == [(seq, ("button:1", "button:2")) for seq in (1, 2, 3)]
+    assert received(other) == []
+
+
+def test_remote_emit_routes_derives_the_matched_channels():
+    async def scenario():
+        router = ChannelRouter()
+        ws = FakeSocket()
+        router.attach(ws)
+        router.subscribe_patterns(ws, ["button:2"], ["cand"])
+
+        text = json.dumps({
+            "channel": "homepage",
+            "channels": ["homepage", "button:1", "button:2"],
+            "candidate_id": "cand",
+            "seq": 7,
+        })
+        result = router.deliver("emit_routes", [list(route) for route in ROUTES], None, Frame.from_text(text))
+        await drain(router)
+        return result, ws
+
+    result, ws = asyncio.run(scenario())
+    assert result.queued == 1
+    assert [(f["seq"], f["channel"], f.get("channels")) for f in ws.frames] == [(7, "button:2", None)]
+
+
+def test_unsubscribe_drops_pattern_subscriptions():
+    router = ChannelRouter()
+    ws = FakeSocket()
+    router.subscribe_patterns(ws, ["button:*"], ["cand", "other"])
+    assert router.reaches_pattern(ws, "button:4", "other")
+
+    assert router.unsubscribe_patterns(ws, candidates=["other"]) == 1
+    assert not router.reaches_pattern(ws, "button:4", "other")
+
+    router.unsubscribe(ws)
+    assert len(router.patterns) == 0
+    assert router.patterns.match("button:4", "cand") == set()
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from client_server_stream.client import StreamClient
+from client_server_stream.client.pool import TransportPool
+from fake_server import FakeServer, chunk, end
+
+
+def test_pool_size_is_validated():
+    with pytest.raises(ValueError):
+        TransportPool("ws://127.0.0.1:1/ws", size=0)
+
+
+def test_pool_spreads_streams_by_load():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            await conn.send(chunk(msg["stream_id"], msg["data"]["payload"]))
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            pool = TransportPool(server.url, size=3, ping_interval=None)
+            await pool.connect()
+            streams = [pool.open_stream(channel="c", payload=i) for i in range(6)]
+            try:
+                firsts = [await s.__anext__() for s in streams]
+                assigned = [c["assigned"] for c in pool.stats()["connections"]]
+
+                # closing a stream frees its connection for the next one
+                for s in streams[:2]:
+                    await s.aclose()
+                freed = [c["assigned"] for c in pool.stats()["connections"]]
+                again = pool.open_stream(channel="c", payload="next")
+                await again.__anext__()
+                streams.append(again)
+                return server, firsts, assigned, freed, pool._load[:]
+            finally:
+                for s in streams:
+                    await s.aclose()
+                await pool.close()
+
+    server, firsts, assigned, freed, load = asyncio.run(scenario())
+    assert firsts == list(range(6))
+    assert assigned == [2, 2, 2]
+    assert sorted(freed) == [1, 1, 2]
+    assert sorted(load) == [1, 2, 2]
+    per_connection = {}
+    for number, msg in server.received:
+        if msg["event"] == "stream.start":
+            per_connection[number] = per_connection.get(number, 0) + 1
+    assert sorted(per_connection.values()) == [2, 2, 3]
+
+
+def test_pool_breaks_ties_by_queued_chunks():
+    pool = TransportPool("ws://127.0.0.1:1/ws", size=2)
+    busy = pool.transports[0]
+    busy._streams["s"] = type("S", (), {"queue": asyncio.Queue()})()
+    busy._streams["s"].queue.put_nowait(1)
+    assert pool._pick() == 1
+    pool._load[1] = 1
+    assert pool._pick() == 0
+
+
+def _push(handler, **options):
+    """
+    Run one push-API stream against a fake server; returns the callback
+    log once on_end or on_error was called.
+    """
+    calls = []
+
+    async def scenario():
+        async with FakeServer(handler) as server:
+            client = StreamClient(server.url)
+            client._transport.ping_interval = None
+            done = asyncio.Event()
+            loop = asyncio.get_running_loop()
+
+            def record(name):
+                def callback(*args):
+                    calls.append((name, args, threading.current_thread().name))
+                    if name in ("end", "error"):
+                        loop.call_soon_threadsafe(done.set)
+                return callback
+
+            callbacks = {
+                k: v if callable(v) else record(v)
+                for k, v in options.pop("callbacks").items()
+            }
+            client.start_stream(
+                channel="c", payload={}, on_end=record("end"), on_error=record("error"),
+                **callbacks, **options,
+            )
+            try:
+                await asyncio.wait_for(done.wait(), 5)
+            finally:
+                await client.close()
+
+    asyncio.run(scenario())
+    return calls
+
+
+def burst(*groups):
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            for group in groups:
+                await conn.send(chunk(msg["stream_id"], *group))
+                await asyncio.sleep(0.02)
+            await conn.send(end(msg["stream_id"]))
+    return on_message
+
+
+def test_on_chunks_receives_what_arrived_since_the_last_call():
+    calls = _push(burst([1, 2, 3], [4], [5, 6]), callbacks={"on_chunks": "chunks"})
+    batches = [args[0] for name, args, _ in calls if name == "chunks"]
+    assert batches == [[1, 2, 3], [4], [5, 6]]
+    assert calls[-1][0] == "end"
+
+
+def test_executor_dispatch_runs_callbacks_in_order_off_the_loop():
+    loop_thread = threading.current_thread().name
+    seen = []
+
+    def slow(item):
+        # later chunks must wait for earlier callbacks
+        time.sleep(0.01 if item % 2 else 0)
+        seen.append((item, threading.current_thread().name))
+
+    calls = _push(
+        burst(range(10)),
+        callbacks={"on_chunk": slow},
+        dispatch="executor",
+        handoff_size=2,
+    )
+    assert [item for item, _ in seen] == list(range(10))
+    assert all(name.startswith("streamkit-callback") for _, name in seen)
+    assert [name for name, _, _ in calls] == ["end"]
+    assert calls[0][2] != loop_thread
+
+
+def test_failing_executor_callback_reports_once_and_stops_delivery():
+    seen = []
+
+    def fragile(item):
+        seen.append(item)
+        if item == 2:
+            raise ValueError("bad chunk")
+
+    calls = _push(burst(range(6)), callbacks={"on_chunk": fragile}, dispatch="executor")
+    assert seen == [0, 1, 2]
+    ((name, (e,), _),) = calls
+    assert name == "error" and isinstance(e, ValueError)
+
+
+def test_start_stream_validates_its_callbacks():
+    client = StreamClient("ws://127.0.0.1:1/ws")
+    with pytest.raises(ValueError):
+        client.start_stream(channel="c", payload={})
+    with pytest.raises(ValueError):
+        client.start_stream(channel="c", payload={}, on_chunk=print, on_chunks=print)
+    with pytest.raises(ValueError):
+        client.start_stream(channel="c", payload={}, on_chunk=print, dispatch="process")
@@ -0,0 +1,65 @@
+from client_server_stream.server.compact import CompactChunk, Expander, delta
+
+ENVELOPE = {
+    "protocol": "streamkit/1.0",
+    "event": "stream.chunk",
+    "stream_id": "s1",
+    "channel": "homepage",
+    "channels": ["homepage", "button:1"],
+    "candidate_id": "cand",
+    "message_id": "m1",
+}
+
+
+def bind(handle, seq, payload):
+    return {**ENVELOPE, "seq": seq, "data": {"payload": payload}, "meta": {}, "h": handle}
+
+
+def test_delta_only_for_dicts_without_removed_keys():
+    assert delta({"a": 1, "b": 2}, {"a": 1, "b": 3, "c": 4}) == {"b": 3, "c": 4}
+    assert delta({"a": 1, "b": 2}, {"a": 1}) is None
+    assert delta("x", {"a": 1}) is None
+
+
+def test_expander_rebuilds_compact_frames():
+    expander = Expander()
+
+    first = expander.expand(bind(7, 1, {"current": 1, "total": 3}))
+    assert "h" not in first
+    assert first["data"] == {"payload": {"current": 1, "total": 3}}
+
+    chunk = CompactChunk(7, 2, {"payload": {"current": 2, "total": 3}}, base=1, delta={"current": 2})
+    second = expander.expand(chunk.message(use_delta=True))
+    assert second["data"] == {"payload": {"current": 2, "total": 3}}
+    assert second["seq"] == 2
+    assert second["channels"] == ["homepage", "button:1"]
+    assert (second["stream_id"], second["candidate_id"], second["message_id"]) == ("s1", "cand", "m1")
+
+    batched = expander.expand(CompactChunk(7, 3, {"payloads": [1, 2]}, meta={"ts": 1.5}).message(False))
+    assert batched["data"] == {"payloads": [1, 2]}
+    assert batched["meta"] == {"ts": 1.5}
+
+    end = expander.expand(CompactChunk(7, 4, end=True).message(False))
+    assert end["event"] == "stream.end"
+    assert end["data"] == {}
+
+    # the handle is released with the end
+    assert expander.expand({"h": 7, "s": 5, "p": "late"}) is None
+
+
+def test_full_payload_after_a_gap_resets_the_delta_base():
+    expander = Expander()
+    expander.expand(bind(3, 1, {"a": 1, "b": 1}))
+
+    full = CompactChunk(3, 5, {"payload": {"a": 5, "b": 5}}, base=4, delta={"a": 5})
+    assert expander.expand(full.message(use_delta=False))["data"]["payload"] == {"a": 5, "b": 5}
+
+    follow_up = expander.expand({"h": 3, "s": 6, "d": {"b": 6}})
+    assert follow_up["data"]["payload"] == {"a": 5, "b": 6}
+
+
+def test_regular_messages_pass_through():
+    expander = Expander()
+    message = {"event": "error", "stream_id": None, "data": {}, "meta": {}}
+    assert expander.expand(message) is message
+    assert expander.expand({"h": 99, "s": 1, "p": "x"}) is None
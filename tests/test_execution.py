@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from client_server_stream.server.execution import PluginExecutor, execution_mode
+from client_server_stream.server.plugins.base import StreamPlugin
+
+
+class CountingPlugin(StreamPlugin):
+    """
+    Blocking generator that records how far it got and whether it was
+    closed.
+    """
+
+    name = "counting"
+    execution = "thread"
+    queue_size = 2
+
+    def __init__(self):
+        self.produced = 0
+        self.closed = threading.Event()
+
+    def stream(self, payload):
+        try:
+            for i in range(payload.get("total", 1000)):
+                self.produced += 1
+                yield i
+            if payload.get("fail"):
+                raise ValueError("plugin failed")
+        finally:
+            self.closed.set()
+
+
+class MarkerPlugin(StreamPlugin):
+    """
+    Process-mode plugin; leaves `payload["marker"]` behind when its
+    generator is closed.
+    """
+
+    name = "marker"
+    execution = "process"
+    queue_size = 2
+
+    def stream(self, payload):
+        try:
+            for i in range(payload.get("total", 10**6)):
+                yield i
+            if payload.get("fail"):
+                raise ValueError("plugin failed")
+        finally:
+            if payload.get("marker"):
+                with open(payload["marker"], "w") as f:
+                    f.write("closed")
+
+
+def test_execution_mode_defaults_and_validation():
+    class AsyncPlugin(StreamPlugin):
+        name = "async"
+
+        async def stream(self, payload):
+            yield 1
+
+    assert execution_mode(AsyncPlugin()) == "async"
+    plain = CountingPlugin()
+    plain.execution = None
+    assert execution_mode(plain) == "thread"
+    plain.execution = "fiber"
+    with pytest.raises(ValueError):
+        execution_mode(plain)
+
+
+def test_thread_mode_delivers_every_chunk_in_order():
+    async def scenario():
+        executor = PluginExecutor(thread_workers=2)
+        try:
+            return [c async for c in executor.stream(CountingPlugin(), {"total": 50})]
+        finally:
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == list(range(50))
+
+
+def test_thread_producer_blocks_on_a_full_queue():
+    async def scenario():
+        executor = PluginExecutor(thread_workers=2)
+        plugin = CountingPlugin()
+        stream = executor.stream(plugin, {})
+        try:
+            assert await stream.__anext__() == 0
+            await asyncio.sleep(0.1)
+            produced = plugin.produced
+            await stream.aclose()
+            return plugin, produced
+        finally:
+            executor.shutdown()
+
+    plugin, produced = asyncio.run(scenario())
+    # one consumed, two queued, one blocked handing over
+    assert produced <= 4
+    assert plugin.closed.wait(1)
+
+
+def test_cancelling_a_thread_stream_stops_the_producer():
+    async def scenario():
+        executor = PluginExecutor(thread_workers=1)
+        plugin = CountingPlugin()
+
+        async def consume():
+            async for _ in executor.stream(plugin, {}):
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        try:
+            assert await asyncio.to_thread(plugin.closed.wait, 1)
+            # the worker is free for the next stream
+            return [c async for c in executor.stream(CountingPlugin(), {"total": 3})]
+        finally:
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+
+
+def test_thread_plugin_error_reaches_the_consumer():
+    async def scenario():
+        executor = PluginExecutor(thread_workers=1)
+        got = []
+        try:
+            with pytest.raises(ValueError):
+                async for chunk in executor.stream(CountingPlugin(), {"total": 3, "fail": True}):
+                    got.append(chunk)
+        finally:
+            executor.shutdown()
+        return got
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+
+
+def test_process_mode_streams_and_propagates_errors():
+    async def scenario():
+        executor = PluginExecutor(process_workers=1)
+        try:
+            ok = [c async for c in executor.stream(MarkerPlugin(), {"total": 20})]
+            got = []
+            with pytest.raises(ValueError):
+                async for chunk in executor.stream(MarkerPlugin(), {"total": 2, "fail": True}):
+                    got.append(chunk)
+            return ok, got
+        finally:
+            executor.shutdown()
+
+    ok, got = asyncio.run(scenario())
+    assert ok == list(range(20))
+    assert got == [0, 1]
+
+
+def test_closing_a_process_stream_stops_the_child(tmp_path):
+    marker = tmp_path / "closed"
+
+    async def scenario():
+        executor = PluginExecutor(process_workers=1)
+        stream = executor.stream(MarkerPlugin(), {"marker": str(marker)})
+        try:
+            assert [await stream.__anext__() for _ in range(3)] == [0, 1, 2]
+            await stream.aclose()
+            deadline = time.monotonic() + 5
+            while not marker.exists() and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
+    assert marker.read_text() == "closed"
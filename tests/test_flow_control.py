@@ -0,0 +1,130 @@
+import asyncio
+import json
+
+import pytest
+
+from client_server_stream.client.transport import StreamTransport
+from client_server_stream.server.channel_router import router
+from client_server_stream.server.flow_control import CreditWindow
+from client_server_stream.server.stream_manager import StreamManager
+from fake_server import FakeServer, chunk, end
+
+
+def test_window_from_meta():
+    assert CreditWindow.from_meta(None) is None
+    window = CreditWindow.from_meta({"chunks": 4})
+    assert (window.chunks, window.bytes) == (4, None)
+
+    for meta in ("4", {}, {"chunks": -1}, {"bytes": 1.5}, {"chunks": True}):
+        with pytest.raises(ValueError):
+            CreditWindow.from_meta(meta)
+
+
+def test_window_suspends_until_credit_in_every_dimension():
+    async def scenario():
+        window = CreditWindow(chunks=2, bytes=100)
+        window.spend(["a", "b"])
+        assert not window.available()
+
+        waiter = asyncio.ensure_future(window.wait())
+        await asyncio.sleep(0)
+        window.grant(chunks=1)
+        await asyncio.sleep(0)
+        assert waiter.done()
+
+        window.spend(["x" * 200])
+        waiter = asyncio.ensure_future(window.wait())
+        window.grant(chunks=5)
+        await asyncio.sleep(0)
+        # bytes are still overdrawn
+        assert not waiter.done()
+        window.grant(nbytes=200)
+        await asyncio.wait_for(waiter, 1)
+        return window
+
+    window = asyncio.run(scenario())
+    assert window.available()
+
+
+class FakeSocket:
+    def __init__(self):
+        self.chunks = []
+
+    async def send_text(self, text):
+        msg = json.loads(text)
+        if msg["event"] == "stream.chunk":
+            self.chunks.append(msg["data"]["payload"]["current"])
+
+
+def test_stream_pauses_at_the_end_of_its_window():
+    async def scenario():
+        manager = StreamManager()
+        ws = FakeSocket()
+        router.attach(ws)
+        task = asyncio.ensure_future(manager.start_stream(
+            ws, "s1", "progress", ["c"], {"total": 1000, "delay": 0},
+            candidate_id="cand", credit=CreditWindow(chunks=3),
+        ))
+        try:
+            await asyncio.sleep(0.05)
+            paused = list(ws.chunks)
+
+            assert manager.grant_credit(ws, "s1", chunks=2)
+            await asyncio.sleep(0.05)
+            resumed = list(ws.chunks)
+            assert not manager.grant_credit(object(), "s1", chunks=2)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            router.unsubscribe(ws)
+        return paused, resumed
+
+    paused, resumed = asyncio.run(scenario())
+    assert paused == [1, 2, 3]
+    assert resumed == [1, 2, 3, 4, 5]
+
+
+def test_client_grants_credit_as_it_consumes():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            for i in range(4):
+                await conn.send(chunk(msg["stream_id"], i))
+        elif msg["event"] == "stream.credit":
+            if len(server.events("stream.credit")) == 2:
+                await conn.send(end(msg["stream_id"]))
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            transport = StreamTransport(server.url, ping_interval=None)
+            got = [item async for item in transport.open_stream(channel="c", payload={}, window=4)]
+            await transport.close()
+            return server, got
+
+    server, got = asyncio.run(scenario())
+    assert got == [0, 1, 2, 3]
+    assert [m["data"]["chunks"] for m in server.events("stream.credit")] == [2, 2]
+    (start,) = server.events("stream.start")
+    assert start["meta"]["credit"] == {"chunks": 4}
+    assert server.events("stream.cancel") == []
+
+
+def test_consumer_stopping_early_cancels_the_stream():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            for i in range(3):
+                await conn.send(chunk(msg["stream_id"], i))
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            transport = StreamTransport(server.url, ping_interval=None)
+            stream = transport.open_stream(channel="c", payload={}, window=4)
+            first = await stream.__anext__()
+            await stream.aclose()
+            cancels = await server.wait_for("stream.cancel")
+            await transport.close()
+            return server, first, cancels
+
+    server, first, (cancel,) = asyncio.run(scenario())
+    (start,) = server.events("stream.start")
+    assert first == 0
+    assert (cancel["stream_id"], cancel["channel"]) == (start["stream_id"], "c")
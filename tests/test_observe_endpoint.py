@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from client_server_stream.server.app import observe_endpoint
+from client_server_stream.server.channel_router import router
+
+
+class FakeWebSocket:
+    """
+    Observer socket whose first receive returns `incoming`, or raises it.
+    """
+
+    def __init__(self, incoming, **query):
+        self.scope = {"subprotocols": []}
+        self.query_params = {"candidate_id": "cand", **query}
+        self.incoming = incoming
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        if isinstance(self.incoming, BaseException):
+            raise self.incoming
+        return self.incoming
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+@pytest.mark.parametrize("query", [{}, {"channels": "button:*"}])
+@pytest.mark.parametrize("incoming", [
+    {"type": "websocket.disconnect", "code": 1000},
+    RuntimeError("send failed"),
+    asyncio.CancelledError(),
+])
+def test_observer_is_unsubscribed_however_it_ends(incoming, query):
+    ws = FakeWebSocket(incoming, **query)
+
+    async def scenario():
+        try:
+            await observe_endpoint(ws)
+        except BaseException as e:
+            return e
+
+    error = asyncio.run(scenario())
+    if isinstance(incoming, BaseException):
+        assert error is incoming
+    assert ws not in router.subscribers
+    assert ws not in router.ws_candidates
+    assert router.patterns.subscriptions(ws) == []
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+
+from client_server_stream.server.channel_router import router
+from client_server_stream.server.plugins.base import StreamPlugin
+from client_server_stream.server.plugins.registry import PluginRegistry
+from client_server_stream.server.stream_manager import StreamManager
+
+
+class GatedPlugin(StreamPlugin):
+    """
+    Plugin whose startup waits for `gate` and counts its runs.
+    """
+
+    name = "gated"
+    gate = None
+    startups = 0
+    fail = False
+
+    async def startup(self):
+        type(self).startups += 1
+        await type(self).gate.wait()
+        if type(self).fail:
+            raise RuntimeError("startup failed")
+
+    async def stream(self, payload):
+        yield payload
+
+
+@pytest.fixture
+def registry():
+    GatedPlugin.startups = 0
+    GatedPlugin.fail = False
+    registry = PluginRegistry(None)
+    registry.manifest["gated"] = f"{__name__}:GatedPlugin"
+    return registry
+
+
+def test_plugins_load_on_first_use(registry):
+    async def scenario():
+        GatedPlugin.gate = asyncio.Event()
+        GatedPlugin.gate.set()
+        assert "gated" in registry
+        assert registry.loaded == {}
+
+        plugin = await registry.get("gated")
+        assert await registry.get("gated") is plugin
+        return plugin
+
+    plugin = asyncio.run(scenario())
+    assert registry.loaded == {"gated": plugin}
+    assert GatedPlugin.startups == 1
+    assert asyncio.run(registry.get("missing")) is None
+
+
+def test_concurrent_first_streams_share_one_load(registry):
+    async def scenario():
+        GatedPlugin.gate = asyncio.Event()
+        acquires = [asyncio.ensure_future(registry.acquire("gated")) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        GatedPlugin.gate.set()
+        return await asyncio.gather(*acquires)
+
+    plugins = asyncio.run(scenario())
+    assert len(set(plugins)) == 1
+    assert GatedPlugin.startups == 1
+    assert registry.stats()["loaded"]["gated"]["streams"] == 5
+
+
+def test_joiners_retry_when_the_first_load_is_cancelled(registry):
+    async def scenario():
+        GatedPlugin.gate = asyncio.Event()
+        first = asyncio.ensure_future(registry.acquire("gated"))
+        await asyncio.sleep(0.05)
+        joiner = asyncio.ensure_future(registry.acquire("gated"))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0.05)
+        GatedPlugin.gate.set()
+        return await joiner, await asyncio.gather(first, return_exceptions=True)
+
+    plugin, (first,) = asyncio.run(scenario())
+    assert isinstance(first, asyncio.CancelledError)
+    assert registry.loaded == {"gated": plugin}
+    assert GatedPlugin.startups == 2
+
+
+def test_failed_load_fails_every_waiter_and_is_retried(registry):
+    async def scenario():
+        GatedPlugin.gate = asyncio.Event()
+        GatedPlugin.fail = True
+        gets = [asyncio.ensure_future(registry.get("gated")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        GatedPlugin.gate.set()
+        results = await asyncio.gather(*gets, return_exceptions=True)
+
+        GatedPlugin.fail = False
+        return results, await registry.get("gated")
+
+    results, plugin = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert registry.loaded == {"gated": plugin}
+    assert GatedPlugin.startups == 2
+
+
+class FakeSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_text(self, text):
+        self.messages.append(json.loads(text))
+
+
+@pytest.mark.parametrize("plugin_name, code", [
+    ("missing", "PLUGIN_NOT_FOUND"),
+    ("gated", "PLUGIN_LOAD_FAILED"),
+])
+def test_stream_of_an_unusable_plugin_gets_an_error(registry, plugin_name, code):
+    async def scenario():
+        GatedPlugin.gate = asyncio.Event()
+        GatedPlugin.gate.set()
+        GatedPlugin.fail = True
+        manager = StreamManager()
+        manager.plugins = registry
+        ws = FakeSocket()
+        router.attach(ws)
+        try:
+            await manager.start_stream(ws, "s1", plugin_name, ["c"], {}, candidate_id="cand")
+            await asyncio.sleep(0.01)
+        finally:
+            router.unsubscribe(ws)
+        return ws.messages
+
+    messages = asyncio.run(scenario())
+    assert [(m["event"], m["stream_id"], m["data"]["code"]) for m in messages] == [("error", "s1", code)]
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from client_server_stream.server.quota import Quota, TokenBucket
+
+
+def test_bucket_starts_full_and_goes_into_debt():
+    bucket = TokenBucket(rate=10, burst=5)
+    now = bucket.updated
+
+    assert bucket.take(5, now) == 0.0
+    # 5 tokens short at 10 tokens/s
+    assert bucket.take(5, now) == pytest.approx(0.5)
+
+
+def test_bucket_refills_up_to_its_burst():
+    bucket = TokenBucket(rate=10, burst=5)
+    now = bucket.updated
+    bucket.take(5, now)
+
+    # 0.3 s later three tokens are back
+    assert bucket.take(3, now + 0.3) == pytest.approx(0.0)
+    # a long idle period never banks more than the burst
+    assert bucket.take(6, now + 100) == pytest.approx(0.1)
+
+
+def test_bucket_burst_defaults_to_one_second():
+    bucket = TokenBucket(rate=4)
+    assert bucket.burst == 4
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_quota_without_limits_only_counts():
+    quota = Quota.from_client_info({"client": "user1", "max_streams": 5})
+    assert asyncio.run(quota.pace(3, 300)) == 0.0
+    assert quota.stats()["chunks"] == 3
+    assert quota.stats()["bytes"] == 300
+    assert quota.stats()["chunks_per_sec"] is None
+
+
+def test_quota_paces_on_the_tighter_bucket():
+    quota = Quota("user1", chunks_per_sec=1000, bytes_per_sec=100, bytes_burst=100)
+    delay = asyncio.run(quota.pace(1, 110))
+    assert delay == pytest.approx(0.1, abs=0.01)
+    assert quota.throttled == pytest.approx(delay)
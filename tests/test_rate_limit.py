@@ -0,0 +1,144 @@
+import asyncio
+import socket
+
+import pytest
+
+from client_server_stream.server.rate_limit import (
+    InMemoryRateLimiter,
+    RateLimitError,
+    SharedRateLimiter,
+    StreamRateLimiter,
+    create_limiter,
+)
+from local_broker import LocalBroker
+
+
+def test_limiter_base_is_abstract():
+    with pytest.raises(TypeError):
+        StreamRateLimiter()
+
+
+def test_in_memory_limiter_counts_leases_per_key():
+    async def scenario():
+        limiter = InMemoryRateLimiter()
+        first = await limiter.acquire("k", 2)
+        await limiter.acquire("k", 2)
+        with pytest.raises(RateLimitError):
+            await limiter.acquire("k", 2)
+        await limiter.acquire("other", 2)
+
+        await limiter.release(first)
+        await limiter.release(first)
+        assert limiter.held("k") == 1
+        await limiter.acquire("k", 2)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.held("k") == 2
+    assert isinstance(create_limiter(""), InMemoryRateLimiter)
+
+
+def _slots(broker, api_key):
+    return broker.broker.zsets.get(b"streamkit:slots:" + api_key.encode(), {})
+
+
+def test_shared_limiter_caps_streams_across_workers():
+    async def scenario():
+        async with LocalBroker() as broker:
+            a, b = SharedRateLimiter(broker.url), SharedRateLimiter(broker.url)
+            await a.start()
+            await b.start()
+            try:
+                lease = await a.acquire("k", 2)
+                await b.acquire("k", 2)
+                with pytest.raises(RateLimitError):
+                    await a.acquire("k", 2)
+                with pytest.raises(RateLimitError):
+                    await b.acquire("k", 2)
+                # the refused leases were taken back
+                assert len(_slots(broker, "k")) == 2
+
+                await a.release(lease)
+                await b.acquire("k", 2)
+                held = len(_slots(broker, "k"))
+            finally:
+                await a.close()
+                await b.close()
+            return held, len(_slots(broker, "k"))
+
+    held, after_close = asyncio.run(scenario())
+    assert held == 2
+    assert after_close == 0
+
+
+def test_slots_of_a_dead_worker_expire():
+    async def scenario():
+        async with LocalBroker() as broker:
+            crashed = SharedRateLimiter(broker.url, ttl=0.1)
+            alive = SharedRateLimiter(broker.url, ttl=0.1)
+            await crashed.start()
+            await alive.start()
+            try:
+                await crashed.acquire("k", 1)
+                await alive.acquire("k", 5)
+                # the crashed worker stops renewing without releasing
+                crashed._heartbeat.cancel()
+                await asyncio.sleep(0.3)
+
+                # the live worker's lease was kept alive by its heartbeat
+                await alive.acquire("k", 2)
+                with pytest.raises(RateLimitError):
+                    await alive.acquire("k", 2)
+            finally:
+                crashed._leases.clear()
+                await crashed.close()
+                await alive.close()
+
+    asyncio.run(scenario())
+
+
+def test_heartbeat_survives_an_unexpected_error():
+    async def scenario():
+        async with LocalBroker() as broker:
+            limiter = SharedRateLimiter(broker.url, ttl=0.06)
+            await limiter.start()
+            try:
+                lease = await limiter.acquire("k", 1)
+                pipeline = limiter._connection_pipeline
+                failures = []
+
+                async def broken(commands):
+                    if not failures:
+                        failures.append(commands)
+                        raise ValueError("unexpected reply")
+                    return await pipeline(commands)
+
+                limiter._connection_pipeline = broken
+                await asyncio.sleep(0.05)
+                assert failures
+                before = _slots(broker, "k")[lease.lease_id.encode()]
+                await asyncio.sleep(0.1)
+                after = _slots(broker, "k")[lease.lease_id.encode()]
+                return before, after, limiter._heartbeat.done()
+            finally:
+                await limiter.close()
+
+    before, after, stopped = asyncio.run(scenario())
+    assert after > before
+    assert not stopped
+
+
+def test_unreachable_store_limits_per_process():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def scenario():
+        limiter = SharedRateLimiter(f"redis://127.0.0.1:{port}")
+        await limiter.acquire("k", 1)
+        with pytest.raises(RateLimitError):
+            await limiter.acquire("k", 1)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.held("k") == 1
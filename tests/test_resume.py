@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+import pytest
+
+from client_server_stream.server.app import manager as app_manager, observe_endpoint
+from client_server_stream.server.channel_router import router
+from client_server_stream.server.stream_manager import StreamManager
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_text(self, text):
+        self.messages.append(json.loads(text))
+
+    def seqs(self, stream_id="s1"):
+        return [m["seq"] for m in self.messages if m.get("stream_id") == stream_id]
+
+
+async def drain():
+    while any(sub.queue for sub in router.subscribers.values()):
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.01)
+
+
+async def run_stream(manager, producer, stream_id="s1", total=10, delay=0, message_id=None, channels=("button:1",)):
+    router.attach(producer)
+    await manager.start_stream(
+        producer, stream_id, "progress", list(channels), {"total": total, "delay": delay},
+        candidate_id="cand", message_id=message_id,
+    )
+
+
+def observer(channels=("button:*",)):
+    ws = RecordingSocket()
+    router.attach(ws)
+    router.subscribe_patterns(ws, list(channels), ["cand"])
+    return ws
+
+
+def test_resume_replays_the_frames_after_the_last_seq():
+    async def scenario():
+        manager = StreamManager()
+        producer = RecordingSocket()
+        await run_stream(manager, producer, message_id="m1")
+        ws = observer()
+        try:
+            replayed = manager.resume(ws, "m1", 7)
+            await drain()
+        finally:
+            router.unsubscribe(producer)
+            router.unsubscribe(ws)
+        return replayed, ws
+
+    replayed, ws = asyncio.run(scenario())
+    # chunks 8-10 and the end
+    assert replayed == 4
+    assert ws.seqs() == [8, 9, 10, 11]
+    assert ws.messages[-1]["event"] == "stream.end"
+
+
+def test_resume_joins_a_live_stream_without_gap_or_duplicate():
+    async def scenario():
+        manager = StreamManager()
+        producer = RecordingSocket()
+        task = asyncio.ensure_future(run_stream(manager, producer, total=30, delay=0.002))
+        try:
+            while manager.streams == {} or next(iter(manager.streams.values())).seq < 5:
+                await asyncio.sleep(0.001)
+            ws = observer()
+            manager.resume(ws, "s1", 2)
+            await task
+            await drain()
+        finally:
+            router.unsubscribe(producer)
+            router.unsubscribe(ws)
+        return ws
+
+    assert asyncio.run(scenario()).seqs() == list(range(3, 32))
+
+
+def test_resume_only_replays_channels_the_observer_matches():
+    async def scenario():
+        manager = StreamManager()
+        producer = RecordingSocket()
+        await run_stream(manager, producer, channels=("button:1", "homepage"))
+        matching, other = observer(), observer(["slider:*"])
+        try:
+            counts = manager.resume(matching, "s1", 9), manager.resume(other, "s1", 9)
+            await drain()
+        finally:
+            for ws in (producer, matching, other):
+                router.unsubscribe(ws)
+        return counts, matching
+
+    counts, matching = asyncio.run(scenario())
+    assert counts == (2, 0)
+    assert {m["channel"] for m in matching.messages} == {"button:1"}
+
+
+def test_resume_outside_the_buffer_is_refused():
+    async def scenario():
+        manager = StreamManager()
+        plugin = await manager.plugins.get("progress")
+        plugin.replay_buffer = 4
+        producer = RecordingSocket()
+        await run_stream(manager, producer)
+        ws = observer()
+        try:
+            # seqs 8-11 are buffered: resuming after 7 still works
+            assert manager.resume(ws, "s1", 7) == 4
+            with pytest.raises(LookupError):
+                manager.resume(ws, "s1", 6)
+            with pytest.raises(LookupError):
+                manager.resume(ws, "unknown", 0)
+        finally:
+            router.unsubscribe(producer)
+            router.unsubscribe(ws)
+
+    asyncio.run(scenario())
+
+
+def test_stream_id_shared_by_two_producers_resumes_by_message_id():
+    async def scenario():
+        manager = StreamManager()
+        first, second = RecordingSocket(), RecordingSocket()
+        await run_stream(manager, first, message_id="m1", total=3)
+        await run_stream(manager, second, message_id="m2", total=5)
+        ws = observer()
+        try:
+            with pytest.raises(LookupError):
+                manager.resume(ws, "s1", 0)
+            replayed = manager.resume(ws, "m2", 0)
+            await drain()
+        finally:
+            for sock in (first, second, ws):
+                router.unsubscribe(sock)
+        return replayed, ws
+
+    replayed, ws = asyncio.run(scenario())
+    assert replayed == 6
+    assert {m["message_id"] for m in ws.messages} == {"m2"}
+
+
+class ObserverSocket(RecordingSocket):
+    def __init__(self, **query):
+        super().__init__()
+        self.scope = {"subprotocols": []}
+        self.query_params = {"candidate_id": "cand", **query}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        await drain()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+
+@pytest.mark.parametrize("resume_from", ["m1:7", "s1:7"])
+def test_observe_endpoint_resumes_from_the_query(resume_from):
+    async def scenario():
+        producer = RecordingSocket()
+        await run_stream(app_manager, producer, message_id="m1")
+        ws = ObserverSocket(resume_from=resume_from)
+        try:
+            await observe_endpoint(ws)
+        finally:
+            router.unsubscribe(producer)
+            for state in list(app_manager.streams.values()):
+                app_manager._forget(producer, state)
+        return ws
+
+    assert asyncio.run(scenario()).seqs() == [8, 9, 10, 11]
+
+
+@pytest.mark.parametrize("resume_from", ["unknown:3", "s1:not-a-seq", "no-seq"])
+def test_observe_endpoint_reports_an_unavailable_resume(resume_from):
+    ws = ObserverSocket(resume_from=resume_from)
+    asyncio.run(observe_endpoint(ws))
+    errors = [m for m in ws.messages if m["event"] == "error"]
+    assert [e["data"]["code"] for e in errors] == ["RESUME_UNAVAILABLE"]
@@ -0,0 +1,112 @@
+import asyncio
+from collections import Counter
+
+from client_server_stream.server.scheduler import StreamScheduler
+
+
+async def _run_streams(scheduler, streams, turns):
+    """
+    Run one task per (stream_id, client, priority) that takes a turn per
+    chunk; returns the order in which the turns were granted.
+    """
+    order = []
+    owner = object()
+
+    async def stream(stream_id, client, priority):
+        ticket = scheduler.register(owner, stream_id, client, priority)
+        try:
+            while len(order) < turns:
+                await ticket.checkpoint()
+                order.append(stream_id)
+        finally:
+            ticket.close()
+
+    await asyncio.gather(*(stream(*s) for s in streams))
+    return order[:turns]
+
+
+def test_turns_are_shared_by_priority_weight():
+    scheduler = StreamScheduler(turn_chunks=1, turn_us=1e9)
+    order = asyncio.run(_run_streams(scheduler, [
+        ("batch", "user1", "batch"),
+        ("chat", "user2", "interactive"),
+    ], turns=90))
+
+    counts = Counter(order)
+    assert counts["chat"] == 80
+    assert counts["batch"] == 10
+
+
+def test_equal_flows_alternate():
+    scheduler = StreamScheduler(turn_chunks=1, turn_us=1e9)
+    order = asyncio.run(_run_streams(scheduler, [
+        ("a", "user1", "normal"),
+        ("b", "user2", "normal"),
+    ], turns=20))
+
+    assert Counter(order) == {"a": 10, "b": 10}
+    assert all(order[i] != order[i + 1] for i in range(len(order) - 1))
+
+
+def test_streams_of_one_flow_share_its_weight():
+    scheduler = StreamScheduler(turn_chunks=1, turn_us=1e9)
+    order = asyncio.run(_run_streams(scheduler, [
+        ("a1", "user1", "normal"),
+        ("a2", "user1", "normal"),
+        ("b", "user2", "normal"),
+    ], turns=60))
+
+    counts = Counter(order)
+    assert counts["a1"] + counts["a2"] == counts["b"] == 30
+
+
+def test_stream_yields_only_after_a_full_turn():
+    async def scenario():
+        scheduler = StreamScheduler(turn_chunks=3, turn_us=1e9)
+        ticket = scheduler.register(object(), "s1", "user1")
+        for _ in range(7):
+            await ticket.checkpoint()
+        ticket.close()
+        return ticket, scheduler
+
+    ticket, scheduler = asyncio.run(scenario())
+    assert ticket.turns == 2
+    assert ticket.turn_chunks == 1
+    assert scheduler.stats() == {"flows": 0, "parked": 0, "streams": []}
+
+
+def test_cancelled_while_parked_leaves_the_queue():
+    async def scenario():
+        scheduler = StreamScheduler(turn_chunks=1, turn_us=1e9)
+        ticket = scheduler.register(object(), "s1", "user1")
+        task = asyncio.ensure_future(ticket.checkpoint())
+        await asyncio.sleep(0)
+        assert scheduler.stats()["parked"] == 1
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        ticket.close()
+        await asyncio.sleep(0)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.stats() == {"flows": 0, "parked": 0, "streams": []}
+    assert not scheduler._dispatching
+
+
+def test_same_stream_id_from_two_owners():
+    scheduler = StreamScheduler(turn_chunks=1, turn_us=1e9)
+    first, second = object(), object()
+
+    a = scheduler.register(first, "s1", "user1")
+    b = scheduler.register(second, "s1", "user2", "batch")
+    assert scheduler.tickets == {(first, "s1"): a, (second, "s1"): b}
+
+    a.close()
+    assert scheduler.tickets == {(second, "s1"): b}
+    assert scheduler.stats()["streams"] == [
+        {"stream_id": "s1", "flow": ["user2", "batch"], "turns": 0, "waited_s": 0.0, "max_wait_s": 0.0},
+    ]
+
+    b.close()
+    assert scheduler.stats() == {"flows": 0, "parked": 0, "streams": []}
@@ -0,0 +1,157 @@
+import asyncio
+
+from client_server_stream.server.stream_cache import SharedStream, StreamCache
+
+
+class Counter:
+    """
+    Upstream of `total` integer chunks that records how many were pulled.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.pulled = 0
+        self.closed = False
+
+    async def stream(self, payload=None):
+        try:
+            for i in range(self.total):
+                self.pulled += 1
+                yield i
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+class Plugin:
+    name = "counter"
+    cache_ttl = 60
+
+    def __init__(self, total):
+        self.upstream = Counter(total)
+
+    def stream(self, payload):
+        return self.upstream.stream(payload)
+
+
+async def take(reader, n):
+    return [await reader.__anext__() for _ in range(n)]
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_upstream_waits_for_a_stalled_reader():
+    async def scenario():
+        upstream = Counter(5000)
+        shared = SharedStream(upstream.stream(), on_done=lambda s: None, readahead=8)
+        reader = shared.iterate()
+
+        # the reader takes four chunks, then stalls (out of credit)
+        got = await take(reader, 4)
+        await _settle()
+        pulled = upstream.pulled
+
+        rest = [chunk async for chunk in reader]
+        return got, pulled, rest, shared
+
+    got, pulled, rest, shared = asyncio.run(scenario())
+    assert got == [0, 1, 2, 3]
+    assert pulled <= 4 + 8 + 1
+    assert got + rest == list(range(5000))
+    assert shared.done and shared.error is None
+
+
+def test_upstream_follows_the_slowest_reader():
+    async def scenario():
+        upstream = Counter(100)
+        shared = SharedStream(upstream.stream(), on_done=lambda s: None, readahead=4)
+        fast, slow = shared.iterate(), shared.iterate()
+
+        await slow.__anext__()
+        fast_task = asyncio.ensure_future(take(fast, 3))
+        await _settle()
+        assert fast_task.done()
+
+        # fast is 3 chunks ahead of slow, the upstream only 4
+        stalled = asyncio.ensure_future(take(fast, 10))
+        await _settle()
+        pulled = upstream.pulled
+        assert not stalled.done()
+
+        async def drain(reader):
+            return [chunk async for chunk in reader]
+
+        # the upstream only finishes while both keep reading
+        slow_rest = asyncio.ensure_future(drain(slow))
+        await stalled
+        fast_rest = await drain(fast)
+        return pulled, await slow_rest, fast_rest
+
+    pulled, slow_rest, fast_rest = asyncio.run(scenario())
+    assert pulled <= 1 + 4 + 1
+    assert slow_rest == list(range(1, 100))
+    assert fast_rest == list(range(13, 100))
+
+
+def test_late_joiner_replays_from_the_first_chunk():
+    async def scenario():
+        cache = StreamCache(max_entries=4, max_bytes=1 << 20)
+        plugin = Plugin(10)
+        first = cache.stream(plugin, {"n": 1})
+        head = await take(first, 3)
+
+        joiner = cache.stream(plugin, {"n": 1})
+        joined = [chunk async for chunk in joiner]
+        tail = [chunk async for chunk in first]
+
+        replayed = [chunk async for chunk in cache.stream(plugin, {"n": 1})]
+        return head + tail, joined, replayed, plugin.upstream.pulled
+
+    first, joined, replayed, pulled = asyncio.run(scenario())
+    assert first == joined == replayed == list(range(10))
+    assert pulled == 10
+
+
+def test_stream_past_the_replay_cap_keeps_only_unread_chunks():
+    async def scenario():
+        cache = StreamCache(max_entries=4, max_bytes=1 << 20, stream_max_bytes=8)
+        plugin = Plugin(50)
+        reader = cache.stream(plugin, {"n": 1})
+        shared = cache._inflight[StreamCache.key("counter", {"n": 1})]
+
+        seen = []
+        kept = 0
+        async for chunk in reader:
+            seen.append(chunk)
+            kept = max(kept, len(shared.chunks))
+
+        # a new identical request does not join or hit the cache
+        again = cache.stream(plugin, {"n": 1})
+        await again.__anext__()
+        await again.aclose()
+        return seen, kept, shared, cache
+
+    seen, kept, shared, cache = asyncio.run(scenario())
+    assert seen == list(range(50))
+    assert not shared.replayable
+    assert kept <= shared.readahead + 8
+    assert cache.stats()["entries"] == 0
+
+
+def test_last_reader_leaving_cancels_the_upstream():
+    async def scenario():
+        upstream = Counter(1000)
+        shared = SharedStream(upstream.stream(), on_done=lambda s: None, readahead=4)
+        reader = shared.iterate()
+        await reader.__anext__()
+        await reader.aclose()
+        await _settle()
+        return upstream, shared
+
+    upstream, shared = asyncio.run(scenario())
+    assert shared.abandoned and shared.done
+    assert upstream.closed
+    assert upstream.pulled < 10
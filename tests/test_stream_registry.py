@@ -0,0 +1,124 @@
+import asyncio
+
+from client_server_stream.server.stream_registry import StreamRegistry
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.released = []
+
+    async def release(self, lease):
+        self.released.append(lease)
+
+
+class FakeRouter:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, ws, message):
+        self.sent.append((ws, message))
+
+
+async def _settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_lease_is_released_once_however_the_stream_ends():
+    async def scenario():
+        limiter = FakeLimiter()
+        registry = StreamRegistry(limiter, FakeRouter(), check_interval=0)
+        owner = object()
+
+        async def ok():
+            pass
+
+        async def fails():
+            raise RuntimeError("plugin error")
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        tasks = []
+        for stream_id, coro in (("s1", ok()), ("s2", fails()), ("s3", forever())):
+            entry = registry.add(owner, stream_id, lease=stream_id)
+            tasks.append(registry.run(entry, coro))
+        await asyncio.sleep(0)
+
+        assert registry.cancel(owner, "s3")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await _settle()
+        return limiter, registry
+
+    limiter, registry = asyncio.run(scenario())
+    assert sorted(limiter.released) == ["s1", "s2", "s3"]
+    assert registry.stats() == {"running": 0, "finished": 3, "timed_out": 0}
+    assert registry._by_owner == {}
+
+
+def test_same_stream_id_from_two_owners():
+    async def scenario():
+        limiter = FakeLimiter()
+        registry = StreamRegistry(limiter, FakeRouter(), check_interval=0)
+        first, second = object(), object()
+        done = asyncio.Event()
+
+        a = registry.add(first, "s1", lease="a")
+        b = registry.add(second, "s1", lease="b")
+        task_a = registry.run(a, done.wait())
+        registry.run(b, done.wait())
+
+        assert registry.get(first, "s1") is a
+        assert registry.get(second, "s1") is b
+        assert not registry.cancel(first, "other")
+
+        assert registry.cancel_owner(first) == 1
+        await asyncio.gather(task_a, return_exceptions=True)
+        await _settle()
+        assert registry.get(first, "s1") is None
+        assert registry.owned(second, "s1")
+
+        done.set()
+        await _settle()
+        return limiter, registry
+
+    limiter, registry = asyncio.run(scenario())
+    assert limiter.released == ["a", "b"]
+    assert registry.entries == {}
+
+
+def test_watchdog_times_out_long_and_idle_streams():
+    async def scenario():
+        router = FakeRouter()
+        registry = StreamRegistry(FakeLimiter(), router, check_interval=0)
+        owner = object()
+        never = asyncio.Event()
+
+        long = registry.add(owner, "long", lease=None)
+        long.max_duration = 5
+        idle = registry.add(owner, "idle", lease=None)
+        idle.idle_timeout = 2
+        fine = registry.add(owner, "fine", lease=None)
+        fine.max_duration = 5
+        fine.idle_timeout = 2
+        tasks = [registry.run(entry, never.wait()) for entry in (long, idle, fine)]
+
+        long.started -= 6
+        idle.last_chunk -= 3
+        fine.started -= 3
+        fine.sent(10)
+        await registry._check(fine.last_chunk + 1)
+        await asyncio.gather(*tasks[:2], return_exceptions=True)
+        await _settle()
+
+        running = [entry["stream_id"] for entry in registry.list()]
+        never.set()
+        return router, registry, running
+
+    router, registry, running = asyncio.run(scenario())
+    assert running == ["fine"]
+    assert registry.timed_out == 2
+    assert [(m["stream_id"], m["data"]["code"]) for _, m in router.sent] == [
+        ("long", "STREAM_TIMEOUT"),
+        ("idle", "STREAM_TIMEOUT"),
+    ]
@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+import pytest
+
+from client_server_stream.server.fanout import Frame
+from client_server_stream.server.subscriber import (
+    CLOSE_TRY_AGAIN_LATER,
+    OverflowPolicy,
+    SendPolicy,
+    Subscriber,
+)
+
+
+class StalledSocket:
+    """
+    Socket whose sends wait until `unblock` is set.
+    """
+
+    def __init__(self):
+        self.unblock = asyncio.Event()
+        self.received = []
+        self.closed_with = None
+
+    async def send_text(self, text):
+        await self.unblock.wait()
+        self.received.append(json.loads(text)["seq"])
+
+    async def close(self, code=None):
+        self.closed_with = code
+
+
+def frame(seq, stream_id="s1"):
+    return Frame({"stream_id": stream_id, "seq": seq})
+
+
+async def _flood(fan_out_policy, frames, **options):
+    """
+    Queue `frames` while the socket is stalled, then let it drain.
+    """
+    ws = StalledSocket()
+    sub = Subscriber(ws, send_timeout=1.0, **options)
+    accepted = [sub.enqueue(f, fan_out_policy) for f in frames]
+    queued = [f.message["seq"] for f in sub.queue]
+
+    ws.unblock.set()
+    for _ in range(20):
+        await asyncio.sleep(0)
+    return sub, ws, accepted, queued
+
+
+def test_drop_oldest_keeps_the_latest_frames():
+    sub, ws, accepted, queued = asyncio.run(
+        _flood(SendPolicy(2, OverflowPolicy.DROP_OLDEST), [frame(i) for i in range(1, 6)])
+    )
+    assert accepted == [True] * 5
+    assert queued == [4, 5]
+    assert ws.received == [4, 5]
+    assert sub.stats() == {"depth": 0, "max_depth": 2, "sent": 2, "dropped": 3}
+
+
+def test_drop_newest_keeps_the_first_frames():
+    sub, ws, accepted, queued = asyncio.run(
+        _flood(SendPolicy(2, OverflowPolicy.DROP_NEWEST), [frame(i) for i in range(1, 6)])
+    )
+    assert accepted == [True, True, False, False, False]
+    assert ws.received == [1, 2]
+    assert sub.dropped == 3
+
+
+def test_coalesce_keeps_the_latest_frame_per_stream():
+    frames = [frame(1, "a"), frame(2, "b"), frame(3, "a"), frame(4, "b"), frame(5, "c")]
+    sub, ws, accepted, queued = asyncio.run(_flood(SendPolicy(2, OverflowPolicy.COALESCE), frames))
+    # a new stream with nothing to supersede pushes out the oldest frame
+    assert queued == [4, 5]
+    assert ws.received == [4, 5]
+    assert sub.dropped == 3
+
+
+def test_disconnect_evicts_the_slow_consumer():
+    closed = []
+    sub, ws, accepted, queued = asyncio.run(_flood(
+        SendPolicy(2, OverflowPolicy.DISCONNECT),
+        [frame(i) for i in range(1, 5)],
+        on_close=closed.append,
+    ))
+    assert accepted == [True, True, False, False]
+    assert sub.closed and closed == [sub]
+    assert ws.closed_with == CLOSE_TRY_AGAIN_LATER
+    assert ws.received == []
+    assert sub.dropped == 2
+
+
+def test_subscriber_policy_overrides_the_fan_out_policy():
+    sub, ws, accepted, queued = asyncio.run(_flood(
+        SendPolicy(2, OverflowPolicy.DROP_OLDEST),
+        [frame(i) for i in range(1, 4)],
+        policy=SendPolicy(2, OverflowPolicy.DISCONNECT),
+    ))
+    assert accepted == [True, True, False]
+    assert sub.closed
+    assert ws.closed_with == CLOSE_TRY_AGAIN_LATER
+
+
+def test_send_timeout_evicts_a_stalled_socket():
+    async def scenario():
+        ws = StalledSocket()
+        sub = Subscriber(ws, send_timeout=0.02)
+        sub.enqueue(frame(1), SendPolicy(4))
+        sub.enqueue(frame(2), SendPolicy(4))
+        await asyncio.sleep(0.1)
+        return sub, ws
+
+    sub, ws = asyncio.run(scenario())
+    assert sub.closed
+    assert ws.closed_with == CLOSE_TRY_AGAIN_LATER
+    assert not sub.enqueue(frame(3), SendPolicy(4))
+
+
+def test_preload_ignores_the_bound():
+    async def scenario():
+        ws = StalledSocket()
+        sub = Subscriber(ws, send_timeout=1.0)
+        assert sub.preload([frame(i) for i in range(1, 6)]) == 5
+        assert sub.enqueue(frame(6), SendPolicy(2, OverflowPolicy.DROP_NEWEST)) is False
+        ws.unblock.set()
+        for _ in range(20):
+            await asyncio.sleep(0)
+        return ws
+
+    assert asyncio.run(scenario()).received == [1, 2, 3, 4, 5]
+
+
+def test_send_policy_validation():
+    assert SendPolicy(1, "coalesce").overflow is OverflowPolicy.COALESCE
+    with pytest.raises(ValueError):
+        SendPolicy(0)
+    with pytest.raises(ValueError):
+        SendPolicy(1, "block")
@@ -0,0 +1,80 @@
+import pytest
+
+from client_server_stream.server.topics import (
+    PatternError,
+    PatternTrie,
+    SubscriptionIndex,
+    pattern_matches,
+    validate_pattern,
+)
+
+
+def test_trie_matches_exact_and_prefix_patterns():
+    trie = PatternTrie()
+    for pattern in ("button:1", "button:*", "butt*", "*", "homepage"):
+        trie.setdefault(pattern, lambda pattern=pattern: pattern)
+
+    assert sorted(trie.match("button:1")) == ["*", "butt*", "button:*", "button:1"]
+    assert sorted(trie.match("button:12")) == ["*", "butt*", "button:*"]
+    assert sorted(trie.match("homepage")) == ["*", "homepage"]
+    assert list(trie.match(None)) == ["*"]
+    assert len(trie) == 5
+
+
+def test_trie_pop_prunes_unused_branches():
+    trie = PatternTrie()
+    trie.setdefault("ab*", list)
+    trie.setdefault("abcd*", list)
+
+    trie.pop("abcd*")
+    assert list(trie.match("abcdef")) == [[]]
+    # the "cd" branch is gone, "ab" is still needed
+    node = trie._root.children["a"].children["b"]
+    assert node.children == {}
+
+    trie.pop("ab*")
+    assert trie._root.children == {}
+    assert len(trie) == 0
+    assert trie.pop("ab*") is None
+
+
+@pytest.mark.parametrize("pattern", ["", "a*b", "**", None, 3])
+def test_invalid_patterns_are_rejected(pattern):
+    with pytest.raises(PatternError):
+        validate_pattern(pattern)
+
+
+def test_pattern_matches():
+    assert pattern_matches("button:*", "button:1")
+    assert pattern_matches("*", None)
+    assert not pattern_matches("button:1", "button:12")
+
+
+def test_index_matches_channel_and_candidate_patterns():
+    index = SubscriptionIndex()
+    a, b, c = object(), object(), object()
+    index.add(a, "button:*", "cand")
+    index.add(b, "*", "team-*")
+    index.add(c, "homepage")
+
+    assert index.match("button:1", "cand") == {a}
+    assert index.match("button:1", "team-red") == {b}
+    assert index.match("homepage", "anyone") == {c}
+    assert index.match("homepage", "team-red") == {b, c}
+
+    assert index.matches(b, "x", "team-blue")
+    assert not index.matches(a, "x", "cand")
+
+
+def test_index_add_is_idempotent_and_remove_cleans_up():
+    index = SubscriptionIndex()
+    ws = object()
+    assert index.add(ws, "button:*", "cand")
+    assert not index.add(ws, "button:*", "cand")
+    assert len(index) == 1
+
+    assert index.remove_socket(ws) == 1
+    assert len(index) == 0
+    assert index.by_socket == {}
+    assert index.match("button:1", "cand") == set()
+    assert not index.remove(ws, "button:*", "cand")
@@ -0,0 +1,161 @@
+import asyncio
+import socket
+
+import pytest
+
+from client_server_stream.client.transport import StreamError, StreamInterrupted, StreamTransport
+from fake_server import FakeServer, chunk, end, error
+
+
+def transport(url, **options):
+    return StreamTransport(url, ping_interval=None, backoff_initial=0.01, **options)
+
+
+async def collect(t, **kwargs):
+    return [item async for item in t.open_stream(channel="c", payload={}, **kwargs)]
+
+
+def test_stream_restarts_when_the_connection_drops_before_its_first_chunk():
+    async def on_message(server, conn, msg):
+        if msg["event"] != "stream.start":
+            return
+        if len(server.connections) == 1:
+            await conn.close()
+        else:
+            await conn.send(chunk(msg["stream_id"], 1))
+            await conn.send(end(msg["stream_id"]))
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            t = transport(server.url)
+            try:
+                return server, t.reconnects, await collect(t), t.reconnects
+            finally:
+                await t.close()
+
+    server, before, got, after = asyncio.run(scenario())
+    assert got == [1]
+    assert (before, after) == (0, 1)
+    first, second = server.events("stream.start")
+    assert first["stream_id"] == second["stream_id"]
+
+
+def test_restarts_are_bounded():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            await conn.close()
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            t = transport(server.url)
+            try:
+                with pytest.raises(StreamInterrupted) as e:
+                    await collect(t, restarts=2)
+                return server, e.value
+            finally:
+                await t.close()
+
+    server, interrupted = asyncio.run(scenario())
+    assert interrupted.received == 0
+    assert len(server.events("stream.start")) == 3
+
+
+def test_stream_that_delivered_chunks_is_interrupted():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            await conn.send(chunk(msg["stream_id"], 1, 2))
+            await conn.close()
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            t = transport(server.url)
+            got = []
+            try:
+                with pytest.raises(StreamInterrupted) as e:
+                    async for item in t.open_stream(channel="c", payload={}):
+                        got.append(item)
+                return server, got, e.value
+            finally:
+                await t.close()
+
+    server, got, interrupted = asyncio.run(scenario())
+    assert got == [1, 2]
+    assert interrupted.received == 2
+    # nothing was restarted
+    assert len(server.events("stream.start")) == 1
+
+
+def test_a_dropped_connection_settles_each_stream_on_its_own():
+    # both streams are running when the connection drops: the one that
+    # delivered a chunk is interrupted, the other is started again
+    async def on_message(server, conn, msg):
+        if msg["event"] != "stream.start":
+            return
+        sid = msg["stream_id"]
+        if len(server.connections) > 1:
+            await conn.send(chunk(sid, "again"))
+            await conn.send(end(sid))
+            return
+        if msg["data"]["payload"] == "chatty":
+            await conn.send(chunk(sid, "first"))
+        if len(server.events("stream.start")) == 2:
+            await asyncio.sleep(0.05)
+            await conn.close()
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            t = transport(server.url)
+
+            async def run(payload):
+                got = []
+                try:
+                    async for item in t.open_stream(channel="c", payload=payload):
+                        got.append(item)
+                except StreamInterrupted as e:
+                    got.append(e)
+                return got
+
+            try:
+                await t.connect()
+                return await asyncio.gather(run("chatty"), run("quiet"))
+            finally:
+                await t.close()
+
+    chatty, quiet = asyncio.run(scenario())
+    assert chatty[0] == "first" and isinstance(chatty[1], StreamInterrupted)
+    assert quiet == ["again"]
+
+
+def test_error_event_raises_stream_error():
+    async def on_message(server, conn, msg):
+        if msg["event"] == "stream.start":
+            await conn.send(error(msg["stream_id"], "PLUGIN_NOT_FOUND", "Unknown plugin: x"))
+
+    async def scenario():
+        async with FakeServer(on_message) as server:
+            t = transport(server.url)
+            try:
+                with pytest.raises(StreamError) as e:
+                    await collect(t)
+                return server, e.value
+            finally:
+                await t.close()
+
+    server, e = asyncio.run(scenario())
+    assert e.code == "PLUGIN_NOT_FOUND"
+    # a stream the server ended is not cancelled
+    assert server.events("stream.cancel") == []
+
+
+def test_connect_gives_up_after_max_attempts():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def scenario():
+        t = transport(f"ws://127.0.0.1:{port}/ws", max_attempts=3)
+        with pytest.raises(ConnectionError):
+            await t.connect()
+        return t
+
+    assert asyncio.run(scenario()).stats()["connected"] is False